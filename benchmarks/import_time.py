@@ -0,0 +1,102 @@
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+
+# Usage (from the parent directory of the repo):
+#   python -m IPODataAnalysis.benchmarks.import_time --output import_time.json [--compare baseline.json]
+# Each module is imported in a fresh interpreter, so that nothing is cached by an earlier import.
+
+MODULES = [
+    "IPODataAnalysis.configs",
+    "IPODataAnalysis.utils",
+    "IPODataAnalysis.metrics",
+    "IPODataAnalysis.storage",
+    "IPODataAnalysis.process_text.build_manifest",
+    "IPODataAnalysis.process_text.sqlite_store",
+    "IPODataAnalysis.process_text.search_index",
+    "IPODataAnalysis.process_text.response_cache",
+    "IPODataAnalysis.process_text.gpt_api",
+    "IPODataAnalysis.process_text.batch_runner",
+    "IPODataAnalysis.process_text.extract_info",
+    "IPODataAnalysis.process_text.q_and_a_database",
+    "IPODataAnalysis.process_text.utils",
+    "IPODataAnalysis.download_data.checkpoint",
+    "IPODataAnalysis.download_data.utils",
+    "IPODataAnalysis.download_data.downloader",
+    "IPODataAnalysis.download_data.szse_api",
+    "IPODataAnalysis.download_data.retrieve_szse_info",
+]
+HEAVY_MODULES = ["pandas", "numpy", "pyarrow", "fitz", "selenium", "bs4", "requests", "tqdm"]
+
+IMPORT_SCRIPT = """
+import time, json, sys
+start_time = time.perf_counter()
+error = None
+try:
+    import {module}
+except Exception as e:
+    error = f"{{type(e).__name__}}: {{e}}"
+seconds = time.perf_counter() - start_time
+print(json.dumps({{
+    "seconds": seconds,
+    "error": error,
+    "heavy_modules": [name for name in {heavy_modules!r} if name in sys.modules],
+}}))
+"""
+
+
+def time_import(module: str, package_parent_dir: str, repeat: int = 3):
+    """
+    Returns
+    -------
+    {
+        "seconds": float (best of repeat),
+        "error": str or None,
+        "heavy_modules": list[str] (the HEAVY_MODULES loaded by the import),
+    }
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([package_parent_dir] + [path for path in [env.get("PYTHONPATH")] if path])
+    script = IMPORT_SCRIPT.format(module=module, heavy_modules=HEAVY_MODULES)
+    results = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True)
+        lines = proc.stdout.strip().splitlines()
+        if proc.returncode != 0 or len(lines) == 0:
+            return {"seconds": float("nan"), "error": proc.stderr.strip()[-500:], "heavy_modules": []}
+        results.append(json.loads(lines[-1]))
+
+    return min(results, key=lambda result: result["seconds"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import time of each module, in fresh interpreters")
+    parser.add_argument("--output", default="import_time.json")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--compare", default=None, help="JSON of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    package_parent_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    results = {module: time_import(module, package_parent_dir, args.repeat) for module in MODULES}
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as rf:
+            baseline = json.load(rf)
+    with open(args.output, "w", encoding="utf-8") as wf:
+        json.dump(results, wf, indent=4)
+
+    for module, result in results.items():
+        line = f"{module}: {result['seconds'] * 1000:.1f} ms"
+        if baseline is not None and module in baseline:
+            line += f" (was {baseline[module]['seconds'] * 1000:.1f} ms)"
+        if result["error"] is not None:
+            line += f", error: {result['error'].splitlines()[-1] if result['error'] else ''}"
+        line += f", loads: {', '.join(result['heavy_modules'])}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import tracemalloc
+import argparse
+import platform
+import tempfile
+import random
+import shutil
+import fitz
+import json
+import time
+import sys
+import os
+
+from ..process_text.extract_info import extract_content, extract_q_and_a
+from ..process_text.q_and_a_database import construct_q_and_a_database_main, query_one_q_and_a, \
+    load_q_and_a_tables
+from ..process_text.utils import combine_pdf_from_comp_names
+from .synthetic_corpus import generate_corpus
+
+
+# Usage (from the parent directory of the repo):
+#   python -m IPODataAnalysis.benchmarks.run_benchmarks --output bench.json [--compare baseline.json]
+# Peak memory is the Python heap measured by tracemalloc; allocations made inside MuPDF aren't included, nor are
+# those of worker processes.
+
+
+def measure(func, *args, **kwargs):
+    """
+    Returns
+    -------
+    (output of func, {"seconds": float, "peak_memory_mb": float})
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start_time = time.perf_counter()
+    try:
+        out = func(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start_time
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return out, {"seconds": seconds, "peak_memory_mb": peak / 1024 ** 2}
+
+
+def __add_throughput(result: dict, num_items: int, unit: str):
+    result.update({
+        "items": num_items,
+        "unit": unit,
+        "items_per_second": num_items / result["seconds"] if result["seconds"] > 0 else float("inf"),
+    })
+
+    return result
+
+
+def bench_extract_content(filenames: list):
+    def run():
+        num_pages = 0
+        for filename in filenames:
+            doc = fitz.open(filename)
+            extract_content(doc)
+            num_pages += len(doc)
+            doc.close()
+        return num_pages
+
+    num_pages, result = measure(run)
+
+    return __add_throughput(result, num_pages, "pages")
+
+
+def bench_extract_q_and_a(filenames: list):
+    """
+    extract_content(.) runs outside the timed part, on a different fitz.Document, so that the page text cache isn't
+    warm.
+    """
+    content_results = []
+    for filename in filenames:
+        doc = fitz.open(filename)
+        content_results.append(extract_content(doc))
+        doc.close()
+
+    def run():
+        num_pages = 0
+        for filename, content_res in zip(filenames, content_results):
+            doc = fitz.open(filename)
+            extract_q_and_a(doc, content_res)
+            num_pages += len(doc)
+            doc.close()
+        return num_pages
+
+    num_pages, result = measure(run)
+
+    return __add_throughput(result, num_pages, "pages")
+
+
+def bench_construct_database(inquiry_dir: str, work_dir: str, db_format: str, num_workers: int):
+    if db_format == "sqlite":
+        q_filename = os.path.join(work_dir, "q_and_a.db")
+        a_filename = None
+    else:
+        q_filename = os.path.join(work_dir, "questions.csv")
+        a_filename = os.path.join(work_dir, "answers.csv")
+    report, result = measure(construct_q_and_a_database_main, inquiry_dir, os.path.join(work_dir, "logs", "q_and_a"),
+                             q_filename, a_filename, num_workers=num_workers)
+    result["num_workers"] = num_workers
+    result["db_format"] = db_format
+
+    return __add_throughput(result, len(report["added"]), "files"), q_filename, a_filename
+
+
+def bench_query(q_filename: str, a_filename: str, num_queries: int, seed: int = 0):
+    q_df, _ = load_q_and_a_tables(q_filename, a_filename)
+    rnd = random.Random(seed)
+    keys = q_df[["website", "comp", "round_number", "question_num"]].to_records(index=False).tolist()
+    keys = [rnd.choice(keys) for _ in range(num_queries)]
+
+    def run():
+        for key in keys:
+            query_one_q_and_a(*key, q_filename, a_filename)
+
+    _, result = measure(run)
+
+    return __add_throughput(result, num_queries, "queries")
+
+
+def bench_combine(comp_names: list, prospectus_dir: str, inquiry_comp_dir: str, work_dir: str, max_file_size_mb: float,
+                  num_workers: int):
+    output_dir = os.path.join(work_dir, "combined")
+    parts, result = measure(combine_pdf_from_comp_names, comp_names, prospectus_dir, inquiry_comp_dir, output_dir,
+                            max_file_size=max_file_size_mb, max_file_size_unit="MB", num_workers=num_workers)
+    result["num_parts"] = len(parts)
+    result["num_workers"] = num_workers
+    result = __add_throughput(result, sum([part["bytes"] for part in parts]) / 1024 ** 2, "MB")
+    result["pages_per_second"] = sum([part["pages"] for part in parts]) / result["seconds"]
+
+    return result
+
+
+def run_benchmarks(work_dir: str, num_comps: int = 10, num_rounds: int = 2, num_questions: int = 8,
+                   pages_per_question: int = 4, prospectus_pages: int = 50, num_workers: int = 1,
+                   db_format: str = "sqlite", num_queries: int = 200, max_file_size_mb: float = 20., seed: int = 0):
+    """
+    Generates a synthetic corpus in work_dir (see .synthetic_corpus.generate_corpus(.)) and times each stage on it.
+
+    Returns
+    -------
+    {
+        "config": dict (the arguments),
+        "environment": dict,
+        "corpus": {"num_files": int, "num_pages": int, "bytes": int, "seconds": float},
+        "results": {
+            name: {
+                "seconds": float,
+                "peak_memory_mb": float,
+                "items": int or float,
+                "unit": str,
+                "items_per_second": float,
+                ...
+            }...
+        },
+    }
+    """
+    config = {
+        "num_comps": num_comps,
+        "num_rounds": num_rounds,
+        "num_questions": num_questions,
+        "pages_per_question": pages_per_question,
+        "prospectus_pages": prospectus_pages,
+        "num_workers": num_workers,
+        "db_format": db_format,
+        "num_queries": num_queries,
+        "max_file_size_mb": max_file_size_mb,
+        "seed": seed,
+    }
+    start_time = time.perf_counter()
+    corpus = generate_corpus(os.path.join(work_dir, "corpus"), num_comps, num_rounds, num_questions,
+                             pages_per_question, prospectus_pages, seed=seed)
+    corpus_seconds = time.perf_counter() - start_time
+
+    results = {}
+    results["extract_content"] = bench_extract_content(corpus["letter_filenames"])
+    results["extract_q_and_a"] = bench_extract_q_and_a(corpus["letter_filenames"])
+    results["construct_q_and_a_database_main"], q_filename, a_filename = \
+        bench_construct_database(corpus["inquiry_dir"], work_dir, db_format, num_workers)
+    results["query_one_q_and_a"] = bench_query(q_filename, a_filename, num_queries, seed)
+    results["combine_pdf_from_comp_names"] = bench_combine(corpus["comp_names"], corpus["prospectus_dir"],
+                                                           corpus["inquiry_comp_dir"], work_dir, max_file_size_mb,
+                                                           num_workers)
+
+    return {
+        "config": config,
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "pymupdf": fitz.VersionBind,
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "corpus": {
+            "num_files": len(corpus["letter_filenames"]),
+            "num_pages": corpus["num_pages"],
+            "bytes": corpus["bytes"],
+            "seconds": corpus_seconds,
+        },
+        "results": results,
+    }
+
+
+def compare_results(baseline: dict, current: dict):
+    """
+    Returns
+    -------
+    {
+        name: {
+            "baseline_items_per_second": float,
+            "items_per_second": float,
+            "speedup": float (> 1: faster than the baseline),
+            "peak_memory_ratio": float (< 1: less memory than the baseline),
+        }...
+    } for the benchmarks present in both
+    """
+    out = {}
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        baseline_result = baseline["results"][name]
+        out[name] = {
+            "baseline_items_per_second": baseline_result["items_per_second"],
+            "items_per_second": result["items_per_second"],
+            "speedup": result["items_per_second"] / baseline_result["items_per_second"],
+            "peak_memory_ratio": result["peak_memory_mb"] / baseline_result["peak_memory_mb"]
+            if baseline_result["peak_memory_mb"] > 0 else float("nan"),
+        }
+
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of extraction, the Q&A DB, querying and bundling on a "
+                                                 "synthetic corpus")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    parser.add_argument("--work-dir", default=None, help="Where the corpus and outputs go (default: a temp dir, "
+                                                         "removed afterwards)")
+    parser.add_argument("--num-comps", type=int, default=10)
+    parser.add_argument("--num-rounds", type=int, default=2)
+    parser.add_argument("--num-questions", type=int, default=8)
+    parser.add_argument("--pages-per-question", type=int, default=4)
+    parser.add_argument("--prospectus-pages", type=int, default=50)
+    parser.add_argument("--num-workers", type=int, default=1)
+    parser.add_argument("--db-format", choices=["sqlite", "csv"], default="sqlite")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--max-file-size-mb", type=float, default=20.)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", default=None, help="JSON of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix="ipo_bench_")
+    try:
+        out = run_benchmarks(work_dir, args.num_comps, args.num_rounds, args.num_questions, args.pages_per_question,
+                             args.prospectus_pages, args.num_workers, args.db_format, args.num_queries,
+                             args.max_file_size_mb, args.seed)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as rf:
+            out["comparison"] = compare_results(json.load(rf), out)
+    with open(args.output, "w", encoding="utf-8") as wf:
+        json.dump(out, wf, ensure_ascii=False, indent=4)
+
+    for name, result in out["results"].items():
+        line = f"{name}: {result['seconds']:.3f}s, {result['items_per_second']:.1f} {result['unit']}/s, " \
+               f"peak {result['peak_memory_mb']:.1f} MB"
+        if name in out.get("comparison", {}):
+            line += f", speedup x{out['comparison'][name]['speedup']:.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import fitz
+import random
+import os
+
+
+# Synthetic reply letters with the layout extract_info expects: a cover page, a 目录 table whose entries link to the
+# question pages, then per question its text, a 回复： marker and 一、/（一） subtitles. Prospectuses are filler pages,
+# named like the downloaded ones (招股说明书_%Y-%m-%d.pdf) so that the bundler picks them up.
+
+ZH_DIGITS = "零一二三四五六七八九"
+TOPICS = ["收入确认", "毛利率", "关联交易", "应收账款", "存货跌价", "研发费用", "客户集中度", "供应商", "股份支付",
+          "募投项目", "核心技术", "行业竞争", "资金流水", "内部控制", "业绩下滑", "商誉减值"]
+FILLER = ["请发行人说明报告期内相关情况及变动原因", "结合同行业可比公司情况分析差异的合理性", "请保荐人发表明确核查意见",
+          "报告期各期发行人营业收入分别为若干万元", "发行人已在招股说明书中补充披露", "经核查保荐人认为相关情况真实准确",
+          "主要系下游客户需求增长所致", "相关会计处理符合企业会计准则的规定", "公司与主要客户保持长期稳定的合作关系"]
+FONT_NAME = "china-s"
+FONT_SIZE = 10
+LINE_HEIGHT = 14
+LINES_PER_PAGE = 48
+TOC_LINES_PER_PAGE = 30
+
+
+def to_zh_number(num: int):
+    """
+    1 <= num <= 99, e.g. 12 -> 十二
+    """
+    tens, ones = divmod(num, 10)
+    out = "" if tens == 0 else ("十" if tens == 1 else f"{ZH_DIGITS[tens]}十")
+
+    return out + (ZH_DIGITS[ones] if ones > 0 else "")
+
+
+def __write_lines(page: fitz.Page, lines: list):
+    """
+    Line i has its baseline at y = 56 + i * LINE_HEIGHT. One call per page: the font is set up once per call.
+    """
+    page.insert_text((56, 56), "\n".join(lines), fontname=FONT_NAME, fontsize=FONT_SIZE,
+                     lineheight=LINE_HEIGHT / FONT_SIZE)
+
+
+def __make_question_pages(rnd: random.Random, question_idx: int, num_pages: int):
+    """
+    Returns
+    -------
+    list[list[str]]: lines of each page of the question
+    """
+    topic = TOPICS[question_idx % len(TOPICS)]
+    question_lines = [f"{to_zh_number(question_idx + 1)}、关于{topic}"]
+    question_lines += [rnd.choice(FILLER) for _ in range(rnd.randint(3, 12))]
+    # The reply starts on the first page, or on the second one for long questions
+    reply_page = 1 if num_pages > 1 and rnd.random() < .2 else 0
+    lines = [[] for _ in range(num_pages)]
+    lines[0] += question_lines
+    if reply_page == 1:
+        lines[1] += [rnd.choice(FILLER) for _ in range(rnd.randint(1, 5))]
+    lines[reply_page].append(rnd.choice(["回复：", "【回复】", "回复"]))
+
+    sub_idx = 0
+    for page_lines in lines[reply_page:]:
+        while len(page_lines) < LINES_PER_PAGE - 6:
+            sub_idx += 1
+            if rnd.random() < .5:
+                page_lines.append(f"（{to_zh_number(sub_idx)}）{topic}的说明")
+            else:
+                page_lines.append(f"{sub_idx}、{rnd.choice(FILLER)}")
+            page_lines += [rnd.choice(FILLER) for _ in range(rnd.randint(2, 6))]
+
+    return lines
+
+
+def make_reply_letter(filename: str, num_questions: int = 8, pages_per_question: int = 4, seed: int = 0):
+    """
+    Returns
+    -------
+    {
+        "pages": int,
+        "bytes": int,
+        "num_questions": int,
+    }
+    """
+    rnd = random.Random(seed)
+    question_pages = [__make_question_pages(rnd, i, max(1, pages_per_question + rnd.randint(-1, 1)))
+                      for i in range(num_questions)]
+
+    doc = fitz.open()
+    __write_lines(doc.new_page(), ["关于首次公开发行股票并在创业板上市申请文件的审核问询函的回复"])
+    num_toc_pages = (num_questions + TOC_LINES_PER_PAGE - 1) // TOC_LINES_PER_PAGE
+    for _ in range(num_toc_pages):
+        doc.new_page()
+
+    toc_entries = []
+    for pages in question_pages:
+        toc_entries.append((pages[0][0], len(doc)))
+        for lines in pages:
+            __write_lines(doc.new_page(), lines)
+
+    for toc_idx in range(num_toc_pages):
+        # Written once the target pages exist; page objects created before them are stale by now
+        toc_page = doc[1 + toc_idx]
+        entries = toc_entries[toc_idx * TOC_LINES_PER_PAGE:(toc_idx + 1) * TOC_LINES_PER_PAGE]
+        lines = ["目录"] if toc_idx == 0 else []
+        offset = len(lines)
+        lines += [f"{title}{'.' * 20}{target_page + 1}" for title, target_page in entries]
+        __write_lines(toc_page, lines)
+        for i, (_, target_page) in enumerate(entries):
+            y = 56 + (offset + i) * LINE_HEIGHT
+            toc_page.insert_link({
+                "kind": fitz.LINK_GOTO,
+                "from": fitz.Rect(56, y - LINE_HEIGHT + 3, 500, y + 3),
+                "page": target_page,
+                "to": fitz.Point(0, 0),
+            })
+
+    dir_name = os.path.dirname(filename)
+    if len(dir_name) > 0 and not os.path.isdir(dir_name):
+        os.makedirs(dir_name)
+    num_pages = len(doc)
+    doc.save(filename, garbage=3, deflate=True)
+    doc.close()
+
+    return {
+        "pages": num_pages,
+        "bytes": os.path.getsize(filename),
+        "num_questions": num_questions,
+    }
+
+
+def make_prospectus(filename: str, num_pages: int = 50, seed: int = 0):
+    """
+    Returns
+    -------
+    {
+        "pages": int,
+        "bytes": int,
+    }
+    """
+    rnd = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(num_pages):
+        __write_lines(doc.new_page(), [rnd.choice(FILLER) for _ in range(LINES_PER_PAGE)])
+
+    dir_name = os.path.dirname(filename)
+    if len(dir_name) > 0 and not os.path.isdir(dir_name):
+        os.makedirs(dir_name)
+    doc.save(filename, garbage=3, deflate=True)
+    doc.close()
+
+    return {
+        "pages": num_pages,
+        "bytes": os.path.getsize(filename),
+    }
+
+
+def generate_corpus(root_dir: str, num_comps: int = 10, num_rounds: int = 2, num_questions: int = 8,
+                    pages_per_question: int = 4, prospectus_pages: int = 50, website: str = "szse", seed: int = 0):
+    """
+    File system (the same as the downloads):
+    $root_dir
+        - ipo_doc
+            - $website
+                - comp
+                    - 关于comp审核问询函的回复.pdf, 关于comp第二轮审核问询函的回复.pdf...
+        - prospectus
+            - comp
+                - 招股说明书_2024-01-01.pdf
+
+    Returns
+    -------
+    {
+        "inquiry_dir": str (pass to .process_text.q_and_a_database.construct_q_and_a_database_main(.)),
+        "inquiry_comp_dir": str (pass to .process_text.utils.combine_pdf_from_comp_names(.)),
+        "prospectus_dir": str,
+        "comp_names": list[str],
+        "letter_filenames": list[str],
+        "num_pages": int (reply letters only),
+        "bytes": int (reply letters only),
+    }
+    """
+    inquiry_dir = os.path.join(root_dir, "ipo_doc")
+    prospectus_dir = os.path.join(root_dir, "prospectus")
+    comp_names = [f"测试公司{i:04d}" for i in range(num_comps)]
+    letter_filenames = []
+    num_pages = 0
+    num_bytes = 0
+    for comp_idx, comp_name in enumerate(comp_names):
+        for round_idx in range(num_rounds):
+            round_str = "" if round_idx == 0 else f"第{to_zh_number(round_idx + 1)}轮"
+            filename = os.path.join(inquiry_dir, website, comp_name, f"关于{comp_name}{round_str}审核问询函的回复.pdf")
+            letter_info = make_reply_letter(filename, num_questions, pages_per_question,
+                                            seed=seed * 100003 + comp_idx * 101 + round_idx)
+            letter_filenames.append(filename)
+            num_pages += letter_info["pages"]
+            num_bytes += letter_info["bytes"]
+        make_prospectus(os.path.join(prospectus_dir, comp_name, "招股说明书_2024-01-01.pdf"), prospectus_pages,
+                        seed=seed * 100003 + comp_idx)
+
+    return {
+        "inquiry_dir": inquiry_dir,
+        "inquiry_comp_dir": os.path.join(inquiry_dir, website),
+        "prospectus_dir": prospectus_dir,
+        "comp_names": comp_names,
+        "letter_filenames": letter_filenames,
+        "num_pages": num_pages,
+        "bytes": num_bytes,
+    }
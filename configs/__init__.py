@@ -1,3 +1,7 @@
+import json
+import os
+
+
 PATTERNS = {
     "content": r"目录[ ]*\n",
     "content_entry": r".*[一二三四五六七八九十0-9]+.*[\n ]*\.{2,}",
@@ -5,4 +9,111 @@ PATTERNS = {
     "subtitle": r"[A-Za-z0-9一二三四五六七八九十]{1,2}、[^\n]*\n|[(（]+[A-Za-z0-9一二三四五六七八九十]{1,2}[)）]+[^\n]*\n",
 }
 
-CHROME_EXECUTABLE_PATH = r"F:\chromedriver-win64\chromedriver.exe"
+# Machine-specific settings, resolved on first use (see get_config(.)) rather than at import time. Each one is read
+# from the environment variable IPO_{NAME}, else from the JSON config file, else falls back to the default here.
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "configs")
+CONFIG_FILENAME_ENV = "IPO_CONFIG_FILE"
+LAZY_CONFIG_DEFAULTS = {
+    "CHROME_EXECUTABLE_PATH": r"F:\chromedriver-win64\chromedriver.exe",
+    "API_KEYS_FILENAME": os.path.join(CONFIG_DIR, "api_keys.json"),
+}
+__CONFIG_FILE_CACHE = {}
+
+
+def load_config_file(config_filename: str = None):
+    """
+    config_filename: default $IPO_CONFIG_FILE, else data/configs/config.json in the repo; a missing file is an empty
+        config. Read once per process.
+    """
+    if config_filename is None:
+        config_filename = os.environ.get(CONFIG_FILENAME_ENV, os.path.join(CONFIG_DIR, "config.json"))
+    if config_filename not in __CONFIG_FILE_CACHE:
+        config = {}
+        if os.path.isfile(config_filename):
+            with open(config_filename, "r", encoding="utf-8") as rf:
+                config = json.load(rf)
+        __CONFIG_FILE_CACHE[config_filename] = config
+
+    return __CONFIG_FILE_CACHE[config_filename]
+
+
+def get_config(name: str, default=None):
+    """
+    name: e.g. "CHROME_EXECUTABLE_PATH"; looked up in $IPO_CHROME_EXECUTABLE_PATH, then the key
+        "CHROME_EXECUTABLE_PATH" of the config file, then default (or LAZY_CONFIG_DEFAULTS)
+    """
+    value = os.environ.get(f"IPO_{name}")
+    if value is not None:
+        return value
+    config = load_config_file()
+    if name in config:
+        return config[name]
+
+    return LAZY_CONFIG_DEFAULTS.get(name) if default is None else default
+
+
+def __getattr__(name: str):
+    # e.g. `from IPODataAnalysis.configs import CHROME_EXECUTABLE_PATH` keeps working, resolved at that point
+    if name in LAZY_CONFIG_DEFAULTS:
+        return get_config(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# First page of the SZSE IPO project list (see download_data/retrieve_szse_info.retrieve_index_table(.))
+SZSE_INDEX_URL = "https://listing.szse.cn/projectdynamic/ipo/index.html"
+# JSON endpoints called by the SZSE project dynamic pages (see download_data/szse_api.py)
+SZSE_API_URL = "http://listing.szse.cn/api/ras/projectrends"
+# {project_list}: the project list of the index page, e.g. "ipo" for .../projectdynamic/ipo/index.html
+SZSE_DETAIL_PAGE_URL = "http://listing.szse.cn/projectdynamic/{project_list}/detail/index.html?id={project_id}"
+# Project list: bizType of its query
+SZSE_BIZ_TYPES = {
+    "ipo": 1,
+    "refinance": 2,
+    "mna": 3,
+}
+SZSE_DOC_BASE_URL = "http://reportdocs.static.szse.cn"
+# Column of the HTML tables: field of the JSON records
+SZSE_INDEX_FIELDS = {
+    "发行人全称": "cmpnm",
+    "审核状态": "prjst",
+    "注册地": "regloc",
+    "证监会行业": "csrcind",
+    "保荐机构": "sprinst",
+    "律师事务所": "lawfm",
+    "会计师事务所": "acctfm",
+    "更新日期": "updtdt",
+    "受理日期": "acptdt",
+}
+SZSE_PROJECT_INFO_FIELDS = {
+    "公司全称": "cmpnm",
+    "公司简称": "cmpsnm",
+    "受理日期": "acptdt",
+    "审核状态": "prjst",
+    "更新日期": "updtdt",
+    "融资金额(亿元)": "maramt",
+    "保荐机构": "sprinst",
+    "会计师事务所": "acctfm",
+    "律师事务所": "lawfm",
+    "评估机构": "evalinst",
+    "证监会行业": "csrcind",
+}
+# Stage of the timeline: field holding its date
+SZSE_TIMELINE_FIELDS = {
+    "受理": "acptdt",
+    "问询": "enqdt",
+    "上市委会议": "lstcmtdt",
+    "提交注册": "regsubdt",
+    "注册结果": "regrsltdt",
+}
+SZSE_INQUIRY_FIELDS = {
+    "list": "enquiryResponseAttachment",
+    "title": "dfnm",
+    "path": "dfpth",
+    "date": "ddt",
+}
+SZSE_DISCLOSURE_FIELDS = {
+    "list": "disclosureMaterials",
+    "title": "dfnm",
+    "path": "dfpth",
+    "date": "ddt",
+}
@@ -0,0 +1,69 @@
+import pandas as pd
+import glob
+import json
+import os
+
+
+def df_to_record(key: str, df: pd.DataFrame):
+    """
+    Returns
+    -------
+    {
+        "key": str,
+        "rows": list[dict],
+        "datetime_columns": list[str] (restored as datetime by records_to_df(.)),
+    }
+    """
+    datetime_columns = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
+    rows = json.loads(df.to_json(orient="records", date_format="iso", force_ascii=False))
+
+    return {"key": key, "rows": rows, "datetime_columns": datetime_columns}
+
+
+def records_to_df(records: list):
+    """
+    Returns
+    -------
+    DataFrame: the rows of all the records, empty if there are none
+    """
+    if len(records) == 0:
+        return pd.DataFrame()
+    dfs = []
+    for record in records:
+        df = pd.DataFrame(record["rows"])
+        for col in record["datetime_columns"]:
+            df[col] = pd.to_datetime(df[col]).dt.tz_localize(None)
+        dfs.append(df)
+
+    return pd.concat(dfs, axis=0)
+
+
+def write_shard(checkpoint_dir: str, records: list):
+    """
+    Writes the records (output of df_to_record(.)) as the next JSONL shard; the shard only appears once complete.
+    """
+    if len(records) == 0:
+        return
+    if not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+    shard_idx = len(glob.glob(os.path.join(checkpoint_dir, "shard_*.jsonl")))
+    shard_filename = os.path.join(checkpoint_dir, f"shard_{shard_idx:05d}.jsonl")
+    temp_filename = f"{shard_filename}.tmp"
+    with open(temp_filename, "w", encoding="utf-8") as wf:
+        for record in records:
+            wf.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(temp_filename, shard_filename)
+
+
+def load_shards(checkpoint_dir: str):
+    """
+    Returns
+    -------
+    list[dict]: records of all the shards, in writing order
+    """
+    records = []
+    for shard_filename in sorted(glob.glob(os.path.join(checkpoint_dir, "shard_*.jsonl"))):
+        with open(shard_filename, "r", encoding="utf-8") as rf:
+            records += [json.loads(line) for line in rf if len(line.strip()) > 0]
+
+    return records
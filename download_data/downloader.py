@@ -0,0 +1,160 @@
+import requests
+import threading
+import random
+import time
+import os
+
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from .utils import download_and_save_file, TruncatedDownloadError
+
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class BulkDownloader(object):
+    """
+    Downloads many files over a pooled session with a thread pool, at most max_per_host concurrent requests per host.
+    Each file is streamed to a .part file and renamed when complete (see .utils.download_and_save_file(.)); failed
+    attempts are retried with exponential backoff and resumed with a Range request.
+    """
+    def __init__(self, max_workers=8, max_per_host=4, max_retries=3, backoff=1., resume=True, timeout=60,
+                 chunk_size=1 << 16):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.resume = resume
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.host_semaphores = {}
+        self.lock = threading.Lock()
+
+    def get_host_semaphore(self, url: str):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+
+            return self.host_semaphores[host]
+
+    @staticmethod
+    def is_retriable(e: Exception):
+        if isinstance(e, requests.HTTPError):
+            return e.response is not None and e.response.status_code in RETRY_STATUS_CODES
+
+        return isinstance(e, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                              TruncatedDownloadError))
+
+    def download(self, url: str, save_filename: str):
+        """
+        Returns
+        -------
+        {
+            "url": str,
+            "filename": str,
+            "status": str ("downloaded", "skipped" or "failed"),
+            "bytes": int,
+            "attempts": int,
+            "error": str (only if failed),
+        }
+        """
+        out_dict = {"url": url, "filename": save_filename, "status": "downloaded", "bytes": 0, "attempts": 0}
+        if os.path.isfile(save_filename):
+            out_dict["status"] = "skipped"
+            return out_dict
+
+        semaphore = self.get_host_semaphore(url)
+        for attempt in range(self.max_retries + 1):
+            out_dict["attempts"] = attempt + 1
+            try:
+                with semaphore:
+                    out_dict["bytes"] = download_and_save_file(url, save_filename, self.session, self.resume,
+                                                               self.chunk_size, self.timeout)
+                return out_dict
+            except Exception as e:
+                if attempt == self.max_retries or not self.is_retriable(e):
+                    out_dict["status"] = "failed"
+                    out_dict["error"] = str(e)
+                    return out_dict
+                time.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+
+    def download_all(self, items: list):
+        """
+        items: [(url, save_filename)...]
+
+        Returns
+        -------
+        (list[dict], dict): output of .download(.) for each item (in order), and
+            {
+                "num_downloaded": int,
+                "num_skipped": int,
+                "num_failed": int,
+                "bytes": int,
+                "seconds": float,
+                "bytes_per_second": float,
+            }
+        """
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda item: self.download(*item), items))
+        seconds = time.perf_counter() - start_time
+
+        num_bytes = sum([result["bytes"] for result in results])
+        stats = {
+            f"num_{status}": sum([result["status"] == status for result in results])
+            for status in ["downloaded", "skipped", "failed"]
+        }
+        stats.update({
+            "bytes": num_bytes,
+            "seconds": seconds,
+            "bytes_per_second": num_bytes / seconds if seconds > 0 else 0.,
+        })
+
+        return results, stats
+
+    def close(self):
+        self.session.close()
+
+
+class DownloadError(IOError):
+    pass
+
+
+__WORKER_DOWNLOADER = None
+
+
+def get_worker_downloader() -> BulkDownloader:
+    """
+    One BulkDownloader per process, created on first use (i.e. in the worker, after the fork).
+    """
+    global __WORKER_DOWNLOADER
+    if __WORKER_DOWNLOADER is None:
+        __WORKER_DOWNLOADER = BulkDownloader()
+
+    return __WORKER_DOWNLOADER
+
+
+def download_files(items: list, downloader: BulkDownloader = None):
+    """
+    items: [(url, save_filename)...], downloaded concurrently
+    downloader: by default the process's, see get_worker_downloader(.)
+
+    Returns
+    -------
+    list[dict]: output of BulkDownloader.download(.) for each item; DownloadError is raised if any failed
+    """
+    if downloader is None:
+        downloader = get_worker_downloader()
+    results, _ = downloader.download_all(items)
+    failed = [result for result in results if result["status"] == "failed"]
+    if len(failed) > 0:
+        raise DownloadError("; ".join([f"{result['url']}: {result['error']}" for result in failed]))
+
+    return results
@@ -0,0 +1,255 @@
+import importlib.util
+import pandas as pd
+import re
+
+from bs4 import BeautifulSoup
+from urllib.parse import urljoin
+from collections import defaultdict
+
+
+# Offline parsing of the SZSE pages: the browser captures a page once (driver.page_source) and everything below is
+# CPU-only, so no WebDriver round trip is spent per element. Each parse_* function takes the HTML or an already
+# parsed soup (see make_soup(.)), and returns what its Selenium counterpart in .retrieve_szse_info used to.
+# Matching follows the XPath it replaces: contains(text(), s) looks at the first text node of an element, and hrefs
+# are resolved against the page URL like WebElement.get_attribute("href").
+
+HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") is not None else "html.parser"
+
+
+def make_soup(page_source: str) -> BeautifulSoup:
+    return BeautifulSoup(page_source, HTML_PARSER)
+
+
+def __to_soup(page):
+    return page if isinstance(page, BeautifulSoup) else make_soup(page)
+
+
+def __select_one(soup, selector: str):
+    tag = soup.select_one(selector)
+    if tag is None:
+        raise ValueError(f"No element matches {selector}")
+
+    return tag
+
+
+def get_tag_text(tag):
+    """
+    Text of the element with runs of whitespace collapsed, close to WebElement.text
+    """
+    return re.sub(r"\s+", " ", tag.get_text()).strip()
+
+
+def __first_text(tag):
+    text_node = tag.find(string=True, recursive=False)
+
+    return "" if text_node is None else str(text_node)
+
+
+def __find_by_first_text(soup, tag_name: str, text: str):
+    """
+    First tag_name element in document order matching //tag_name[contains(text(), text)]
+    """
+    return soup.find(lambda tag: tag.name == tag_name and text in __first_text(tag))
+
+
+def __resolve_href(anchor, base_url: str = None):
+    href = anchor.get("href")
+    if href is None or base_url is None:
+        return href
+
+    return urljoin(base_url, href)
+
+
+def parse_html_table(table_tag):
+    """
+    Header from the th cells (of the thead, else of the first row), one row per tr with td cells. Empty cells are NaN
+    and columns whose cells are all numbers are converted, as pd.read_html(.) does.
+    """
+    header_row = table_tag.select_one("thead tr") or table_tag.find("tr")
+    columns = [get_tag_text(cell) for cell in header_row.find_all("th")] if header_row is not None else []
+    rows = []
+    for row in table_tag.find_all("tr"):
+        cells = row.find_all("td")
+        if len(cells) == 0:
+            continue
+        values = [get_tag_text(cell) or None for cell in cells]
+        if len(columns) > 0:
+            values = (values + [None] * len(columns))[:len(columns)]
+        rows.append(values)
+    if len(columns) == 0:
+        columns = list(range(max([len(row) for row in rows], default=0)))
+        rows = [(row + [None] * len(columns))[:len(columns)] for row in rows]
+
+    data_df = pd.DataFrame(rows, columns=columns)
+    for col in data_df.columns:
+        try:
+            data_df[col] = pd.to_numeric(data_df[col])
+        except (ValueError, TypeError):
+            pass
+
+    return data_df
+
+
+##### Index Page #####
+
+
+def parse_total_pages(page):
+    """
+    Number of pages of the index table, from div.current-page (e.g. "共12页")
+    """
+    div_total_pages = __select_one(__to_soup(page), "div.current-page")
+    matches = re.findall(r"共[0-9]+页", get_tag_text(div_total_pages))
+
+    return int(matches[0][1:-1])
+
+
+def parse_index_table(page, base_url: str = None, if_retrieve_link: bool = True):
+    """
+    page: the page or just the table.reg-table element's HTML
+
+    Returns
+    -------
+    DataFrame: the table, with the link of each issuer in "detail_page" if if_retrieve_link (None if there is none)
+    """
+    soup = __to_soup(page)
+    table_tag = soup.select_one("table.reg-table") or __select_one(soup, "table")
+    table_df = parse_html_table(table_tag)
+
+    if if_retrieve_link:
+        anchors = [(__first_text(anchor), __resolve_href(anchor, base_url)) for anchor in table_tag.find_all("a")]
+        exact_links = {}
+        for text, link in anchors:
+            exact_links.setdefault(text.strip(), link)
+
+        def find_link(comp_name: str):
+            # One dict lookup per row; the substring scan (the former XPath) only for names not matched exactly
+            if comp_name in exact_links:
+                return exact_links[comp_name]
+            for text, link in anchors:
+                if comp_name in text:
+                    return link
+            return None
+
+        table_df["detail_page"] = table_df["发行人全称"].apply(find_link)
+
+    return table_df
+
+
+##### Detail Page #####
+
+
+def parse_timeline(page):
+    data_dict = defaultdict(list)
+    ul_tag = __select_one(__to_soup(page), "ul.project-dy-flow-con")
+    for li_tag in ul_tag.find_all("li"):
+        title_iter = get_tag_text(__select_one(li_tag, "span.title"))
+        date_iter = pd.to_datetime(get_tag_text(__select_one(li_tag, "span.date")))
+        data_dict[title_iter].append(date_iter)
+
+    data_df = pd.DataFrame(data_dict)
+
+    return data_df
+
+
+def parse_project_info(page):
+    data_dict = defaultdict(list)
+    table_tag = __select_one(__to_soup(page), "div.base-info.project-base-info")
+    for table_row in table_tag.find_all("tr"):
+        index_tag_all = table_row.select("td.title")
+        info_tag_all = table_row.select("td.info")
+        for index_tag, info_tag in zip(index_tag_all, info_tag_all):
+            data_dict[get_tag_text(index_tag)].append(get_tag_text(info_tag))
+
+    data_df = pd.DataFrame(data_dict)
+
+    return data_df
+
+
+def select_inquiry_reply_titles(data_df: pd.DataFrame):
+    """
+    data_df: the table of inquiries and replies with columns "内容" (title) and "更新日期"
+
+    Returns
+    -------
+    list[str]: titles of the latest first-round and second-round replies of the issuer and the sponsor
+    """
+    def find_broker_rows(title: str, key_word: str = None):
+        """
+        key_word: e.g. first round or second round
+        """
+        name_pattern = re.compile(r"[\u4e00-\u9fff]{2}函")
+        if "发行人" in title and "保荐机构" in title and "回复" in title and ".pdf" in title:
+            name_matches = re.findall(name_pattern, title)
+            if len(name_matches) > 0 and name_matches[0] != "问询函":
+                return False
+            if key_word is None:
+                return True
+            if key_word in title:
+                return True
+
+        return False
+
+    broker_mask = data_df["内容"].apply(find_broker_rows)
+    broker_df = data_df[broker_mask]
+    second_round_mask = broker_df["内容"].str.contains("第二轮")
+    second_round_df = broker_df[second_round_mask].sort_values("更新日期", ascending=False)
+    first_round_df = broker_df[~second_round_mask].sort_values("更新日期", ascending=False)
+
+    titles = []
+    for df_iter in [first_round_df, second_round_df]:
+        if len(df_iter) == 0:
+            continue
+        titles.append(df_iter["内容"].iloc[0])
+
+    return titles
+
+
+def parse_inquiries_and_replies(page, base_url: str = None):
+    """
+    Handles:
+    - No table
+    - No link in the row, i.e a <span> instead of an <a>
+    - Can't find first and / or second round inquiry letter
+
+    Returns
+    -------
+    dict:
+        filename: url
+    """
+    soup = __to_soup(page)
+    title_div = __find_by_first_text(soup, "div", "问询与回复")
+    div_tag = None if title_div is None else title_div.find_next_sibling("div")
+    table_tag = None if div_tag is None else div_tag.select_one("table.info-disc-table")
+    if table_tag is None:
+        return {}
+    data_df = parse_html_table(table_tag)
+    if len(data_df) == 0 or "内容" not in data_df.columns:
+        return {}
+    data_df["内容"] = data_df["内容"].fillna("").astype(str)
+
+    out_dict = {}
+    for title_iter in select_inquiry_reply_titles(data_df):
+        anchor = __find_by_first_text(soup, "a", title_iter)
+        out_dict[title_iter] = None if anchor is None else __resolve_href(anchor, base_url)
+
+    return out_dict
+
+
+def parse_latest_prospectus(page, base_url: str = None):
+    """
+    Returns
+    -------
+    (str, str): date (the anchor's text) and url of the latest prospectus
+    """
+    soup = __to_soup(page)
+    title_td = __find_by_first_text(soup, "td", "招股说明书")
+    tgt_td = None if title_td is None else title_td.find_next_sibling("td")
+    if tgt_td is None:
+        raise ValueError("No prospectus on the page")
+    all_anchors = [anchor for anchor in tgt_td.find_all("a") if anchor.get("href") is not None]
+    if len(all_anchors) == 0:
+        raise ValueError("No prospectus link on the page")
+    all_anchors.sort(key=lambda anchor: pd.to_datetime(get_tag_text(anchor)), reverse=True)
+    tgt_anchor = all_anchors[0]
+
+    return get_tag_text(tgt_anchor), __resolve_href(tgt_anchor, base_url)
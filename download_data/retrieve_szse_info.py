@@ -1,26 +1,26 @@
-import numpy as np
 import pandas as pd
-import requests
-import re
-import datetime as dt
 import logging
 import time
 import os
 
-from multiprocessing import Pool, Manager
-from bs4 import BeautifulSoup
+from multiprocessing import Pool
 from selenium import webdriver
 from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.common.exceptions import NoSuchElementException
-from collections import defaultdict
 
 from ..global_configs import ROOT_DIR
 from ..utils import make_directories
-from IPODataAnalysis.configs import CHROME_EXECUTABLE_PATH
-from .utils import download_and_save_file, init_driver
+from ..storage import save_table, load_table
+from ..metrics import timed, dump_summary
+from .utils import create_driver, init_worker_driver, get_worker_driver
+from .downloader import BulkDownloader, download_files
+from .page_parser import make_soup, parse_total_pages, parse_index_table, parse_timeline, parse_project_info, \
+    parse_inquiries_and_replies, parse_latest_prospectus, select_inquiry_reply_titles
+from .checkpoint import df_to_record, records_to_df, write_shard, load_shards
+from .szse_api import retrieve_index_table_http, retrieve_detail_page_http, resolve_latest_prospectus_http, \
+    get_worker_session
 
 
 ##### Index Page (e.g. IPO) #####
@@ -31,35 +31,28 @@ def is_table_ready(driver):
 
 
 def retrieve_table(html_ele: WebElement, if_retrieve_link=True):
+    """
+    html_ele: the driver or an element containing table.reg-table; the table is captured once and parsed offline
+    (see .page_parser.parse_index_table(.))
+    """
     table_ele = html_ele.find_element(By.CSS_SELECTOR, "table.reg-table")
     time.sleep(0.5)  # Prevent Stale Element Reference Exception
     table_html = table_ele.get_attribute("outerHTML")
-    table_df = pd.read_html(table_html)[0]
-
-    def find_link(comp_name: str):
-        xpath = f"//a[contains(text(), '{comp_name}')]"
-        anchor_ele = table_ele.find_element(By.XPATH, xpath)
-        link = anchor_ele.get_attribute("href")
-
-        return link
-
+    base_url = None
     if if_retrieve_link:
-        table_df["detail_page"] = table_df["发行人全称"].apply(find_link)
+        driver = html_ele.parent if isinstance(html_ele, WebElement) else html_ele
+        base_url = driver.current_url
 
-    return table_df
+    return parse_index_table(table_html, base_url, if_retrieve_link)
 
 
-def retrieve_index_table(index_begin_url: str, wait_ready=30, save_dir=None):
-    driver = webdriver.Chrome(service=ChromeService(executable_path=CHROME_EXECUTABLE_PATH))
+def __retrieve_index_table(driver: webdriver.Chrome, index_begin_url: str, wait_ready=30):
     driver.get(index_begin_url)
     # WebDriverWait(driver, wait_ready).until(
     #     lambda driver: driver.execute_script("return document.readyState") == "complete"
     # )
     WebDriverWait(driver, wait_ready).until(is_table_ready)
-    div_total_pages = driver.find_element(By.CSS_SELECTOR, "div.current-page")
-    total_page_pattern = r"共[0-9]+页"
-    matches = re.findall(total_page_pattern, div_total_pages.text)
-    num_total_pages = int(matches[0][1:-1])
+    num_total_pages = parse_total_pages(driver.page_source)
 
     table_dfs = [retrieve_table(driver)]
     for page_idx in range(num_total_pages - 1):
@@ -75,10 +68,35 @@ def retrieve_index_table(index_begin_url: str, wait_ready=30, save_dir=None):
 
     table_df_out = pd.concat(table_dfs, axis=0)
 
+    return table_df_out
+
+
+def retrieve_index_table(index_begin_url: str, wait_ready=30, save_dir=None, headless=False, use_http=False,
+                         file_format="csv", logger: logging.Logger = None):
+    """
+    use_http: try .szse_api.retrieve_index_table_http(.) (for the project list of index_begin_url) first and fall back
+        to the browser if it fails
+    file_format: "csv" or "parquet" (with a CSV copy) for $save_dir/index_page.*
+    logger: for the fallback warning, by default the module's logger
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    table_df_out = None
+    if use_http:
+        try:
+            table_df_out = retrieve_index_table_http(index_url=index_begin_url)
+        except Exception as e:
+            logger.warning(f"{index_begin_url}: HTTP retrieval failed, falling back to the browser: {e}")
+
+    if table_df_out is None:
+        driver = create_driver(headless)
+        try:
+            table_df_out = __retrieve_index_table(driver, index_begin_url, wait_ready)
+        finally:
+            driver.quit()
+
     if save_dir is not None:
-        if not os.path.isdir(save_dir):
-            os.makedirs(save_dir)
-        table_df_out.to_csv(os.path.join(save_dir, "index_page.csv"), index=False, encoding="utf_8_sig")
+        save_table(table_df_out, os.path.join(save_dir, f"index_page.{file_format}"), "index_page", export_csv=True)
 
     return table_df_out
 
@@ -96,182 +114,260 @@ def is_page_ready(driver):
 
 
 def extract_timeline(driver):
-    data_dict = defaultdict(list)
-    ul_ele: WebElement = driver.find_element(By.CSS_SELECTOR, "ul.project-dy-flow-con")
-    all_li_ele = ul_ele.find_elements(By.CSS_SELECTOR, "li")
-    for li_ele in all_li_ele:
-        title_iter = li_ele.find_element(By.CSS_SELECTOR, "span.title").text
-        date_iter = pd.to_datetime(li_ele.find_element(By.CSS_SELECTOR, "span.date").text)
-        data_dict[title_iter].append(date_iter)
-
-    data_df = pd.DataFrame(data_dict)
-
-    return data_df
+    return parse_timeline(driver.page_source)
 
 
 def extract_project_info(driver):
-    data_dict = defaultdict(list)
-    table_ele = driver.find_element(By.CSS_SELECTOR, "div.base-info.project-base-info")
-    table_rows = table_ele.find_elements(By.CSS_SELECTOR, "tr")
-    for table_row in table_rows:
-        index_ele_all = table_row.find_elements(By.CSS_SELECTOR, "td.title")
-        info_ele_all = table_row.find_elements(By.CSS_SELECTOR, "td.info")
-        for index_ele, info_ele in zip(index_ele_all, info_ele_all):
-            data_dict[index_ele.text].append(info_ele.text)
-
-    data_df = pd.DataFrame(data_dict)
-
-    return data_df
+    return parse_project_info(driver.page_source)
 
 
 def extract_inquiries_and_replies(driver):
     """
-    Handles:
-    - No table (Done)
-    - No link in the row, i.e a <span> instead of an <a>
-    - Can't find first and / or second round inquiry letter
-
     Returns
     -------
     dict:
         filename: url
+    See .page_parser.parse_inquiries_and_replies(.)
     """
-    div_ele = driver.find_element(By.XPATH, "//div[contains(text(), '问询与回复')]/following-sibling::div[1]")
-    table_ele: WebElement = div_ele.find_element(By.CSS_SELECTOR, "table.info-disc-table")
-    data_df_all = pd.read_html(table_ele.get_attribute("outerHTML"))
-    if len(data_df_all) == 0:
-        return {}
-    data_df = data_df_all[0]
-
-    def find_broker_rows(title: str, key_word: str = None):
-        """
-        key_word: e.g. first round or second round
-        """
-        name_pattern = re.compile(r"[\u4e00-\u9fff]{2}函")
-        if "发行人" in title and "保荐机构" in title and "回复" in title and ".pdf" in title:
-            name_matches = re.findall(name_pattern, title)
-            if len(name_matches) > 0 and name_matches[0] != "问询函":
-                return False
-            if key_word is None:
-                return True
-            if key_word in title:
-                return True
-
-        return False
-
-    broker_mask = data_df["内容"].apply(find_broker_rows)
-    broker_df = data_df[broker_mask]
-    second_round_mask = broker_df["内容"].str.contains("第二轮")
-    second_round_df = broker_df[second_round_mask].sort_values("更新日期", ascending=False)
-    first_round_df = broker_df[~second_round_mask].sort_values("更新日期", ascending=False)
-
-    out_dict = {}
-    for df_iter in [first_round_df, second_round_df]:
-        if len(df_iter) == 0:
-            continue
-        title_iter = df_iter["内容"].iloc[0]
-        try:
-            anchor_ele: WebElement = driver.find_element(By.XPATH, f"//a[contains(text(), '{title_iter}')]")
-            out_dict[title_iter] = anchor_ele.get_attribute("href")
-        except NoSuchElementException:
-            out_dict[title_iter] = None
-
-    return out_dict
+    return parse_inquiries_and_replies(driver.page_source, driver.current_url)
 
 
-def retrieve_detail_page(page_url: str, save_dir: str, wait_ready=30):
+@timed()
+def retrieve_detail_page(page_url: str, save_dir: str, wait_ready=30, driver: webdriver.Chrome = None,
+                         downloader: BulkDownloader = None):
     """
     - extract_timeline(.)
     - extract_project_info(.)
     - extract_inquieies_and_replies(.): Download the pdfs
+    driver: reused if given, otherwise a driver is created and quit for this page only
+    downloader: downloads the pdfs concurrently, see .downloader.download_files(.)
 
     Returns
     -------
     DataFrame: one row containing timeline and project info
     """
-    driver = webdriver.Chrome(service=ChromeService(executable_path=CHROME_EXECUTABLE_PATH))
+    if driver is not None:
+        return __retrieve_detail_page(page_url, save_dir, wait_ready, driver, downloader)
+    driver = create_driver()
+    try:
+        return __retrieve_detail_page(page_url, save_dir, wait_ready, driver, downloader)
+    finally:
+        driver.quit()
+
+
+def __retrieve_detail_page(page_url: str, save_dir: str, wait_ready: int, driver: webdriver.Chrome,
+                           downloader: BulkDownloader):
+    """
+    Untimed: see retrieve_detail_page(.), which records one event per page whether or not it creates the driver
+    """
     driver.get(page_url)
     WebDriverWait(driver, wait_ready).until(is_page_ready)
-    timeline_df = extract_timeline(driver)
-    project_info_df = extract_project_info(driver)
+    # One snapshot of the page, parsed offline
+    soup = make_soup(driver.page_source)
+    timeline_df = parse_timeline(soup)
+    project_info_df = parse_project_info(soup)
     df_all = pd.concat([timeline_df, project_info_df], axis=1)
-    url_dict = extract_inquiries_and_replies(driver)
+    url_dict = parse_inquiries_and_replies(soup, driver.current_url)
     comp_name = df_all["公司简称"].iloc[0]
     save_dir_company = os.path.join(save_dir, comp_name)
-    for filename, url in url_dict.items():
-        filename_save = os.path.join(save_dir_company, filename)
-        download_and_save_file(url, filename_save)
+    download_files([(url, os.path.join(save_dir_company, filename)) for filename, url in url_dict.items()],
+                   downloader)
 
     return df_all
 
 
-def __wrapper_retrieve_detail_page(page_url: str, save_dir: str, wait_ready: int, print_interval: int,
-                                   total_num_urls: int, shared_list: list, logger: logging.Logger):
+def __retrieve_detail_page_any(page_url: str, save_dir: str, wait_ready: int, use_http: bool,
+                               logger: logging.Logger):
+    if use_http:
+        try:
+            return retrieve_detail_page_http(page_url, save_dir, get_worker_session())
+        except Exception as e:
+            logger.warning(f"{page_url}: HTTP retrieval failed, falling back to the browser: {e}")
+    with get_worker_driver().session() as driver:
+        return retrieve_detail_page(page_url, save_dir, wait_ready, driver)
+
+
+def __wrapper_retrieve_detail_page(page_url: str, save_dir: str, wait_ready: int, use_http: bool,
+                                   logger: logging.Logger):
+    """
+    Returns
+    -------
+    (str, dict or None, str or None): page_url, .checkpoint.df_to_record(.) of the page and the error if any
+    """
     try:
-        df_all = retrieve_detail_page(page_url, save_dir, wait_ready)
-        shared_list.append(df_all)
-        if len(shared_list) % print_interval == 1:
-            logger.debug(f"Current: {len(shared_list)}/{total_num_urls}")
+        df_all = __retrieve_detail_page_any(page_url, save_dir, wait_ready, use_http, logger)
+        return page_url, df_to_record(page_url, df_all), None
     except Exception as e:
-        logger.debug(e)
+        return page_url, None, str(e)
+
+
+def __wrapper_retrieve_detail_page_star(args):
+    return __wrapper_retrieve_detail_page(*args)
+
+
+def merge_detail_pages(index_page_df: pd.DataFrame, detail_all_df: pd.DataFrame):
+    """
+    Joins the index table and the detail pages on the company's full name. The columns on both (e.g. 审核状态, 受理日期)
+    are kept once, with the value of the detail page where it has one, instead of as *_x / *_y pairs.
+    """
+    overlap_cols = [col for col in detail_all_df.columns if col in index_page_df.columns]
+    combined_df = index_page_df.merge(detail_all_df, how="inner", left_on="发行人全称", right_on="公司全称",
+                                      suffixes=("", "_detail"))
+    for col in overlap_cols:
+        combined_df[col] = combined_df[f"{col}_detail"].combine_first(combined_df[col])
+
+    return combined_df.drop(columns=[f"{col}_detail" for col in overlap_cols])
 
 
 def retrieve_all_detail_pages(index_page_filename: str, save_dir: str, logger: logging.Logger, output_dir: str = None,
                               num_processes=8, **kwargs):
     """
     save_dir: Root directory for saving pdfs
-    output_dir: Directory for saving the combined DF
+    output_dir: Directory for saving the combined DF, not saved if None
+    kwargs: wait_ready, print_interval, headless, max_pages_per_driver (pages before a worker's driver is recycled),
+        use_http (use the JSON endpoints, see .szse_api, with the browser as fallback),
+        checkpoint_dir (default: $output_dir/detail_pages_checkpoint, required without output_dir), shard_size (pages
+        per checkpoint shard), file_format ("csv" or "parquet" (with a CSV copy) for $output_dir/detailed_info.*)
+    index_page_filename: CSV or Parquet
+
+    Finished pages are streamed back and checkpointed in shards as the crawl goes; on restart, pages already in the
+    checkpoint are skipped. detailed_info.csv is built from the shards at the end.
+
+    Returns
+    -------
+    DataFrame: the index table joined with the detail pages (see merge_detail_pages(.)), empty if no page was
+        retrieved
     """
     wait_ready = kwargs.get("wait_ready", 30)
     print_interval = kwargs.get("print_interval", 50)
-
-    index_page_df: pd.DataFrame = pd.read_csv(index_page_filename, header=[0])
+    headless = kwargs.get("headless", False)
+    max_pages_per_driver = kwargs.get("max_pages_per_driver", 50)
+    use_http = kwargs.get("use_http", False)
+    checkpoint_dir = kwargs.get("checkpoint_dir")
+    if checkpoint_dir is None:
+        if output_dir is None:
+            raise ValueError("checkpoint_dir is required without output_dir")
+        checkpoint_dir = os.path.join(output_dir, "detail_pages_checkpoint")
+    shard_size = kwargs.get("shard_size", 50)
+    file_format = kwargs.get("file_format", "csv")
+
+    index_page_df: pd.DataFrame = load_table(index_page_filename)
     # index_page_df = index_page_df.loc[:10, :]
     detail_page_urls = list(index_page_df["detail_page"])
-
-    with Manager() as manager:
-        shared_list = manager.list()
-        args_all = [(url_iter, save_dir, wait_ready, print_interval, len(detail_page_urls), shared_list, logger)
-                    for url_iter in detail_page_urls]
-        with Pool(processes=num_processes) as pool:
-            pool.starmap(__wrapper_retrieve_detail_page, args_all)
-        detail_all_df = pd.concat(shared_list, axis=0)
-
-    combined_df = index_page_df.merge(detail_all_df, how="inner", left_on="发行人全称", right_on="公司全称")
-
-    if not os.path.isdir(output_dir):
-        os.makedirs(output_dir)
-    combined_df.to_csv(os.path.join(output_dir, "detailed_info.csv"), index=False, encoding="utf_8_sig")
+    done_urls = set([record["key"] for record in load_shards(checkpoint_dir)])
+    todo_urls = [url_iter for url_iter in dict.fromkeys(detail_page_urls) if url_iter not in done_urls]
+    logger.debug(f"{len(done_urls)} pages in the checkpoint, {len(todo_urls)} to retrieve")
+
+    args_all = [(url_iter, save_dir, wait_ready, use_http, logger) for url_iter in todo_urls]
+    shard_records = []
+    num_finished = 0
+    with Pool(processes=num_processes, initializer=init_worker_driver,
+              initargs=(headless, max_pages_per_driver)) as pool:
+        for page_url, record, error in pool.imap_unordered(__wrapper_retrieve_detail_page_star, args_all):
+            num_finished += 1
+            if error is not None:
+                logger.debug(f"{page_url}: {error}")
+            else:
+                shard_records.append(record)
+                if len(shard_records) >= shard_size:
+                    write_shard(checkpoint_dir, shard_records)
+                    shard_records = []
+            if num_finished % print_interval == 1:
+                logger.debug(f"Current: {num_finished}/{len(todo_urls)}")
+        write_shard(checkpoint_dir, shard_records)
+        # Let the workers exit normally so that their drivers are quit
+        pool.close()
+        pool.join()
+
+    detail_all_df = records_to_df(load_shards(checkpoint_dir))
+    if len(detail_all_df) == 0:
+        # Every page failed, or there were none: the index table's columns without rows
+        logger.warning(f"No detail page retrieved out of {len(todo_urls)}")
+        combined_df = index_page_df.iloc[:0]
+    else:
+        combined_df = merge_detail_pages(index_page_df, detail_all_df)
+
+    if output_dir is not None:
+        save_table(combined_df, os.path.join(output_dir, f"detailed_info.{file_format}"), "detailed_info",
+                   export_csv=True)
+    dump_summary(logger)
     logger.debug("Finished!")
 
+    return combined_df
 
-def retrieve_latest_prospectus(driver: webdriver.Chrome, company_dir: str):
-    div_ele = driver.find_element(By.XPATH, "//div[contains(text(), '信息披露')]/following-sibling::div[1]")
-    tgt_td = div_ele.find_element(By.XPATH, "//td[contains(text(), '招股说明书')]/following-sibling::td[1]")
-    all_anchors = tgt_td.find_elements(By.CSS_SELECTOR, "a")
-    all_anchors = [anchor for anchor in all_anchors if anchor.get_attribute("href") is not None]
-    all_anchors.sort(key=lambda anchor: pd.to_datetime(anchor.text), reverse=True)
-    tgt_anchor = all_anchors[0]
-    file_url = tgt_anchor.get_attribute("href")
-    download_and_save_file(file_url, os.path.join(company_dir, f"招股说明书_{tgt_anchor.text}.pdf"))
 
+def retrieve_latest_prospectus(driver: webdriver.Chrome, company_dir: str, downloader: BulkDownloader = None):
+    date_str, file_url = parse_latest_prospectus(driver.page_source, driver.current_url)
+    download_files([(file_url, os.path.join(company_dir, f"招股说明书_{date_str}.pdf"))], downloader)
 
-def __wrap_retrieve_latest_prospectus(url: str, company_dir: str, wait_ready=30):
+
+def __resolve_latest_prospectus(url: str, company_dir: str, wait_ready=30, use_http=False,
+                                logger: logging.Logger = None):
+    """
+    Returns
+    -------
+    (str, str) or None: url of the latest prospectus and the file to save it to, None if it can't be found
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    if use_http:
+        try:
+            date_str, file_url = resolve_latest_prospectus_http(url, get_worker_session())
+            return file_url, os.path.join(company_dir, f"招股说明书_{date_str}.pdf")
+        except Exception as e:
+            logger.warning(f"{url}: HTTP retrieval failed, falling back to the browser: {e}")
     try:
-        driver = init_driver(url)
-        WebDriverWait(driver, wait_ready).until(is_page_ready)
-        retrieve_latest_prospectus(driver, company_dir)
+        with get_worker_driver().session() as driver:
+            driver.get(url)
+            WebDriverWait(driver, wait_ready).until(is_page_ready)
+            date_str, file_url = parse_latest_prospectus(driver.page_source, driver.current_url)
+            return file_url, os.path.join(company_dir, f"招股说明书_{date_str}.pdf")
     except Exception as e:
-        pass
+        logger.warning(f"{url}: no prospectus retrieved: {e}")
+
+    return None
+
+
+def __resolve_latest_prospectus_star(args):
+    return __resolve_latest_prospectus(*args)
 
 
 def retrieve_all_prospectuses(detail_info_filename: str, save_dir: str, num_processes=8, **kwargs):
+    """
+    kwargs: wait_ready, headless, max_pages_per_driver (pages before a worker's driver is recycled),
+        use_http (use the JSON endpoints, see .szse_api, with the browser as fallback), logger (for the pages that
+        fall back or fail, by default the module's logger), max_downloads (concurrent downloads)
+
+    The workers only find the prospectus of each page; the files are then downloaded together with a
+    .downloader.BulkDownloader.
+    """
     wait_ready = kwargs.get("wait_ready", 30)
-    detail_info_df: pd.DataFrame = pd.read_csv(detail_info_filename, header=[0])
+    headless = kwargs.get("headless", False)
+    max_pages_per_driver = kwargs.get("max_pages_per_driver", 50)
+    use_http = kwargs.get("use_http", False)
+    logger = kwargs.get("logger", logging.getLogger(__name__))
+    max_downloads = kwargs.get("max_downloads", 8)
+    detail_info_df: pd.DataFrame = load_table(detail_info_filename, columns=["公司简称", "detail_page"])
     comp_names = detail_info_df["公司简称"].tolist()
     detail_urls = detail_info_df["detail_page"].tolist()
 
-    with Pool(processes=num_processes) as pool:
-        args_all = [(url_iter, os.path.join(save_dir, comp_name_iter), wait_ready) for url_iter, comp_name_iter in
-                    zip(detail_urls, comp_names)]
-        pool.starmap(__wrap_retrieve_latest_prospectus, args_all)
+    with Pool(processes=num_processes, initializer=init_worker_driver,
+              initargs=(headless, max_pages_per_driver)) as pool:
+        args_all = [(url_iter, os.path.join(save_dir, comp_name_iter), wait_ready, use_http, logger)
+                    for url_iter, comp_name_iter in zip(detail_urls, comp_names)]
+        items = [item for item in pool.imap(__resolve_latest_prospectus_star, args_all) if item is not None]
+        # Let the workers exit normally so that their drivers are quit
+        pool.close()
+        pool.join()
+
+    downloader = BulkDownloader(max_workers=max_downloads)
+    try:
+        results, stats = downloader.download_all(items)
+    finally:
+        downloader.close()
+    for result in results:
+        if result["status"] == "failed":
+            logger.warning(f"{result['url']}: download failed: {result['error']}")
+    logger.debug(f"Prospectuses: {stats['num_downloaded']} downloaded, {stats['num_skipped']} skipped, "
+                 f"{stats['num_failed']} failed, {stats['bytes_per_second'] / 1024 ** 2:.2f} MB/s")
+    dump_summary()
@@ -0,0 +1,235 @@
+import pandas as pd
+import requests
+import os
+
+from urllib.parse import urlparse, parse_qs, urljoin
+from collections import defaultdict
+from IPODataAnalysis.configs import SZSE_API_URL, SZSE_DETAIL_PAGE_URL, SZSE_DOC_BASE_URL, SZSE_INDEX_FIELDS, \
+    SZSE_PROJECT_INFO_FIELDS, SZSE_TIMELINE_FIELDS, SZSE_INQUIRY_FIELDS, SZSE_DISCLOSURE_FIELDS, SZSE_INDEX_URL, \
+    SZSE_BIZ_TYPES
+from .downloader import BulkDownloader, download_files
+from ..metrics import timed
+
+
+# Browser-free retrieval: the SZSE project dynamic pages render JSON from SZSE_API_URL, so the same tables are built
+# from those responses directly. The functions here return the same DataFrames as their Selenium counterparts in
+# .retrieve_szse_info.
+
+
+def create_session():
+    session = requests.Session()
+    session.headers.update({
+        "User-Agent": "Mozilla/5.0",
+        "Accept": "application/json, text/plain, */*",
+        "Referer": "http://listing.szse.cn/projectdynamic/ipo/index.html",
+    })
+
+    return session
+
+
+__WORKER_SESSION = None
+
+
+def get_worker_session() -> requests.Session:
+    """
+    One pooled session per process.
+    """
+    global __WORKER_SESSION
+    if __WORKER_SESSION is None:
+        __WORKER_SESSION = create_session()
+
+    return __WORKER_SESSION
+
+
+def get_json(session: requests.Session, url: str, params: dict = None, timeout=30):
+    resp = session.get(url, params=params, timeout=timeout)
+    if resp.status_code != 200:
+        raise requests.HTTPError(f"{resp.status_code}: {resp.url}")
+
+    return resp.json()
+
+
+def get_project_id(page_url: str):
+    """
+    page_url: e.g. http://listing.szse.cn/projectdynamic/ipo/detail/index.html?id=1003162
+    """
+    query = parse_qs(urlparse(page_url).query)
+    if "id" not in query:
+        raise ValueError(f"No project id in {page_url}")
+
+    return query["id"][0]
+
+
+def get_project_list(index_url: str):
+    """
+    index_url: e.g. https://listing.szse.cn/projectdynamic/ipo/index.html
+
+    Returns
+    -------
+    str: the project list, e.g. "ipo", see SZSE_BIZ_TYPES
+    """
+    path_parts = [part for part in urlparse(index_url).path.split("/") if len(part) > 0]
+    if "projectdynamic" in path_parts[:-1]:
+        project_list = path_parts[path_parts.index("projectdynamic") + 1]
+        if project_list in SZSE_BIZ_TYPES:
+            return project_list
+    raise ValueError(f"Unknown project list: {index_url}")
+
+
+def retrieve_index_table_http(save_dir=None, biz_type=None, page_size=100, session: requests.Session = None,
+                              api_url: str = SZSE_API_URL, index_url: str = SZSE_INDEX_URL):
+    """
+    Same output (and index_page.csv) as .retrieve_szse_info.retrieve_index_table(.)
+    index_url: the index page whose table is retrieved; biz_type (if None) and the detail page links follow its project
+        list, see get_project_list(.)
+    """
+    if session is None:
+        session = create_session()
+    project_list = get_project_list(index_url)
+    if biz_type is None:
+        biz_type = SZSE_BIZ_TYPES[project_list]
+
+    records = []
+    page_idx = 0
+    while True:
+        params = {"bizType": biz_type, "pageIndex": page_idx, "pageSize": page_size}
+        resp_dict = get_json(session, f"{api_url}/query", params)
+        records_iter = resp_dict.get("data") or []
+        records += records_iter
+        page_idx += 1
+        if len(records_iter) == 0 or len(records) >= int(resp_dict.get("totalSize", 0)):
+            break
+
+    data_dict = defaultdict(list)
+    for i, record in enumerate(records):
+        data_dict["序号"].append(i + 1)
+        for col, field in SZSE_INDEX_FIELDS.items():
+            data_dict[col].append(record.get(field))
+        data_dict["detail_page"].append(SZSE_DETAIL_PAGE_URL.format(project_list=project_list,
+                                                                     project_id=record.get("prjid")))
+    table_df_out = pd.DataFrame(data_dict)
+
+    if save_dir is not None:
+        if not os.path.isdir(save_dir):
+            os.makedirs(save_dir)
+        table_df_out.to_csv(os.path.join(save_dir, "index_page.csv"), index=False, encoding="utf_8_sig")
+
+    return table_df_out
+
+
+def retrieve_project_details(page_url: str, session: requests.Session = None, api_url: str = SZSE_API_URL):
+    """
+    Returns
+    -------
+    dict: the "data" of the project details response
+    """
+    if session is None:
+        session = create_session()
+    resp_dict = get_json(session, f"{api_url}/details", {"id": get_project_id(page_url)})
+    details = resp_dict.get("data")
+    if not details:
+        raise ValueError(f"Empty project details for {page_url}")
+
+    return details
+
+
+def extract_timeline_http(details: dict):
+    data_dict = defaultdict(list)
+    for title, field in SZSE_TIMELINE_FIELDS.items():
+        date_str = details.get(field)
+        if date_str:
+            data_dict[title].append(pd.to_datetime(date_str))
+
+    return pd.DataFrame(data_dict)
+
+
+def extract_project_info_http(details: dict):
+    data_dict = defaultdict(list)
+    for col, field in SZSE_PROJECT_INFO_FIELDS.items():
+        value = details.get(field)
+        data_dict[col].append("" if value is None else str(value))
+
+    return pd.DataFrame(data_dict)
+
+
+def __get_documents(details: dict, fields: dict):
+    """
+    Returns
+    -------
+    DataFrame: columns "内容" (title), "更新日期" and "url"
+    """
+    data_dict = defaultdict(list)
+    for doc_record in details.get(fields["list"]) or []:
+        path = doc_record.get(fields["path"])
+        data_dict["内容"].append(doc_record.get(fields["title"]))
+        data_dict["更新日期"].append(doc_record.get(fields["date"]))
+        data_dict["url"].append(None if path is None else urljoin(SZSE_DOC_BASE_URL, path))
+
+    return pd.DataFrame(data_dict, columns=["内容", "更新日期", "url"])
+
+
+def extract_inquiries_and_replies_http(details: dict):
+    """
+    Returns
+    -------
+    dict:
+        filename: url
+    """
+    from .page_parser import select_inquiry_reply_titles
+
+    data_df = __get_documents(details, SZSE_INQUIRY_FIELDS)
+    if len(data_df) == 0:
+        return {}
+    url_dict = dict(zip(data_df["内容"], data_df["url"]))
+
+    return {title: url_dict[title] for title in select_inquiry_reply_titles(data_df)}
+
+
+@timed()
+def retrieve_detail_page_http(page_url: str, save_dir: str, session: requests.Session = None,
+                              api_url: str = SZSE_API_URL, downloader: BulkDownloader = None):
+    """
+    Same output (and downloads) as .retrieve_szse_info.retrieve_detail_page(.)
+    downloader: downloads the replies concurrently, see .downloader.download_files(.)
+    """
+    if session is None:
+        session = create_session()
+    details = retrieve_project_details(page_url, session, api_url)
+    timeline_df = extract_timeline_http(details)
+    project_info_df = extract_project_info_http(details)
+    df_all = pd.concat([timeline_df, project_info_df], axis=1)
+    url_dict = extract_inquiries_and_replies_http(details)
+    comp_name = df_all["公司简称"].iloc[0]
+    save_dir_company = os.path.join(save_dir, comp_name)
+    download_files([(url, os.path.join(save_dir_company, filename)) for filename, url in url_dict.items()],
+                   downloader)
+
+    return df_all
+
+
+def resolve_latest_prospectus_http(page_url: str, session: requests.Session = None, api_url: str = SZSE_API_URL):
+    """
+    Returns
+    -------
+    (str, str): date (%Y-%m-%d) and url of the latest prospectus, as .page_parser.parse_latest_prospectus(.)
+    """
+    if session is None:
+        session = create_session()
+    details = retrieve_project_details(page_url, session, api_url)
+    data_df = __get_documents(details, SZSE_DISCLOSURE_FIELDS)
+    data_df = data_df[data_df["内容"].fillna("").str.contains("招股说明书") & data_df["url"].notna()]
+    if len(data_df) == 0:
+        raise ValueError(f"No prospectus for {page_url}")
+    data_df = data_df.assign(date=pd.to_datetime(data_df["更新日期"])).sort_values("date", ascending=False)
+    latest = data_df.iloc[0]
+
+    return latest["date"].strftime("%Y-%m-%d"), latest["url"]
+
+
+def retrieve_latest_prospectus_http(page_url: str, company_dir: str, session: requests.Session = None,
+                                    api_url: str = SZSE_API_URL, downloader: BulkDownloader = None):
+    """
+    Same download as .retrieve_szse_info.retrieve_latest_prospectus(.)
+    """
+    date_str, file_url = resolve_latest_prospectus_http(page_url, session, api_url)
+    download_files([(file_url, os.path.join(company_dir, f"招股说明书_{date_str}.pdf"))], downloader)
@@ -1,31 +1,147 @@
 import requests
+import signal
 import os
 
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service as ChromeService
+from contextlib import contextmanager
+from multiprocessing.util import Finalize
 
 from ..global_configs import ROOT_DIR
-from IPODataAnalysis.configs import CHROME_EXECUTABLE_PATH
+from ..metrics import timed
+from IPODataAnalysis.configs import get_config
 
+# selenium and bs4 are imported by the functions using them: the HTTP download path (.downloader, .szse_api) doesn't
+# need either
 
-def init_driver(url: str):
-    driver = webdriver.Chrome(service=ChromeService(executable_path=CHROME_EXECUTABLE_PATH))
+
+def create_driver(headless: bool = False):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service as ChromeService
+
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+        options.add_argument("--disable-gpu")
+    driver = webdriver.Chrome(service=ChromeService(executable_path=get_config("CHROME_EXECUTABLE_PATH")),
+                              options=options)
+
+    return driver
+
+
+def init_driver(url: str, headless: bool = False):
+    driver = create_driver(headless)
     driver.get(url)
 
     return driver
 
 
+class ReusableDriver(object):
+    """
+    A long-lived driver reused across pages. It is recycled (quit and recreated on next use) after max_pages pages
+    or after a WebDriver crash.
+    driver_factory: called with headless to create a driver, create_driver(.) by default
+    """
+    def __init__(self, headless: bool = False, max_pages: int = 50, driver_factory=None):
+        self.headless = headless
+        self.max_pages = max_pages
+        self.driver_factory = create_driver if driver_factory is None else driver_factory
+        self.driver = None
+        self.num_pages = 0
+
+    def acquire(self):
+        if self.driver is None:
+            self.driver = self.driver_factory(self.headless)
+            self.num_pages = 0
+        self.num_pages += 1
+
+        return self.driver
+
+    def release(self, crashed: bool = False):
+        if crashed or self.num_pages >= self.max_pages:
+            self.quit()
+
+    @contextmanager
+    def session(self):
+        """
+        with reusable_driver.session() as driver:
+            driver.get(url)
+            ...
+        """
+        from selenium.common.exceptions import WebDriverException, TimeoutException, NoSuchElementException
+
+        driver = self.acquire()
+        crashed = False
+        try:
+            yield driver
+        except (TimeoutException, NoSuchElementException):
+            # The page is not as expected but the browser is fine
+            raise
+        except WebDriverException:
+            crashed = True
+            raise
+        finally:
+            self.release(crashed)
+
+    def quit(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+            self.driver = None
+
+
+__WORKER_DRIVER = None
+
+
+def __quit_worker_driver_on_sigterm(signum, frame):
+    __WORKER_DRIVER.quit()
+    # Then die of SIGTERM as the Pool expects
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def init_worker_driver(headless: bool = False, max_pages: int = 50, driver_factory=None):
+    """
+    Pool initializer: each worker process owns one ReusableDriver, quit when the process exits normally (i.e. after
+    pool.close() and pool.join()) or is sent SIGTERM by pool.terminate() (e.g. when leaving the Pool's with block on
+    an exception), which skips the Finalize callbacks. On Windows terminate() can't be caught: the drivers are only
+    quit on a normal exit.
+    driver_factory: see ReusableDriver
+    """
+    global __WORKER_DRIVER
+    __WORKER_DRIVER = ReusableDriver(headless, max_pages, driver_factory)
+    Finalize(__WORKER_DRIVER, __WORKER_DRIVER.quit, exitpriority=10)
+    if os.name == "posix":
+        signal.signal(signal.SIGTERM, __quit_worker_driver_on_sigterm)
+
+
+def get_worker_driver() -> ReusableDriver:
+    if __WORKER_DRIVER is None:
+        init_worker_driver()
+
+    return __WORKER_DRIVER
+
+
 def retrieve_element(url: str, css_selector: str):
-    driver = webdriver.Chrome(service=ChromeService(executable_path=CHROME_EXECUTABLE_PATH))
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.chrome.service import Service as ChromeService
+
+    driver = webdriver.Chrome(service=ChromeService(executable_path=get_config("CHROME_EXECUTABLE_PATH")))
     driver.get(url)
     ele = driver.find_element(By.CSS_SELECTOR, css_selector)
 
     return ele
 
 
-def retrieve_page(url: str) -> BeautifulSoup:
+def retrieve_page(url: str):
+    """
+    Returns
+    -------
+    bs4.BeautifulSoup
+    """
+    from bs4 import BeautifulSoup
+
     resp = requests.get(url)
     if resp.status_code == 200:
         soup = BeautifulSoup(resp.content, "html.parser")
@@ -34,15 +150,85 @@ def retrieve_page(url: str) -> BeautifulSoup:
         raise requests.HTTPError
 
 
-def download_and_save_file(url, save_filename: str = None):
-    if os.path.isfile(save_filename):
-       return
-    resp = requests.get(url)
-    if resp.status_code != 200:
-        raise requests.HTTPError
-    if save_filename is not None:
-        save_dir = os.path.dirname(save_filename)
-        if not os.path.isdir(save_dir):
-            os.makedirs(save_dir)
-        with open(save_filename, "wb") as wf:
-            wf.write(resp.content)
+class TruncatedDownloadError(IOError):
+    pass
+
+
+@timed(num_bytes=lambda out, *args, **kwargs: out)
+def download_and_save_file(url, save_filename: str = None, session: requests.Session = None, resume=True,
+                           chunk_size=1 << 16, timeout=60):
+    """
+    Streams the response to ${save_filename}.part and renames it once complete, so an interrupted download never
+    leaves a truncated file at save_filename. With resume, an existing .part file is continued with a Range request.
+    session: reused if given (e.g. .downloader.BulkDownloader's), otherwise one is opened and closed for this file
+
+    Returns
+    -------
+    int: number of bytes downloaded (0 if save_filename already exists)
+    """
+    if save_filename is not None and os.path.isfile(save_filename):
+        return 0
+    if session is not None:
+        return __download(url, save_filename, session, resume, chunk_size, timeout)
+    with requests.Session() as session:
+        return __download(url, save_filename, session, resume, chunk_size, timeout)
+
+
+def __download(url, save_filename: str, session: requests.Session, resume: bool, chunk_size: int, timeout):
+    if save_filename is None:
+        resp = session.get(url, timeout=timeout)
+        if resp.status_code != 200:
+            raise requests.HTTPError(f"{resp.status_code}: {url}", response=resp)
+        return len(resp.content)
+
+    save_dir = os.path.dirname(save_filename)
+    if not os.path.isdir(save_dir):
+        os.makedirs(save_dir)
+    part_filename = f"{save_filename}.part"
+    headers = {}
+    offset = 0
+    if resume and os.path.isfile(part_filename):
+        offset = os.path.getsize(part_filename)
+        if offset > 0:
+            headers["Range"] = f"bytes={offset}-"
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+        if resp.status_code == 206:
+            mode = "ab"
+        elif resp.status_code == 200:
+            # Range not honoured: start over
+            mode = "wb"
+        else:
+            if resp.status_code == 416 and offset > 0:
+                # Nothing left after offset: the .part file is complete if it has the size in "bytes */{total}"
+                if __get_content_range_total(resp) == offset:
+                    os.replace(part_filename, save_filename)
+                    return 0
+                os.remove(part_filename)
+            raise requests.HTTPError(f"{resp.status_code}: {url}", response=resp)
+        content_length = resp.headers.get("Content-Length")
+        num_bytes = 0
+        with open(part_filename, mode) as wf:
+            for chunk in resp.iter_content(chunk_size):
+                wf.write(chunk)
+                num_bytes += len(chunk)
+        num_raw_bytes = resp.raw.tell()
+
+    if content_length is not None and num_raw_bytes != int(content_length):
+        # Keep the .part file so that the next attempt resumes
+        raise TruncatedDownloadError(f"Truncated download ({num_raw_bytes}/{content_length} bytes): {url}")
+    os.replace(part_filename, save_filename)
+
+    return num_bytes
+
+
+def __get_content_range_total(resp: requests.Response):
+    """
+    Returns
+    -------
+    int or None: the complete length in the Content-Range header (e.g. "bytes */1234"), None if unknown
+    """
+    content_range = resp.headers.get("Content-Range", "")
+    total = content_range.rsplit("/", 1)[-1].strip()
+
+    return int(total) if total.isdigit() else None
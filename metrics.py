@@ -0,0 +1,231 @@
+import threading
+import functools
+import logging
+import glob
+import json
+import time
+import os
+
+from contextlib import contextmanager
+
+
+# Stage-level timings and counters. Disabled unless $IPO_METRICS_DIR is set (or enable(.) is called), in which case
+# every process, Pool workers included, appends one JSON line per event to $IPO_METRICS_DIR/metrics_{pid}.jsonl;
+# summarize(.) aggregates the files, and the top-level runs (construct_q_and_a_database_main(.), the crawls, the
+# bundler, run_batch(.)) end with dump_summary(.). enable(.) at the start of a run clears the events of earlier runs.
+# When disabled, a timed function costs one extra call and a None check.
+
+METRICS_DIR_ENV = "IPO_METRICS_DIR"
+
+__STATE = {
+    "metrics_dir": os.environ.get(METRICS_DIR_ENV) or None,
+    "pid": None,
+    "file": None,
+}
+__LOCK = threading.Lock()
+
+
+def is_enabled():
+    return __STATE["metrics_dir"] is not None
+
+
+def enable(metrics_dir: str, clear: bool = True):
+    """
+    Starts a run: events of this process and of the processes it starts from now on go to metrics_dir.
+    clear: remove the events of earlier runs
+    """
+    if not os.path.isdir(metrics_dir):
+        os.makedirs(metrics_dir)
+    if clear:
+        for filename in glob.glob(os.path.join(metrics_dir, "metrics_*.jsonl")):
+            os.remove(filename)
+    # Inherited by spawned workers; forked ones inherit __STATE as well
+    os.environ[METRICS_DIR_ENV] = metrics_dir
+    with __LOCK:
+        __close_file()
+        __STATE["metrics_dir"] = metrics_dir
+
+
+def disable():
+    os.environ.pop(METRICS_DIR_ENV, None)
+    with __LOCK:
+        __close_file()
+        __STATE["metrics_dir"] = None
+
+
+def __close_file():
+    if __STATE["file"] is not None and __STATE["pid"] == os.getpid():
+        __STATE["file"].close()
+    __STATE["file"] = None
+    __STATE["pid"] = None
+
+
+def record(stage: str, seconds: float = 0., items: int = 1, num_bytes: int = 0, ok: bool = True):
+    """
+    Appends one event. Each event is written (and flushed) right away, so that nothing is lost when Pool workers are
+    terminated.
+    """
+    metrics_dir = __STATE["metrics_dir"]
+    if metrics_dir is None:
+        return
+    event = {
+        "stage": stage,
+        "seconds": seconds,
+        "items": items,
+        "bytes": num_bytes,
+        "ok": ok,
+        "time": time.time(),
+    }
+    line = json.dumps(event) + "\n"
+    with __LOCK:
+        pid = os.getpid()
+        if __STATE["pid"] != pid:
+            # First event of the process, or a forked child holding its parent's handle
+            __STATE["file"] = open(os.path.join(metrics_dir, f"metrics_{pid}.jsonl"), "a", encoding="utf-8")
+            __STATE["pid"] = pid
+        __STATE["file"].write(line)
+        __STATE["file"].flush()
+
+
+def count(stage: str, items: int = 1, num_bytes: int = 0):
+    """
+    Counter without timing, e.g. count("pages_skipped", 3)
+    """
+    record(stage, 0., items, num_bytes)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    with stage_timer("write_csv") as event:
+        ...
+        event["items"] = len(rows)
+        event["bytes"] = os.path.getsize(filename)
+
+    The event is recorded with ok=False if the body raises.
+    """
+    if __STATE["metrics_dir"] is None:
+        yield {}
+        return
+    event = {"items": 1, "bytes": 0}
+    ok = False
+    start_time = time.perf_counter()
+    try:
+        yield event
+        ok = True
+    finally:
+        record(stage, time.perf_counter() - start_time, event["items"], event["bytes"], ok)
+
+
+def timed(stage: str = None, items=None, num_bytes=None):
+    """
+    Decorator recording the wall time of each call under stage (default: the function's name).
+    items, num_bytes: optional callables (output, *args, **kwargs) -> int, e.g. num_bytes=lambda out, *_, **__: out
+    """
+    def decorator(func):
+        stage_name = func.__name__ if stage is None else stage
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if __STATE["metrics_dir"] is None:
+                return func(*args, **kwargs)
+            start_time = time.perf_counter()
+            try:
+                out = func(*args, **kwargs)
+            except BaseException:
+                record(stage_name, time.perf_counter() - start_time, 1, 0, ok=False)
+                raise
+            seconds = time.perf_counter() - start_time
+            record(stage_name, seconds, 1 if items is None else items(out, *args, **kwargs),
+                   0 if num_bytes is None else num_bytes(out, *args, **kwargs))
+
+            return out
+
+        return wrapper
+
+    return decorator
+
+
+def __percentile(sorted_values: list, q: float):
+    """
+    Nearest-rank percentile, q in [0, 100]
+    """
+    if len(sorted_values) == 0:
+        return 0.
+    rank = max(int(-(-q * len(sorted_values) // 100)), 1)
+
+    return sorted_values[rank - 1]
+
+
+def load_events(metrics_dir: str = None):
+    metrics_dir = __STATE["metrics_dir"] if metrics_dir is None else metrics_dir
+    events = []
+    for filename in sorted(glob.glob(os.path.join(metrics_dir, "metrics_*.jsonl"))):
+        with open(filename, "r", encoding="utf-8") as rf:
+            for line in rf:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # Line cut short by a killed worker
+                    continue
+
+    return events
+
+
+def summarize(metrics_dir: str = None):
+    """
+    Returns
+    -------
+    {
+        stage: {
+            "count": int,
+            "errors": int,
+            "total_seconds": float,
+            "p50_seconds": float,
+            "p95_seconds": float,
+            "max_seconds": float,
+            "items": int,
+            "bytes": int,
+        }...
+    }
+    """
+    stage_events = {}
+    for event in load_events(metrics_dir):
+        stage_events.setdefault(event["stage"], []).append(event)
+
+    summary = {}
+    for stage, events in sorted(stage_events.items()):
+        durations = sorted([event["seconds"] for event in events])
+        summary[stage] = {
+            "count": len(events),
+            "errors": sum([not event["ok"] for event in events]),
+            "total_seconds": sum(durations),
+            "p50_seconds": __percentile(durations, 50),
+            "p95_seconds": __percentile(durations, 95),
+            "max_seconds": durations[-1],
+            "items": sum([event["items"] for event in events]),
+            "bytes": sum([event["bytes"] for event in events]),
+        }
+
+    return summary
+
+
+def dump_summary(logger: logging.Logger = None, summary_filename: str = None):
+    """
+    Called at the end of a run: writes the summary to summary_filename (default: $IPO_METRICS_DIR/summary.json) and
+    logs one line per stage. Does nothing when disabled.
+    """
+    if not is_enabled():
+        return None
+    summary = summarize()
+    if summary_filename is None:
+        summary_filename = os.path.join(__STATE["metrics_dir"], "summary.json")
+    with open(summary_filename, "w", encoding="utf-8") as wf:
+        json.dump(summary, wf, indent=4)
+    if logger is not None:
+        for stage, stats in summary.items():
+            logger.debug(f"[metrics] {stage}: count {stats['count']}, errors {stats['errors']}, "
+                         f"total {stats['total_seconds']:.3f}s, p50 {stats['p50_seconds']:.3f}s, "
+                         f"p95 {stats['p95_seconds']:.3f}s, items {stats['items']}, bytes {stats['bytes']}")
+
+    return summary
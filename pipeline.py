@@ -0,0 +1,432 @@
+import multiprocessing
+import argparse
+import hashlib
+import logging
+import json
+import time
+import os
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .global_configs import ROOT_DIR
+from .utils import create_logger, save_json
+from .metrics import enable, stage_timer
+from IPODataAnalysis.configs import SZSE_INDEX_URL
+
+
+# Usage (from the parent directory of the repo, or `ipo-pipeline` once installed):
+#   python -m IPODataAnalysis.pipeline --data-dir F:\Data\IPODataAnalysis [--stages q_and_a combine] [--force all]
+# The workflow as a DAG of stages with declared inputs and outputs:
+#   index -> detail_pages -> prospectuses -> combine
+#                         -> q_and_a
+#                         -> combine
+# Each finished stage is recorded in $data_dir/pipeline_state.json with the fingerprints of its inputs, parameters
+# and outputs; a stage whose fingerprints all match is skipped. Stages whose dependencies are done run concurrently
+# (e.g. the prospectus download and the Q&A extraction), each in a spawned process of its own that starts its own
+# process pool: no pool is forked from a process with other threads running (and possibly holding the logging or
+# metrics locks). As with any spawned process, a script calling main(.) needs an `if __name__ == "__main__":` guard.
+
+STATE_FILENAME = "pipeline_state.json"
+STAGE_NAMES = ["index", "detail_pages", "prospectuses", "q_and_a", "combine"]
+
+
+class Stage(object):
+    """
+    func: (config: dict, logger) -> None
+    inputs, outputs: files or directories; a directory is fingerprinted from the sizes and mtimes of its files
+    params: JSON-serializable; a change reruns the stage
+    """
+    def __init__(self, name: str, func, inputs: list, outputs: list, deps: list = None, params: dict = None):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.deps = [] if deps is None else deps
+        self.params = {} if params is None else params
+
+    def __repr__(self):
+        return f"Stage({self.name}, deps={self.deps})"
+
+
+def fingerprint_paths(paths: list):
+    """
+    Hash of the (relative path, size, mtime) of every file under paths; the content isn't read, so that large PDF
+    directories are cheap to fingerprint. Missing paths are part of the hash.
+    """
+    hasher = hashlib.sha256()
+    for path in paths:
+        hasher.update(f"{path}\n".encode("utf-8"))
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            hasher.update(f"{stat.st_size} {stat.st_mtime_ns}\n".encode("utf-8"))
+        elif os.path.isdir(path):
+            for dir_name, sub_dir_names, filenames in os.walk(path):
+                sub_dir_names.sort()
+                for filename in sorted(filenames):
+                    full_filename = os.path.join(dir_name, filename)
+                    stat = os.stat(full_filename)
+                    rel_filename = os.path.relpath(full_filename, path)
+                    hasher.update(f"{rel_filename} {stat.st_size} {stat.st_mtime_ns}\n".encode("utf-8"))
+        else:
+            hasher.update(b"missing\n")
+
+    return hasher.hexdigest()[:16]
+
+
+def fingerprint_params(params: dict):
+    params_str = json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+    return hashlib.sha256(params_str.encode("utf-8")).hexdigest()[:16]
+
+
+def get_pipeline_paths(data_dir: str, file_format: str = "csv", db_format: str = "sqlite", website: str = "szse"):
+    """
+    File system:
+    $data_dir
+        - index_page.csv, detailed_info.csv (or .parquet)
+        - ipo_doc
+            - $website
+                - comp
+                    - *.pdf
+        - prospectus
+            - comp
+                - 招股说明书_%Y-%m-%d.pdf
+        - q_and_a.db (or questions.csv, answers.csv), q_and_a_manifest.json, q_and_a_index.db
+        - combined
+        - logs
+        - pipeline_state.json
+    """
+    if db_format == "sqlite":
+        q_filename = os.path.join(data_dir, "q_and_a.db")
+        a_filename = None
+    else:
+        q_filename = os.path.join(data_dir, "questions.csv")
+        a_filename = os.path.join(data_dir, "answers.csv")
+
+    return {
+        "index_page": os.path.join(data_dir, f"index_page.{file_format}"),
+        "detailed_info": os.path.join(data_dir, f"detailed_info.{file_format}"),
+        "inquiry_dir": os.path.join(data_dir, "ipo_doc"),
+        "inquiry_comp_dir": os.path.join(data_dir, "ipo_doc", website),
+        "prospectus_dir": os.path.join(data_dir, "prospectus"),
+        "q_filename": q_filename,
+        "a_filename": a_filename,
+        "q_and_a_manifest": os.path.join(data_dir, "q_and_a_manifest.json"),
+        "search_index": os.path.join(data_dir, "q_and_a_index.db"),
+        "combined_dir": os.path.join(data_dir, "combined"),
+        "log_dir": os.path.join(data_dir, "logs"),
+        "state": os.path.join(data_dir, STATE_FILENAME),
+    }
+
+
+##### Stages #####
+
+
+def __run_index(config: dict, logger: logging.Logger):
+    from .download_data.retrieve_szse_info import retrieve_index_table
+
+    retrieve_index_table(config["index_url"], save_dir=config["data_dir"], headless=config["headless"],
+                         use_http=config["use_http"], file_format=config["file_format"], logger=logger)
+
+
+def __run_detail_pages(config: dict, logger: logging.Logger):
+    from .download_data.retrieve_szse_info import retrieve_all_detail_pages
+
+    paths = config["paths"]
+    retrieve_all_detail_pages(paths["index_page"], paths["inquiry_comp_dir"], logger, config["data_dir"],
+                              num_processes=config["num_processes"], headless=config["headless"],
+                              use_http=config["use_http"], file_format=config["file_format"])
+
+
+def __run_prospectuses(config: dict, logger: logging.Logger):
+    from .download_data.retrieve_szse_info import retrieve_all_prospectuses
+
+    paths = config["paths"]
+    retrieve_all_prospectuses(paths["detailed_info"], paths["prospectus_dir"], num_processes=config["num_processes"],
+                              headless=config["headless"], use_http=config["use_http"], logger=logger)
+
+
+def __run_q_and_a(config: dict, logger: logging.Logger):
+    from .process_text.q_and_a_database import construct_q_and_a_database_main
+
+    paths = config["paths"]
+    report = construct_q_and_a_database_main(paths["inquiry_dir"], os.path.join(paths["log_dir"], "q_and_a"),
+                                             paths["q_filename"], paths["a_filename"],
+                                             num_workers=config["num_workers"],
+                                             manifest_filename=paths["q_and_a_manifest"],
+                                             index_filename=paths["search_index"])
+    logger.debug(f"q_and_a: {len(report['added'])} added, {len(report['updated'])} updated, "
+                 f"{len(report['removed'])} removed, {len(report['unchanged'])} unchanged")
+
+
+def __run_combine(config: dict, logger: logging.Logger):
+    from .storage import load_table
+    from .process_text.utils import combine_pdf_from_comp_names
+
+    paths = config["paths"]
+    comp_names = list(dict.fromkeys(load_table(paths["detailed_info"], columns=["公司简称"])["公司简称"].tolist()))
+    parts = combine_pdf_from_comp_names(comp_names, paths["prospectus_dir"], paths["inquiry_comp_dir"],
+                                        paths["combined_dir"], max_file_size=config["max_file_size_mb"],
+                                        max_file_size_unit="MB", num_workers=config["num_workers"],
+                                        dedup=config["dedup"])
+    logger.debug(f"combine: {len(parts)} parts")
+
+
+def build_stages(config: dict):
+    """
+    Returns
+    -------
+    list[Stage]: in a topological order
+    """
+    from .process_text.build_manifest import get_patterns_version
+
+    paths = config["paths"]
+    q_and_a_outputs = [paths["q_filename"]] + ([] if paths["a_filename"] is None else [paths["a_filename"]])
+
+    return [
+        # Nothing local to fingerprint: rerun with --force index to refresh the project list
+        Stage("index", __run_index, [], [paths["index_page"]],
+              params={"index_url": config["index_url"]}),
+        Stage("detail_pages", __run_detail_pages, [paths["index_page"]], [paths["detailed_info"]],
+              deps=["index"]),
+        Stage("prospectuses", __run_prospectuses, [paths["detailed_info"]], [paths["prospectus_dir"]],
+              deps=["detail_pages"]),
+        Stage("q_and_a", __run_q_and_a, [paths["inquiry_dir"]], q_and_a_outputs,
+              deps=["detail_pages"], params={"patterns_version": get_patterns_version()}),
+        Stage("combine", __run_combine, [paths["detailed_info"], paths["prospectus_dir"], paths["inquiry_comp_dir"]],
+              [paths["combined_dir"]], deps=["detail_pages", "prospectuses"],
+              params={"max_file_size_mb": config["max_file_size_mb"], "dedup": config["dedup"]}),
+    ]
+
+
+##### State #####
+
+
+def load_state(state_filename: str):
+    """
+    Returns
+    -------
+    {
+        "stages": {
+            name: {
+                "inputs": str,
+                "params": str,
+                "outputs": str,
+                "finished": float (timestamp),
+                "seconds": float,
+            }...
+        }
+    }
+    """
+    if not os.path.isfile(state_filename):
+        return {"stages": {}}
+    with open(state_filename, "r", encoding="utf-8") as rf:
+        return json.load(rf)
+
+
+def save_state(state: dict, state_filename: str):
+    save_json(state, state_filename)
+
+
+def get_stale_reason(stage: Stage, state: dict):
+    """
+    Returns
+    -------
+    str or None: why the stage has to run, None if it is up to date
+    """
+    entry = state["stages"].get(stage.name)
+    if entry is None:
+        return "no previous run"
+    if not all([os.path.exists(path) for path in stage.outputs]):
+        return "outputs missing"
+    if entry["params"] != fingerprint_params(stage.params):
+        return "parameters changed"
+    if entry["inputs"] != fingerprint_paths(stage.inputs):
+        return "inputs changed"
+    if entry["outputs"] != fingerprint_paths(stage.outputs):
+        return "outputs changed"
+
+    return None
+
+
+def plan_pipeline(stages: list, state: dict, selected: list = None, force: list = None):
+    """
+    Dry run: a stage runs if it is selected and forced or stale. A stage that is up to date but downstream of a stage
+    that runs "may run": run_pipeline(.) checks its fingerprints again once the upstream stage is done, and only runs
+    it if the upstream outputs it reads changed. The plan is thus an upper bound of what runs.
+
+    Returns
+    -------
+    {name: str ("run: reason", "may run: upstream ... runs", "up to date" or "not selected")}
+    """
+    selected = [stage.name for stage in stages] if selected is None else selected
+    force = [] if force is None else force
+    plan = {}
+    for stage in stages:
+        if stage.name not in selected:
+            plan[stage.name] = "not selected"
+            continue
+        reason = "forced" if stage.name in force else get_stale_reason(stage, state)
+        if reason is not None:
+            plan[stage.name] = f"run: {reason}"
+            continue
+        upstream = [dep for dep in stage.deps if plan.get(dep, "").startswith(("run", "may run"))]
+        plan[stage.name] = "up to date" if len(upstream) == 0 else f"may run: upstream {', '.join(upstream)} runs"
+
+    return plan
+
+
+def __run_stage(stage: Stage, config: dict):
+    """
+    Runs in the stage's own process, logging to $log_dir/pipeline_{stage}_*.log
+    """
+    logger = create_logger(f"pipeline.{stage.name}", os.path.join(config["paths"]["log_dir"],
+                                                                   f"pipeline_{stage.name}"))
+    start_time = time.perf_counter()
+    with stage_timer(f"stage:{stage.name}"):
+        stage.func(config, logger)
+
+    return time.perf_counter() - start_time
+
+
+def run_pipeline(stages: list, config: dict, logger: logging.Logger, selected: list = None, force: list = None,
+                 max_concurrent_stages: int = 2):
+    """
+    Runs the stale stages, each as soon as its dependencies are finished or up to date. A stage that isn't selected
+    counts as done for its dependents; a failed stage blocks them. The state file is updated after every stage, so an
+    interrupted run resumes from the stages that didn't finish.
+    Stages run in spawned processes (up to max_concurrent_stages at a time), each logging to its own file in
+    $log_dir; logger is for the orchestration.
+
+    Returns
+    -------
+    {
+        name: {
+            "status": str ("done", "up_to_date", "failed", "blocked" or "not_selected"),
+            "reason": str or None (why it ran, or the error),
+            "seconds": float,
+        }...
+    }
+    """
+    selected = [stage.name for stage in stages] if selected is None else selected
+    force = [] if force is None else force
+    state_filename = config["paths"]["state"]
+    state = load_state(state_filename)
+    pending = {stage.name: stage for stage in stages}
+    results = {}
+    futures = {}
+
+    with ProcessPoolExecutor(max_workers=max_concurrent_stages, mp_context=multiprocessing.get_context("spawn")) \
+            as executor:
+        while len(pending) > 0 or len(futures) > 0:
+            # Settling a stage without running it can release its dependents right away
+            changed = True
+            while changed:
+                changed = False
+                for name, stage in list(pending.items()):
+                    dep_statuses = [results[dep]["status"] if dep in results else None for dep in stage.deps]
+                    if any([status in ("failed", "blocked") for status in dep_statuses]):
+                        results[name] = {"status": "blocked", "reason": None, "seconds": 0.}
+                    elif any([status is None for status in dep_statuses]):
+                        continue
+                    elif name not in selected:
+                        results[name] = {"status": "not_selected", "reason": None, "seconds": 0.}
+                    else:
+                        reason = "forced" if name in force else get_stale_reason(stage, state)
+                        if reason is None:
+                            results[name] = {"status": "up_to_date", "reason": None, "seconds": 0.}
+                            logger.debug(f"{name}: up to date")
+                        else:
+                            logger.debug(f"{name}: running ({reason})")
+                            # The inputs are fingerprinted before the run: a change made meanwhile reruns the stage
+                            fingerprints = {
+                                "inputs": fingerprint_paths(stage.inputs),
+                                "params": fingerprint_params(stage.params),
+                            }
+                            future = executor.submit(__run_stage, stage, config)
+                            futures[future] = (stage, reason, fingerprints)
+                    pending.pop(name)
+                    changed = True
+
+            if len(futures) == 0:
+                if len(pending) > 0:
+                    raise ValueError(f"Unresolvable dependencies: {list(pending)}")
+                break
+            done_futures, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done_futures:
+                stage, reason, fingerprints = futures.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    logger.exception(f"{stage.name}: failed")
+                    results[stage.name] = {"status": "failed", "reason": f"{type(e).__name__}: {e}", "seconds": 0.}
+                    continue
+                state["stages"][stage.name] = dict(fingerprints, outputs=fingerprint_paths(stage.outputs),
+                                                   finished=time.time(), seconds=seconds)
+                save_state(state, state_filename)
+                results[stage.name] = {"status": "done", "reason": reason, "seconds": seconds}
+                logger.debug(f"{stage.name}: done in {seconds:.1f}s")
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the download, Q&A extraction and bundling stages, skipping "
+                                                 "those whose outputs are up to date")
+    parser.add_argument("--data-dir", default=os.path.join(ROOT_DIR, "data", "pipeline"))
+    parser.add_argument("--stages", nargs="+", choices=STAGE_NAMES, default=None,
+                        help="Stages to run (default: all); the others count as done")
+    parser.add_argument("--force", nargs="+", choices=STAGE_NAMES + ["all"], default=[],
+                        help="Stages to rerun even if up to date")
+    parser.add_argument("--dry-run", action="store_true", help="Only print which stages would run")
+    parser.add_argument("--index-url", default=SZSE_INDEX_URL)
+    parser.add_argument("--file-format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--db-format", choices=["sqlite", "csv"], default="sqlite")
+    parser.add_argument("--use-http", action="store_true", help="Use the JSON endpoints, with the browser as fallback")
+    parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--num-processes", type=int, default=8, help="Crawler processes per download stage")
+    parser.add_argument("--num-workers", type=int, default=1, help="Processes parsing / bundling pdfs")
+    parser.add_argument("--max-file-size-mb", type=float, default=576.)
+    parser.add_argument("--dedup", choices=["drop", "reference"], default=None,
+                        help="Drop (or replace with a reference) pages repeated within a company's bundle")
+    parser.add_argument("--max-concurrent-stages", type=int, default=2)
+    parser.add_argument("--metrics-dir", default=None, help="Record stage metrics there (see .metrics)")
+    args = parser.parse_args(argv)
+
+    config = {
+        "data_dir": args.data_dir,
+        "paths": get_pipeline_paths(args.data_dir, args.file_format, args.db_format),
+        "index_url": args.index_url,
+        "file_format": args.file_format,
+        "use_http": args.use_http,
+        "headless": args.headless,
+        "num_processes": args.num_processes,
+        "num_workers": args.num_workers,
+        "max_file_size_mb": args.max_file_size_mb,
+        "dedup": args.dedup,
+    }
+    stages = build_stages(config)
+    force = STAGE_NAMES if "all" in args.force else args.force
+
+    if args.dry_run:
+        plan = plan_pipeline(stages, load_state(config["paths"]["state"]), args.stages, force)
+        for name, status in plan.items():
+            print(f"{name}: {status}")
+        return
+
+    if args.metrics_dir is not None:
+        enable(args.metrics_dir)
+    logger = create_logger("pipeline", os.path.join(config["paths"]["log_dir"], "pipeline"))
+    results = run_pipeline(stages, config, logger, args.stages, force, args.max_concurrent_stages)
+    for name, result in results.items():
+        line = f"{name}: {result['status']}"
+        if result["reason"] is not None:
+            line += f" ({result['reason']})"
+        if result["status"] == "done":
+            line += f", {result['seconds']:.1f}s"
+        print(line)
+    if any([result["status"] in ("failed", "blocked") for result in results.values()]):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
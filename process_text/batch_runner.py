@@ -0,0 +1,186 @@
+import requests
+import threading
+import random
+import json
+import time
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from .gpt_api import ErnieAPIError, get_default_client
+from ..metrics import dump_summary
+
+
+class RateLimiter(object):
+    """
+    Token buckets for requests per second and (estimated) tokens per minute; None disables a limit.
+    """
+    def __init__(self, requests_per_second: float = None, tokens_per_minute: float = None):
+        self.requests_per_second = requests_per_second
+        self.tokens_per_minute = tokens_per_minute
+        self.lock = threading.Lock()
+        self.request_allowance = 1. if requests_per_second is None else float(requests_per_second)
+        self.token_allowance = 0. if tokens_per_minute is None else float(tokens_per_minute)
+        self.last_time = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_time
+        self.last_time = now
+        if self.requests_per_second is not None:
+            self.request_allowance = min(float(self.requests_per_second),
+                                         self.request_allowance + elapsed * self.requests_per_second)
+        if self.tokens_per_minute is not None:
+            self.token_allowance = min(float(self.tokens_per_minute),
+                                       self.token_allowance + elapsed * self.tokens_per_minute / 60.)
+
+    def acquire(self, num_tokens: int = 0):
+        """
+        Blocks until a request of num_tokens tokens is allowed. A request larger than the whole minute budget is let
+        through once the bucket is full.
+        """
+        while True:
+            with self.lock:
+                self.refill()
+                wait_time = 0.
+                if self.requests_per_second is not None and self.request_allowance < 1.:
+                    wait_time = (1. - self.request_allowance) / self.requests_per_second
+                if self.tokens_per_minute is not None:
+                    num_tokens_needed = min(float(num_tokens), float(self.tokens_per_minute))
+                    if self.token_allowance < num_tokens_needed:
+                        wait_time = max(wait_time, (num_tokens_needed - self.token_allowance) * 60. /
+                                        self.tokens_per_minute)
+                if wait_time == 0.:
+                    if self.requests_per_second is not None:
+                        self.request_allowance -= 1.
+                    if self.tokens_per_minute is not None:
+                        self.token_allowance -= num_tokens
+                    return
+            time.sleep(wait_time)
+
+
+def estimate_prompt_tokens(prompt: dict):
+    """
+    Rough estimate: one token per character of the message contents.
+    """
+    return sum([len(str(message.get("content", ""))) for message in prompt.get("messages", [])])
+
+
+def load_done_ids(output_filename: str, id_key: str = "request_id"):
+    """
+    Ids with a successful result in the output JSONL. A truncated last line (crash while writing) is ignored.
+    """
+    done_ids = set()
+    if not os.path.isfile(output_filename):
+        return done_ids
+    with open(output_filename, "r", encoding="utf-8") as rf:
+        for line in rf:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "result" in record:
+                done_ids.add(record[id_key])
+
+    return done_ids
+
+
+def is_retriable(e: Exception):
+    if isinstance(e, ErnieAPIError):
+        return e.is_retriable
+
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+
+def run_batch(input_filename: str, output_filename: str, client=None, num_workers: int = 8,
+              requests_per_second: float = None, tokens_per_minute: float = None, max_retries: int = 5,
+              backoff: float = 1., id_key: str = "request_id", prompt_key: str = None):
+    """
+    Streams the prompts of a JSONL file through client.get_response(.) concurrently and appends one line per prompt to
+    output_filename as soon as it finishes:
+        {id_key: ..., "result": str} or {id_key: ..., "error": str}
+    Prompts that already have a result in output_filename are skipped, so a rerun after a crash resumes; failed
+    prompts are tried again. Any other error (e.g. writing output_filename) stops the run and is raised.
+
+    input_filename: one JSON object per line; the prompt payload (e.g. {"messages": [...]}) is record[prompt_key], or
+        the record without id_key if prompt_key is None. Records without id_key are identified by their line number.
+    client: anything with get_response(prompt: dict) -> str, by default .gpt_api.get_default_client()
+
+    Returns
+    -------
+    {
+        "num_done": int,
+        "num_skipped": int,
+        "num_failed": int,
+        "seconds": float,
+    }
+    """
+    if client is None:
+        client = get_default_client()
+    limiter = RateLimiter(requests_per_second, tokens_per_minute)
+    done_ids = load_done_ids(output_filename, id_key)
+    write_lock = threading.Lock()
+    # Bounds the number of prompts read ahead of the workers
+    in_flight = threading.BoundedSemaphore(num_workers * 2)
+    stats = {"num_done": 0, "num_skipped": 0, "num_failed": 0}
+    output_dir = os.path.dirname(output_filename)
+    if len(output_dir) > 0 and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    def run_one(request_id, prompt: dict):
+        out_dict = {id_key: request_id}
+        try:
+            for attempt in range(max_retries + 1):
+                limiter.acquire(estimate_prompt_tokens(prompt))
+                try:
+                    out_dict["result"] = client.get_response(prompt)
+                    break
+                except Exception as e:
+                    if attempt == max_retries or not is_retriable(e):
+                        out_dict["error"] = str(e)
+                        break
+                    time.sleep(random.uniform(0., backoff * 2 ** attempt))
+            with write_lock:
+                wf.write(json.dumps(out_dict, ensure_ascii=False) + "\n")
+                wf.flush()
+                stats["num_done" if "result" in out_dict else "num_failed"] += 1
+        finally:
+            in_flight.release()
+
+    # A crash while writing may have cut the last line short: the next record starts on a new line
+    needs_newline = False
+    if os.path.isfile(output_filename) and os.path.getsize(output_filename) > 0:
+        with open(output_filename, "rb") as rf:
+            rf.seek(-1, os.SEEK_END)
+            needs_newline = rf.read(1) != b"\n"
+
+    start_time = time.perf_counter()
+    futures = set()
+    with open(output_filename, "a", encoding="utf-8") as wf, open(input_filename, "r", encoding="utf-8") as rf, \
+            ThreadPoolExecutor(max_workers=num_workers) as executor:
+        if needs_newline:
+            wf.write("\n")
+        for line_idx, line in enumerate(rf):
+            if len(line.strip()) == 0:
+                continue
+            record = json.loads(line)
+            request_id = record.get(id_key, f"line-{line_idx}")
+            if request_id in done_ids:
+                stats["num_skipped"] += 1
+                continue
+            if prompt_key is None:
+                prompt = {key: val for key, val in record.items() if key != id_key}
+            else:
+                prompt = record[prompt_key]
+            in_flight.acquire()
+            futures.add(executor.submit(run_one, request_id, prompt))
+            done_futures = set([future for future in futures if future.done()])
+            for future in done_futures:
+                # Raises the worker's error, if any
+                future.result()
+            futures -= done_futures
+        for future in futures:
+            future.result()
+    stats["seconds"] = time.perf_counter() - start_time
+    dump_summary()
+
+    return stats
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+
+from typing import List
+from IPODataAnalysis.configs import PATTERNS
+from ..utils import save_json
+
+
+# Bumped when the rows built from a file change while PATTERNS don't, e.g. 2: rounds numbered from "第N轮" in the file
+# name (.utils.get_round_number(.)) instead of 1 or 2
+ROW_FORMAT_VERSION = 2
+
+
+def get_patterns_version():
+    """
+    Hash of the extraction regexes and ROW_FORMAT_VERSION: a change in either invalidates every processed file.
+    """
+    patterns_str = json.dumps({"patterns": PATTERNS, "row_format_version": ROW_FORMAT_VERSION}, sort_keys=True,
+                              ensure_ascii=False)
+
+    return hashlib.sha256(patterns_str.encode("utf-8")).hexdigest()[:16]
+
+
+def hash_file(filename: str, block_size: int = 1 << 20):
+    hasher = hashlib.sha256()
+    with open(filename, "rb") as rf:
+        for block in iter(lambda: rf.read(block_size), b""):
+            hasher.update(block)
+
+    return hasher.hexdigest()
+
+
+def load_manifest(manifest_filename: str):
+    """
+    Returns
+    -------
+    {
+        "patterns_version": str,
+        "files": {
+            filename: {
+                "size": int,
+                "mtime": float,
+                "sha256": str,
+                "status": str ("ok" or "error"),
+            }...
+        }
+    }
+    """
+    if not os.path.isfile(manifest_filename):
+        return {"patterns_version": None, "files": {}}
+    with open(manifest_filename, "r", encoding="utf-8") as rf:
+        manifest = json.load(rf)
+
+    return manifest
+
+
+def save_manifest(manifest: dict, manifest_filename: str):
+    save_json(manifest, manifest_filename)
+
+
+def diff_manifest(manifest: dict, filenames: List[str]):
+    """
+    Compares the files on disk with the manifest. The content hash is only computed when size or mtime changed.
+
+    Returns
+    -------
+    {
+        "added": list[str],
+        "updated": list[str],
+        "removed": list[str],
+        "unchanged": list[str],
+        "fingerprints": {filename: {"size": int, "mtime": float, "sha256": str}} (of added and updated files),
+    }
+    """
+    patterns_changed = manifest["patterns_version"] != get_patterns_version()
+    old_entries = manifest["files"]
+    report = {
+        "added": [],
+        "updated": [],
+        "removed": sorted(set(old_entries) - set(filenames)),
+        "unchanged": [],
+        "fingerprints": {},
+    }
+
+    for filename in filenames:
+        stat = os.stat(filename)
+        fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime}
+        old_entry = old_entries.get(filename)
+        if old_entry is None:
+            fingerprint["sha256"] = hash_file(filename)
+            report["added"].append(filename)
+            report["fingerprints"][filename] = fingerprint
+            continue
+        if old_entry["size"] == fingerprint["size"] and old_entry["mtime"] == fingerprint["mtime"]:
+            fingerprint["sha256"] = old_entry["sha256"]
+        else:
+            fingerprint["sha256"] = hash_file(filename)
+        if patterns_changed or fingerprint["sha256"] != old_entry["sha256"]:
+            report["updated"].append(filename)
+            report["fingerprints"][filename] = fingerprint
+        else:
+            # Refresh a touched but identical file so it isn't hashed again next time
+            old_entry.update(fingerprint)
+            report["unchanged"].append(filename)
+
+    return report
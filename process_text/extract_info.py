@@ -1,12 +1,132 @@
-import fitz
 import sys
 import re
 
 from ..global_configs import ROOT_DIR
+from ..metrics import timed
 from IPODataAnalysis.configs import PATTERNS
 
 
-def extract_content(doc: fitz.Document):
+class PageTextCache(object):
+    """
+    Lazy per-document store of page texts: each page is decoded at most once.
+    """
+    def __init__(self, doc: "fitz.Document"):
+        self.doc = doc
+        self.texts = [None] * len(doc)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.texts)
+
+    def get_text(self, page_idx: int):
+        text = self.texts[page_idx]
+        if text is None:
+            self.misses += 1
+            text = self.doc.load_page(page_idx).get_text()
+            self.texts[page_idx] = text
+        else:
+            self.hits += 1
+
+        return text
+
+    def stats(self):
+        """
+        Returns
+        -------
+        {
+            "hits": int,
+            "misses": int,
+            "num_pages": int,
+        }
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "num_pages": len(self.texts),
+        }
+
+
+def get_page_text_cache(doc: "fitz.Document") -> PageTextCache:
+    """
+    Returns the PageTextCache memoized on doc, creating it on first use. The cache lives as long as doc does.
+    """
+    page_cache = getattr(doc, "_page_text_cache", None)
+    if page_cache is None:
+        page_cache = PageTextCache(doc)
+        doc._page_text_cache = page_cache
+
+    return page_cache
+
+
+class DocumentScanner(object):
+    """
+    Positioned event stream over a document: every match of the PATTERNS in SCAN_KINDS as a dict
+    {
+        "kind": str (e.g. "reply"),
+        "page": int,
+        "start": int (char offset in the page text),
+        "end": int,
+        "text": str,
+    }
+    Each page is decoded once (through its PageTextCache) and each pattern runs over it at most once, however many
+    question ranges the page belongs to.
+    """
+    SCAN_KINDS = ("content_entry", "reply", "subtitle")
+
+    def __init__(self, doc: "fitz.Document"):
+        self.page_cache = get_page_text_cache(doc)
+        self.patterns = {kind: re.compile(PATTERNS[kind]) for kind in self.SCAN_KINDS}
+        self.events = [dict() for _ in range(len(self.page_cache))]
+
+    def __len__(self):
+        return len(self.page_cache)
+
+    def get_events(self, page_idx: int, kind: str):
+        """
+        Returns
+        -------
+        list[dict]: events of the kind on the page, in order of their offsets
+        """
+        page_events = self.events[page_idx]
+        if kind not in page_events:
+            page_text = self.page_cache.get_text(page_idx)
+            page_events[kind] = [{
+                "kind": kind,
+                "page": page_idx,
+                "start": match.start(),
+                "end": match.end(),
+                "text": match.group(),
+            } for match in self.patterns[kind].finditer(page_text)]
+
+        return page_events[kind]
+
+    def scan(self, kinds=SCAN_KINDS, start_page: int = 0, end_page: int = None):
+        """
+        Yields the events of the kinds on pages start_page to end_page (inclusive, default: last page), ordered by
+        (page, start).
+        """
+        if end_page is None:
+            end_page = len(self) - 1
+        for page_idx in range(start_page, end_page + 1):
+            page_events = [event for kind in kinds for event in self.get_events(page_idx, kind)]
+            yield from sorted(page_events, key=lambda event: event["start"])
+
+
+def get_document_scanner(doc: "fitz.Document") -> DocumentScanner:
+    """
+    Returns the DocumentScanner memoized on doc, like get_page_text_cache(.).
+    """
+    scanner = getattr(doc, "_document_scanner", None)
+    if scanner is None:
+        scanner = DocumentScanner(doc)
+        doc._document_scanner = scanner
+
+    return scanner
+
+
+@timed(items=lambda out, *args, **kwargs: len(out))
+def extract_content(doc: "fitz.Document"):
     """
     output:
     {
@@ -17,32 +137,21 @@ def extract_content(doc: fitz.Document):
         }
     }
     """
-    content_entry_pattern = re.compile(PATTERNS["content_entry"])
-    content_pages = []
+    scanner = get_document_scanner(doc)
     content_page_ids = []
-    has_found_content = False
     for page_id in range(len(doc)):
-        page = doc.load_page(page_id)
-        matches = re.findall(content_entry_pattern, page.get_text())
-        if len(matches) == 0 and has_found_content:
+        has_entries = len(scanner.get_events(page_id, "content_entry")) > 0
+        if not has_entries and len(content_page_ids) > 0:
             break
-        if len(matches) > 0:
-            content_pages.append(page)
+        if has_entries:
             content_page_ids.append(page_id)
-            has_found_content = True
 
-    # print(page_id)
-    # print(content_pages)
     content_page_end_id = content_page_ids[-1]
     res = []
-    for page in content_pages:
-        matches = re.findall(content_entry_pattern, page.get_text())
-        links = page.get_links()
+    for page_id in content_page_ids:
+        matches = [event["text"] for event in scanner.get_events(page_id, "content_entry")]
+        links = doc.load_page(page_id).get_links()
         links = list(filter(lambda link: link["page"] > content_page_end_id, links))
-        # first_page = doc.load_page(links[0]["page"])
-        # content_matches = re.findall(re.compile(r"\.{3,}"), first_page.get_text())
-        # if len(content_matches) > 0:
-        #     links = links[1:]
         for match, link in zip(matches, links):  # The first link is to the content table
             match = re.sub(r"[\n\.]", "", match)
             match = match.strip()
@@ -63,9 +172,10 @@ def extract_content(doc: fitz.Document):
     return res
 
 
-def extract_q_and_a(doc: fitz.Document, content_res: list):
+def extract_q_and_a(doc: "fitz.Document", content_res: list):
     """
     content_res is output of extract_content(.)
+    Consecutive questions share their boundary page; its events are scanned once, see DocumentScanner.
 
     Returns
     -------
@@ -96,8 +206,9 @@ def extract_q_and_a(doc: fitz.Document, content_res: list):
     return res
 
 
-def process_ans(doc: fitz.Document, start_page: int, end_page: int, reply_str: str, buffer=100):
+def process_ans(doc: "fitz.Document", start_page: int, end_page: int, reply_end: int, buffer=100):
     """
+    reply_end: char offset right after the reply marker on start_page; subtitles before it are skipped
     buffer: heuristic to include multiline subtitle
 
     Returns
@@ -109,26 +220,23 @@ def process_ans(doc: fitz.Document, start_page: int, end_page: int, reply_str: s
         }...
     ]
     """
-    subtitle_pattern = re.compile(PATTERNS["subtitle"])
+    scanner = get_document_scanner(doc)
     res = []
 
-    for i, page_idx in enumerate(range(start_page, end_page + 1)):
-        page_str = doc.load_page(page_idx).get_text()
-        if i == 0:
-            sep_idx = page_str.find(reply_str)
-            page_str = page_str[sep_idx + len(reply_str):]
-        matches = re.findall(subtitle_pattern, page_str)
-        for match in matches:
-            sep_idx = page_str.find(match)
-            res.append({
-                "page": page_idx,
-                "subtitle": page_str[sep_idx:sep_idx + buffer].strip(),
-            })
+    for event in scanner.scan(["subtitle"], start_page, end_page):
+        if event["page"] == start_page and event["start"] < reply_end:
+            continue
+        page_str = scanner.page_cache.get_text(event["page"])
+        res.append({
+            "page": event["page"],
+            "subtitle": page_str[event["start"]:event["start"] + buffer].strip(),
+        })
 
     return res
 
 
-def process_q_and_a(doc: fitz.Document, start_page: int, end_page: int):
+@timed(items=lambda out, *args, **kwargs: len(out["ans_collection"]))
+def process_q_and_a(doc: "fitz.Document", start_page: int, end_page: int):
     """
     Returns
     -------
@@ -138,37 +246,35 @@ def process_q_and_a(doc: fitz.Document, start_page: int, end_page: int):
     }
     """
     # Find "回复：" pattern
-    reply_pattern = re.compile(PATTERNS["reply"])
-    reply_page_idx = -1
-    reply_str = None
+    scanner = get_document_scanner(doc)
+    reply_event = None
     for page_idx in range(start_page, end_page + 1):
-        page = doc.load_page(page_idx)
-        page_text = page.get_text()
-        matches = re.findall(reply_pattern, page_text)
-        if len(matches) > 0:
-            reply_page_idx = page_idx
-            reply_str = matches[0]
+        reply_events = scanner.get_events(page_idx, "reply")
+        if len(reply_events) > 0:
+            reply_event = reply_events[0]
             break
-    # print(repr(reply_str))
-    if reply_page_idx == -1:
+    if reply_event is None:
         raise IndexError("Cannot find '回复：' pattern!")
+    reply_page_idx = reply_event["page"]
 
     res = {}
     # Store the question
     q_str = ""
     for page_idx in range(start_page, reply_page_idx):
-        page = doc.load_page(page_idx)
-        q_str += page.get_text()
-    page = doc.load_page(page_idx)
-    page_str = page.get_text()
-    sep_idx = page_str.find(reply_str)
-    q_str += page_str[:sep_idx]
+        q_str += scanner.page_cache.get_text(page_idx)
+    if page_idx == reply_page_idx:
+        sep_idx = reply_event["start"]
+    else:
+        # Kept from the original parsing for unchanged output: when the reply starts on a later page, the tail is
+        # cut from the page before it, at the (usually absent) reply marker
+        sep_idx = scanner.page_cache.get_text(page_idx).find(reply_event["text"])
+    q_str += scanner.page_cache.get_text(page_idx)[:sep_idx]
     res["question_long"] = q_str
 
     # Store the reply
     # Ignore the last page since there's no sufficient content to make a substantial subsection
     # in order to prevent overlap with the next question
-    ans_list = process_ans(doc, reply_page_idx, end_page - 1, reply_str)
+    ans_list = process_ans(doc, reply_page_idx, end_page - 1, reply_event["end"])
     res["ans_collection"] = ans_list
 
     return res
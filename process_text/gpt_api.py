@@ -1,38 +1,229 @@
 import requests
+import threading
 import json
+import time
 
+from requests.adapters import HTTPAdapter
+from collections import deque
 from ..global_configs import ROOT_DIR
+from .response_cache import ResponseCache, make_key
+from ..metrics import timed
+from IPODataAnalysis.configs import get_config
 
-API_FILENAME = r"D:\testings\Python\TestingPython\IPODataAnalysis\data\configs\api_keys.json"
-with open(API_FILENAME, "r") as rf:
-    API_DICT = json.load(rf)
-URL = f"https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id={API_DICT['api_key']}&" \
-      f"client_secret={API_DICT['secret_key']}"
+# The keys are read on first use: $IPO_API_KEY / $IPO_SECRET_KEY, else the config file, else the JSON file at
+# get_config("API_KEYS_FILENAME") ({"api_key": ..., "secret_key": ...})
+__API_DICT = {}
 MODEL_URL = "https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/ernie-speed-128k?access_token={access_token}"
+TOKEN_URL = "https://aip.baidubce.com/oauth/2.0/token"
+# Error codes of an invalid or expired access token
+TOKEN_ERROR_CODES = (110, 111)
+# Error codes worth retrying later: internal errors and QPS / RPM / TPM limits
+RETRIABLE_ERROR_CODES = (2, 18, 336000, 336100, 336501, 336502)
 
 
-def get_access_token():
-    payload = json.dumps("")
-    headers = {
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
+class ErnieAPIError(ValueError):
+    def __init__(self, message: str, status_code: int = None, error_code: int = None):
+        super(ErnieAPIError, self).__init__(message)
+        self.status_code = status_code
+        self.error_code = error_code
+
+    @property
+    def is_retriable(self):
+        return self.error_code in RETRIABLE_ERROR_CODES or self.status_code == 429 or \
+            (self.status_code is not None and self.status_code >= 500)
+
+
+class ErnieClient(object):
+    """
+    Caches the access token until refresh_margin seconds before it expires and sends every request through one
+    pooled session. Safe to share between threads: an expired token is refreshed once, under a lock.
+    cache: if given, replies are looked up in / stored to it, keyed by the prompt and model_url
+    max_latencies: number of latest latencies kept per kind for latency_stats(.)
+    """
+    def __init__(self, api_key: str, secret_key: str, token_url: str = TOKEN_URL, model_url: str = MODEL_URL,
+                 refresh_margin: float = 300., timeout: float = 120., pool_maxsize: int = 16,
+                 cache: ResponseCache = None, max_latencies: int = 10000):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.token_url = token_url
+        self.model_url = model_url
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+        self.cache = cache
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.access_token = None
+        self.expires_at = 0.
+        self.latencies = {"token": deque(maxlen=max_latencies), "chat": deque(maxlen=max_latencies)}
+        # Per thread: concurrent calls don't overwrite each other's latency
+        self.local = threading.local()
+
+    @property
+    def last_latency(self):
+        """
+        Latency (seconds) of the calling thread's last chat request, None before the first one
+        """
+        return getattr(self.local, "last_latency", None)
+
+    def is_token_valid(self):
+        return self.access_token is not None and time.time() < self.expires_at - self.refresh_margin
+
+    def get_access_token(self, force_refresh: bool = False):
+        if not force_refresh and self.is_token_valid():
+            return self.access_token
+
+        old_token = self.access_token
+        with self.lock:
+            # Another thread may have refreshed it while this one was waiting
+            if self.is_token_valid() and (not force_refresh or self.access_token != old_token):
+                return self.access_token
+            params = {
+                "grant_type": "client_credentials",
+                "client_id": self.api_key,
+                "client_secret": self.secret_key,
+            }
+            headers = {
+                'Content-Type': 'application/json',
+                'Accept': 'application/json'
+            }
+            start_time = time.perf_counter()
+            response = self.session.post(self.token_url, params=params, headers=headers, data=json.dumps(""),
+                                         timeout=self.timeout)
+            self.latencies["token"].append(time.perf_counter() - start_time)
+            resp_dict = response.json()
+            if "access_token" not in resp_dict:
+                raise ValueError(f"Unsuccessful to retrieve an access token: {resp_dict}")
+            self.access_token = resp_dict["access_token"]
+            self.expires_at = time.time() + float(resp_dict.get("expires_in", 30 * 24 * 3600))
+
+            return self.access_token
+
+    @timed()
+    def get_response(self, prompt: dict, use_cache: bool = True):
+        """
+        use_cache: False bypasses the cache for both lookup and storage
+
+        Returns
+        -------
+        str: the model's reply; the latency of the call is in .last_latency (seconds), for the calling thread
+        """
+        if self.cache is None or not use_cache:
+            return self.request_response(prompt)
+
+        key = make_key(prompt, self.model_url)
+        with self.cache.key_lock(key):
+            result = self.cache.get(key)
+            if result is None:
+                result = self.request_response(prompt)
+                self.cache.put(key, result)
+
+        return result
+
+    def request_response(self, prompt: dict):
+        payload = json.dumps(prompt)
+        headers = {
+            'Content-Type': 'application/json'
+        }
 
-    response = requests.request("POST", URL, headers=headers, data=payload)
+        for attempt in range(2):
+            post_url = self.model_url.format(access_token=self.get_access_token(force_refresh=attempt > 0))
+            start_time = time.perf_counter()
+            response = self.session.post(post_url, headers=headers, data=payload, timeout=self.timeout)
+            self.local.last_latency = time.perf_counter() - start_time
+            self.latencies["chat"].append(self.local.last_latency)
+            try:
+                resp_dict = json.loads(response.text)
+            except ValueError:
+                raise ErnieAPIError(f"Unsuccessful to retrieve a reply: HTTP {response.status_code}",
+                                    status_code=response.status_code)
+            if resp_dict.get("error_code") not in TOKEN_ERROR_CODES:
+                break
+        if "result" not in resp_dict:
+            raise ErnieAPIError(f"Unsuccessful to retrieve a reply: {resp_dict.get('error_msg')}",
+                                status_code=response.status_code, error_code=resp_dict.get("error_code"))
 
-    return response.json().get("access_token")
+        return resp_dict["result"]
 
+    def latency_stats(self):
+        """
+        Over the last max_latencies requests of each kind
 
-def get_response(prompt: dict):
-    payload = json.dumps(prompt)
-    headers = {
-        'Content-Type': 'application/json'
-    }
+        Returns
+        -------
+        {
+            "token": {"count": int, "mean": float, "max": float},
+            "chat": {"count": int, "mean": float, "max": float},
+        }
+        """
+        stats = {}
+        for kind, latencies in self.latencies.items():
+            latencies = list(latencies)
+            stats[kind] = {
+                "count": len(latencies),
+                "mean": sum(latencies) / len(latencies) if len(latencies) > 0 else 0.,
+                "max": max(latencies) if len(latencies) > 0 else 0.,
+            }
+
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+def get_api_dict():
+    """
+    Returns
+    -------
+    {"api_key": str, "secret_key": str}
+    """
+    if len(__API_DICT) == 0:
+        api_key, secret_key = get_config("API_KEY"), get_config("SECRET_KEY")
+        if api_key is None or secret_key is None:
+            with open(get_config("API_KEYS_FILENAME"), "r") as rf:
+                api_dict = json.load(rf)
+            api_key, secret_key = api_dict["api_key"], api_dict["secret_key"]
+        __API_DICT.update({"api_key": api_key, "secret_key": secret_key})
+
+    return __API_DICT
+
+
+def __getattr__(name: str):
+    # The former import-time constants
+    if name == "API_DICT":
+        return get_api_dict()
+    if name == "API_FILENAME":
+        return get_config("API_KEYS_FILENAME")
+    if name == "URL":
+        api_dict = get_api_dict()
+        return f"{TOKEN_URL}?grant_type=client_credentials&client_id={api_dict['api_key']}&" \
+               f"client_secret={api_dict['secret_key']}"
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__DEFAULT_CLIENT = None
+__DEFAULT_CLIENT_LOCK = threading.Lock()
+
+
+def get_default_client() -> ErnieClient:
+    global __DEFAULT_CLIENT
+    with __DEFAULT_CLIENT_LOCK:
+        if __DEFAULT_CLIENT is None:
+            api_dict = get_api_dict()
+            __DEFAULT_CLIENT = ErnieClient(api_dict["api_key"], api_dict["secret_key"])
+
+    return __DEFAULT_CLIENT
+
+
+def get_access_token():
+    return get_default_client().get_access_token()
 
-    post_url = MODEL_URL.format(access_token=get_access_token())
-    response = requests.request("POST", post_url, headers=headers, data=payload)
-    resp_dict = json.loads(response.text)
-    if "result" not in resp_dict:
-        raise ValueError("Unsuccessful to retrieve a reply")
 
-    return resp_dict["result"]
+def get_response(prompt: dict, use_cache: bool = True):
+    """
+    Set get_default_client().cache to a .response_cache.ResponseCache to cache the replies.
+    """
+    return get_default_client().get_response(prompt, use_cache)
@@ -0,0 +1,163 @@
+import hashlib
+import os
+
+from typing import List
+
+
+# Exact-duplicate pages within a company's bundle: the cover and boilerplate pages and the financial tables repeated
+# between the prospectus and the reply letters of successive rounds. A page is identified by its text and the digests
+# of its image streams (image xrefs differ between files, their streams don't); pages without either are never
+# treated as duplicates. The first occurrence, in bundle order, is kept.
+
+DEDUP_MODES = ("drop", "reference")
+STUB_FONT_NAME = "china-s"
+STUB_TEXT = "本页与《{filename}》第{page}页相同，已省略。"
+
+
+def hash_pdf_pages(filename: str):
+    """
+    Returns
+    -------
+    list[dict or None]: per page (None for a page without text and images)
+    {
+        "hash": str,
+        "content_bytes": int (raw size of the page's content streams),
+        "images": {digest: raw size of the image stream},
+    }
+    """
+    import fitz
+
+    out = []
+    with fitz.open(filename) as doc:
+        image_infos = {}
+        for page in doc:
+            text = page.get_text("text")
+            image_xrefs = [image[0] for image in page.get_images(full=True)]
+            if len(text.strip()) == 0 and len(image_xrefs) == 0:
+                out.append(None)
+                continue
+            hasher = hashlib.sha256(text.encode("utf-8"))
+            images = {}
+            for xref in image_xrefs:
+                if xref not in image_infos:
+                    image_stream = doc.xref_stream_raw(xref) or b""
+                    image_infos[xref] = (hashlib.sha256(image_stream).hexdigest(), len(image_stream))
+                digest, num_bytes = image_infos[xref]
+                hasher.update(f"\nimage:{digest}".encode("utf-8"))
+                images[digest] = num_bytes
+            out.append({
+                "hash": hasher.hexdigest(),
+                "content_bytes": sum([len(doc.xref_stream_raw(xref) or b"") for xref in page.get_contents()]),
+                "images": images,
+            })
+
+    return out
+
+
+def plan_comp_dedup(filenames: List[str]):
+    """
+    filenames: the sources of one company in bundle order (see .utils.get_comp_pdf_filenames(.))
+
+    Returns
+    -------
+    {
+        filename: {
+            "num_pages": int,
+            "keep_pages": list[int],
+            "elided": [
+                {
+                    "page": int,
+                    "duplicate_of": {"filename": str, "page": int},
+                    "bytes_saved": int (estimated),
+                }...
+            ],
+        }...
+    }
+    Bytes saved: the content streams of the elided page and its images that no kept page of the company uses.
+    """
+    page_infos = {filename: hash_pdf_pages(filename) for filename in filenames}
+    first_seen = {}
+    kept_images = set()
+    plan = {}
+    for filename in filenames:
+        plan[filename] = {"num_pages": len(page_infos[filename]), "keep_pages": [], "elided": []}
+        for page_idx, page_info in enumerate(page_infos[filename]):
+            if page_info is None or page_info["hash"] not in first_seen:
+                if page_info is not None:
+                    first_seen[page_info["hash"]] = {"filename": filename, "page": page_idx}
+                    kept_images.update(page_info["images"])
+                plan[filename]["keep_pages"].append(page_idx)
+                continue
+            plan[filename]["elided"].append({
+                "page": page_idx,
+                "duplicate_of": first_seen[page_info["hash"]],
+            })
+
+    # Only known once every kept page has been seen
+    for filename in filenames:
+        for elided in plan[filename]["elided"]:
+            page_info = page_infos[filename][elided["page"]]
+            elided["bytes_saved"] = page_info["content_bytes"] + \
+                sum([num_bytes for digest, num_bytes in page_info["images"].items() if digest not in kept_images])
+
+    return plan
+
+
+def __plan_comp_dedup_star(args):
+    return plan_comp_dedup(*args)
+
+
+def plan_dedup(comp_filenames: List[List[str]], num_workers: int = 1):
+    """
+    comp_filenames: sources of each company; companies are deduplicated independently, in parallel if num_workers > 1
+
+    Returns
+    -------
+    {filename: output of plan_comp_dedup(.) for the file}
+    """
+    args_all = [(filenames,) for filenames in comp_filenames if len(filenames) > 0]
+    if num_workers > 1:
+        from multiprocessing import Pool
+
+        with Pool(processes=num_workers) as pool:
+            comp_plans = pool.map(__plan_comp_dedup_star, args_all)
+    else:
+        comp_plans = map(__plan_comp_dedup_star, args_all)
+    plan = {}
+    for comp_plan in comp_plans:
+        plan.update(comp_plan)
+
+    return plan
+
+
+def apply_page_selection(doc, selection: dict, mode: str = "drop"):
+    """
+    Applies a file's entry of plan_comp_dedup(.) to the opened fitz.Document, in memory, before it is inserted into a
+    bundle.
+    mode: "drop" removes the duplicate pages; "reference" replaces each one with a one-line page naming the original,
+        so that the page numbers (and the page references of the Q&A DB) stay valid
+
+    Returns
+    -------
+    bool: False if no page is left, i.e. the file is to be skipped
+    """
+    if len(selection["elided"]) == 0:
+        return True
+    if mode == "drop":
+        if len(selection["keep_pages"]) == 0:
+            return False
+        # Links between kept pages are kept
+        doc.select(selection["keep_pages"])
+        return True
+    if mode != "reference":
+        raise ValueError(f"Unknown dedup mode: {mode}")
+    for elided in selection["elided"]:
+        page_idx = elided["page"]
+        rect = doc[page_idx].rect
+        doc.delete_page(page_idx)
+        stub_page = doc.new_page(pno=page_idx, width=rect.width, height=rect.height)
+        stub_page.insert_text((56, 72), STUB_TEXT.format(filename=os.path.basename(elided["duplicate_of"]["filename"]),
+                                                         page=elided["duplicate_of"]["page"] + 1),
+                              fontname=STUB_FONT_NAME, fontsize=10)
+
+    return True
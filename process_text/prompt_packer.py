@@ -0,0 +1,265 @@
+import math
+import json
+import re
+import os
+
+from typing import List
+from .q_and_a_database import QAndAQueryEngine
+
+
+# Packs the Q&A records of each company into as few ernie-speed-128k requests as fit the context budget, instead of
+# one small prompt per question. The output is a JSONL batch for .batch_runner.run_batch(.) plus a mapping from each
+# request to the (website, comp, round_number, question_num) of the records in it. Each record in a prompt starts with
+# a reference like [R1-Q3] (round 1, question 3) so that the reply can be matched back.
+
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+WHITE_SPACE_PATTERN = re.compile(r"\s")
+SENTENCE_END_PATTERN = re.compile(r"(?<=[。；！？])")
+# ernie-speed-128k: 128k context, part of which is left for the reply
+DEFAULT_MAX_PROMPT_TOKENS = 120000
+DEFAULT_INSTRUCTION = "以下为{comp}审核问询函中的问题及回复要点，每条记录以[编号]开头，标注“续”的为同一问题的后续部分。" \
+                      "请按编号逐条分析，并在每条分析前标注对应编号。"
+RECORD_SEPARATOR = "\n\n"
+# Headroom per part for the "（续 k/n）" marks added after splitting
+PART_MARK_TOKENS = 16
+
+
+def estimate_tokens(text: str, cjk_tokens_per_char: float = 1., chars_per_token: float = 4.):
+    """
+    Tokenizer-free estimate, erring on the high side: one token per CJK character (ERNIE averages fewer) and one per
+    chars_per_token other non-whitespace characters.
+    """
+    if not isinstance(text, str) or len(text) == 0:
+        return 0
+    num_cjk = len(CJK_PATTERN.findall(text))
+    num_white_space = len(WHITE_SPACE_PATTERN.findall(text))
+    num_other = len(text) - num_cjk - num_white_space
+
+    return int(math.ceil(num_cjk * cjk_tokens_per_char + num_other / chars_per_token))
+
+
+def make_ref(round_number: int, question_num: int):
+    return f"R{int(round_number)}-Q{int(question_num)}"
+
+
+def __split_piece(text: str, budget: int):
+    """
+    Splits a paragraph exceeding budget at sentence ends, then, for a sentence still too long, every budget chars.
+    """
+    if estimate_tokens(text) <= budget:
+        return [text]
+    pieces = []
+    for sentence in SENTENCE_END_PATTERN.split(text):
+        if len(sentence) == 0:
+            continue
+        if estimate_tokens(sentence) <= budget:
+            pieces.append(sentence)
+            continue
+        pieces += [sentence[i:i + budget] for i in range(0, len(sentence), budget)]
+
+    return pieces
+
+
+def format_record(entry: dict, budget: int):
+    """
+    entry: output of QAndAQueryEngine.query_one(.)
+    budget: max tokens per part
+
+    Returns
+    -------
+    list[str]: the record as one text, or as parts if it doesn't fit the budget. Parts are cut on subtitle boundaries
+        of the answer (falling back to lines and sentences of question_long / of a single overlong subtitle), and each
+        part after the first repeats the question.
+    """
+    ref = make_ref(entry["round_number"], entry["question_num"])
+    header = f"[{ref}] 问题：{entry['question']}"
+    question_long = entry.get("question_long")
+    answer = entry.get("answer")
+    body_pieces = []
+    if isinstance(question_long, str) and len(question_long.strip()) > 0:
+        body_pieces += [line for line in question_long.split("\n") if len(line.strip()) > 0]
+    body_pieces.append("回复要点：")
+    if isinstance(answer, str):
+        # .q_and_a_database joins the subtitles with blank lines
+        body_pieces += [subtitle for subtitle in answer.split("\n\n") if len(subtitle) > 0]
+
+    text = "\n".join([header] + body_pieces)
+    if estimate_tokens(text) <= budget:
+        return [text]
+
+    part_budget = budget - estimate_tokens(header) - PART_MARK_TOKENS
+    if part_budget <= 0:
+        raise ValueError(f"Budget of {budget} tokens is too small for the question of {ref}")
+    parts = []
+    part_pieces = []
+    part_tokens = 0
+    for body_piece in body_pieces:
+        for piece in __split_piece(body_piece, part_budget):
+            piece_tokens = estimate_tokens(piece) + 1
+            if len(part_pieces) > 0 and part_tokens + piece_tokens > part_budget:
+                parts.append(part_pieces)
+                part_pieces = []
+                part_tokens = 0
+            part_pieces.append(piece)
+            part_tokens += piece_tokens
+    parts.append(part_pieces)
+
+    return [f"{header}（续 {i + 1}/{len(parts)}）\n" + "\n".join(pieces) if i > 0 else
+            f"{header}（{i + 1}/{len(parts)}）\n" + "\n".join(pieces) for i, pieces in enumerate(parts)]
+
+
+def pack_items(item_tokens: List[int], capacity: int):
+    """
+    First-fit decreasing bin packing.
+
+    Returns
+    -------
+    list[list[int]]: indices of the items in each bin, bins in order of creation, indices ascending within a bin
+    """
+    bins = []
+    bin_loads = []
+    for idx in sorted(range(len(item_tokens)), key=lambda i: (-item_tokens[i], i)):
+        for bin_idx, load in enumerate(bin_loads):
+            if load + item_tokens[idx] <= capacity:
+                bins[bin_idx].append(idx)
+                bin_loads[bin_idx] += item_tokens[idx]
+                break
+        else:
+            bins.append([idx])
+            bin_loads.append(item_tokens[idx])
+
+    return [sorted(bin_iter) for bin_iter in bins]
+
+
+def pack_comp_records(entries: List[dict], max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS,
+                      instruction: str = DEFAULT_INSTRUCTION):
+    """
+    entries: output of QAndAQueryEngine.query_comp(.), i.e. the records of one company
+    instruction: prepended to every prompt, formatted with comp
+
+    Returns
+    -------
+    [
+        {
+            "content": str,
+            "tokens": int (estimated),
+            "records": [
+                {
+                    "website": str,
+                    "comp": str,
+                    "round_number": int,
+                    "question_num": int,
+                    "ref": str,
+                    "part": int,
+                    "num_parts": int,
+                }...
+            ],
+        }...
+    ]
+    """
+    if len(entries) == 0:
+        return []
+    instruction_text = instruction.format(comp=entries[0]["comp"])
+    separator_tokens = estimate_tokens(RECORD_SEPARATOR) + 1
+    capacity = max_prompt_tokens - estimate_tokens(instruction_text) - separator_tokens
+    items = []
+    for entry in entries:
+        parts = format_record(entry, capacity - separator_tokens)
+        for part_idx, part in enumerate(parts):
+            items.append({
+                "text": part,
+                "tokens": estimate_tokens(part) + separator_tokens,
+                "record": {
+                    "website": entry["website"],
+                    "comp": entry["comp"],
+                    "round_number": int(entry["round_number"]),
+                    "question_num": int(entry["question_num"]),
+                    "ref": make_ref(entry["round_number"], entry["question_num"]),
+                    "part": part_idx + 1,
+                    "num_parts": len(parts),
+                },
+            })
+
+    # Items keep the (round_number, question_num, part) order within a request
+    requests = []
+    for bin_iter in pack_items([item["tokens"] for item in items], capacity):
+        content = RECORD_SEPARATOR.join([instruction_text] + [items[idx]["text"] for idx in bin_iter])
+        requests.append({
+            "content": content,
+            "tokens": estimate_tokens(content),
+            "records": [items[idx]["record"] for idx in bin_iter],
+        })
+
+    return requests
+
+
+def build_packed_batch(q_filename: str, a_filename: str, requests_filename: str, mapping_filename: str,
+                       comps: List[str] = None, website: str = None,
+                       max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS, instruction: str = DEFAULT_INSTRUCTION):
+    """
+    Writes one prompt per packed request to requests_filename, in the input format of .batch_runner.run_batch(.):
+        {"request_id": "szse-comp-0001", "messages": [{"role": "user", "content": str}]}
+    and the records of each request to mapping_filename (JSON):
+        {request_id: list[dict] (the "records" of pack_comp_records(.))}
+    comps, website: restrict to these companies / this website
+
+    Returns
+    -------
+    {
+        "num_records": int,
+        "num_split_records": int,
+        "num_requests": int,
+        "total_tokens": int,
+        "max_tokens": int,
+        "fill_ratio": float (mean estimated tokens per request / max_prompt_tokens),
+    }
+    """
+    engine = QAndAQueryEngine(q_filename, a_filename)
+    comp_keys = sorted(engine.comp_index)
+    if website is not None:
+        comp_keys = [comp_key for comp_key in comp_keys if comp_key[0] == website]
+    if comps is not None:
+        comp_keys = [comp_key for comp_key in comp_keys if comp_key[1] in set(comps)]
+
+    for filename in [requests_filename, mapping_filename]:
+        dir_name = os.path.dirname(filename)
+        if len(dir_name) > 0 and not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+
+    mapping = {}
+    stats = {"num_records": 0, "num_split_records": 0, "num_requests": 0, "total_tokens": 0, "max_tokens": 0}
+    with open(requests_filename, "w", encoding="utf-8") as wf:
+        for website_iter, comp in comp_keys:
+            entries = engine.query_comp(website_iter, comp)
+            requests = pack_comp_records(entries, max_prompt_tokens, instruction)
+            for request_idx, request in enumerate(requests):
+                request_id = f"{website_iter}-{comp}-{request_idx + 1:04d}"
+                wf.write(json.dumps({
+                    "request_id": request_id,
+                    "messages": [{"role": "user", "content": request["content"]}],
+                }, ensure_ascii=False) + "\n")
+                mapping[request_id] = request["records"]
+                stats["total_tokens"] += request["tokens"]
+                stats["max_tokens"] = max(stats["max_tokens"], request["tokens"])
+            stats["num_records"] += len(entries)
+            stats["num_requests"] += len(requests)
+            stats["num_split_records"] += len(set([(record["round_number"], record["question_num"])
+                                                   for request in requests for record in request["records"]
+                                                   if record["num_parts"] > 1]))
+
+    with open(mapping_filename, "w", encoding="utf-8") as wf:
+        json.dump(mapping, wf, ensure_ascii=False, indent=2)
+    stats["fill_ratio"] = stats["total_tokens"] / stats["num_requests"] / max_prompt_tokens \
+        if stats["num_requests"] > 0 else 0.
+
+    return stats
+
+
+def load_request_mapping(mapping_filename: str):
+    """
+    Returns
+    -------
+    {request_id: list[dict]}, see build_packed_batch(.)
+    """
+    with open(mapping_filename, "r", encoding="utf-8") as rf:
+        return json.load(rf)
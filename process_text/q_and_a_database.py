@@ -1,17 +1,31 @@
-import numpy as np
 import pandas as pd
-import fitz
 import re
 import os
 import glob
 
-from .extract_info import extract_content, extract_q_and_a
+from multiprocessing import Pool
+from .sqlite_store import is_sqlite_filename, create_sqlite_schema, upsert_q_and_a_rows, query_question, \
+    read_sqlite_tables, delete_files, get_question_filenames, Q_KEY_COLUMNS
+from .search_index import index_q_and_a_rows, delete_indexed_files
+from .build_manifest import load_manifest, save_manifest, diff_manifest, get_patterns_version
+from .utils import get_round_number
 from ..utils import create_logger
+from ..storage import is_parquet_filename, save_table, load_table
+from ..metrics import timed, dump_summary
 from tqdm import tqdm
 from typing import List
+from collections import defaultdict
 
 
 def create_schema(q_filename: str, a_filename: str):
+    """
+    If q_filename is a SQLite file (.db, .sqlite or .sqlite3), both tables are stored in it and a_filename is
+    ignored; otherwise each table is a CSV file.
+    """
+    if is_sqlite_filename(q_filename):
+        create_sqlite_schema(q_filename)
+        return
+
     if not os.path.isfile(q_filename):
         cols = [
             "website",
@@ -47,9 +61,9 @@ def create_schema(q_filename: str, a_filename: str):
         a_df.to_csv(a_filename, index=False, encoding="utf_8_sig")
 
 
-def insert_q_and_a_entries(q_and_a_entries: List[dict], meta_info: dict, q_filename: str, a_filename: str):
+def build_q_and_a_rows(q_and_a_entries: List[dict], meta_info: dict):
     """
-    Given the output of .extract_info.extract_q_and_a(.), insert it to the DB.
+    Given the output of .extract_info.extract_q_and_a(.), build the rows of the question and answer tables.
     The output(q_and_a_entries) is in the form of:
     [
         {
@@ -71,9 +85,11 @@ def insert_q_and_a_entries(q_and_a_entries: List[dict], meta_info: dict, q_filen
             "filename": str,
             "round_number": int,
         }
+
+    Returns
+    -------
+    (list[dict], list[dict]): rows of the question table and rows of the answer table
     """
-    q_df = pd.read_csv(q_filename)
-    a_df = pd.read_csv(a_filename)
     new_q_entries = []
     new_a_entries = []
 
@@ -99,12 +115,113 @@ def insert_q_and_a_entries(q_and_a_entries: List[dict], meta_info: dict, q_filen
             })
             new_a_entries.append(new_a_entry)
 
-    new_q_df = pd.DataFrame(new_q_entries)
-    new_a_df = pd.DataFrame(new_a_entries)
-    q_df = pd.concat([q_df, new_q_df], axis=0).drop_duplicates()
-    a_df = pd.concat([a_df, new_a_df], axis=0).drop_duplicates()
-    q_df.to_csv(q_filename, index=False, encoding="utf_8_sig")
-    a_df.to_csv(a_filename, index=False, encoding="utf_8_sig")
+    return new_q_entries, new_a_entries
+
+
+@timed(items=lambda out, q_rows, *args, **kwargs: len(q_rows))
+def insert_q_and_a_rows(q_rows: List[dict], a_rows: List[dict], q_filename: str, a_filename: str,
+                        index_filename: str = None):
+    """
+    q_rows, a_rows: output of build_q_and_a_rows(.), possibly concatenated over several files
+    index_filename: if given, the rows are also added to this full-text index, see .search_index. The index is only
+        updated once the rows are written, so that a failed write leaves no documents the DB doesn't have
+    """
+    if is_sqlite_filename(q_filename):
+        upsert_q_and_a_rows(q_filename, q_rows, a_rows)
+    else:
+        q_df = pd.read_csv(q_filename)
+        a_df = pd.read_csv(a_filename)
+        new_q_df = pd.DataFrame(q_rows)
+        new_a_df = pd.DataFrame(a_rows)
+        q_df = pd.concat([q_df, new_q_df], axis=0).drop_duplicates()
+        a_df = pd.concat([a_df, new_a_df], axis=0).drop_duplicates()
+        q_df.to_csv(q_filename, index=False, encoding="utf_8_sig")
+        a_df.to_csv(a_filename, index=False, encoding="utf_8_sig")
+    if index_filename is not None:
+        index_q_and_a_rows(index_filename, q_rows, a_rows)
+
+
+def __get_q_key(row: dict):
+    return row["website"], row["comp"], int(row["round_number"]), int(row["question_num"])
+
+
+def insert_q_and_a_files(file_rows: List[tuple], q_filename: str, a_filename: str, index_filename: str = None):
+    """
+    file_rows: [(filename, q_rows, a_rows)...], rows as output by build_q_and_a_rows(.) for each file
+    A question whose key (website, comp, round_number, question_num) is already taken by another file, in the DB or
+    earlier in file_rows, is not written (nor its answers): the first file keeps the key, as query_one_q_and_a(.)
+    does for duplicates. Questions of the same file are replaced.
+
+    Returns
+    -------
+    [
+        {
+            "key": tuple,
+            "filename": str (the file whose question is dropped),
+            "kept_filename": str,
+        }...
+    ]
+    """
+    keys = [__get_q_key(row) for _, q_rows, _ in file_rows for row in q_rows]
+    if is_sqlite_filename(q_filename):
+        taken = get_question_filenames(q_filename, keys)
+    else:
+        q_df = pd.read_csv(q_filename, usecols=list(Q_KEY_COLUMNS) + ["filename"])
+        taken = {}
+        for row in q_df.to_dict("records"):
+            taken.setdefault(__get_q_key(row), row["filename"])
+
+    conflicts = []
+    q_rows_out = []
+    a_rows_out = []
+    for filename, q_rows, a_rows in file_rows:
+        dropped_keys = set()
+        for row in q_rows:
+            key = __get_q_key(row)
+            kept_filename = taken.setdefault(key, filename)
+            if kept_filename != filename:
+                dropped_keys.add(key)
+                conflicts.append({"key": key, "filename": filename, "kept_filename": kept_filename})
+        q_rows_out += [row for row in q_rows if __get_q_key(row) not in dropped_keys]
+        a_rows_out += [row for row in a_rows if __get_q_key(row) not in dropped_keys]
+    if len(q_rows_out) > 0 or len(a_rows_out) > 0:
+        insert_q_and_a_rows(q_rows_out, a_rows_out, q_filename, a_filename, index_filename)
+
+    return conflicts
+
+
+def delete_q_and_a_files(filenames: List[str], q_filename: str, a_filename: str, index_filename: str = None):
+    """
+    Removes the questions parsed from filenames and their answer entries from the DB (and the full-text index).
+    """
+    if len(filenames) == 0:
+        return
+    if index_filename is not None:
+        delete_indexed_files(index_filename, filenames)
+    if is_sqlite_filename(q_filename):
+        delete_files(q_filename, filenames)
+        return
+
+    q_df = pd.read_csv(q_filename)
+    a_df = pd.read_csv(a_filename)
+    key_cols = ["website", "comp", "round_number", "question_num"]
+    q_mask = q_df["filename"].isin(filenames)
+    a_mask = a_df.set_index(key_cols).index.isin(q_df.loc[q_mask, key_cols].set_index(key_cols).index)
+    q_df[~q_mask].to_csv(q_filename, index=False, encoding="utf_8_sig")
+    a_df[~a_mask].to_csv(a_filename, index=False, encoding="utf_8_sig")
+
+
+@timed(items=lambda out, q_and_a_entries, *args, **kwargs: len(q_and_a_entries))
+def insert_q_and_a_entries(q_and_a_entries: List[dict], meta_info: dict, q_filename: str, a_filename: str,
+                           index_filename: str = None):
+    """
+    Given the output of .extract_info.extract_q_and_a(.), insert it to the DB.
+    See build_q_and_a_rows(.) for the format of q_and_a_entries and meta_info, and insert_q_and_a_files(.) for the
+    output (the questions not written as their keys are taken by another file).
+    """
+    q_rows, a_rows = build_q_and_a_rows(q_and_a_entries, meta_info)
+
+    return insert_q_and_a_files([(meta_info["filename"], q_rows, a_rows)], q_filename, a_filename, index_filename)
 
 
 def __remove_white_space(text: str):
@@ -117,6 +234,8 @@ def __remove_white_space(text: str):
 def query_one_q_and_a(website: str, comp: str, round_number: int, question_num: int, q_filename: str,
                       a_filename: str) -> dict:
     """
+    Reads the tables on every call; see QAndAQueryEngine for repeated queries.
+
     Returns
     -------
     {
@@ -127,6 +246,30 @@ def query_one_q_and_a(website: str, comp: str, round_number: int, question_num:
     }
     """
     out_dict = {}
+    if is_sqlite_filename(q_filename):
+        q_entry, a_entries = query_question(q_filename, website, comp, round_number, question_num)
+        out_dict["question"] = q_entry["question"]
+        out_dict["question_long"] = q_entry["question_long"]
+        out_dict["pages"] = (q_entry["page_from"], q_entry["page_to"])
+        out_dict["answer"] = "\n\n".join([__remove_white_space(a_entry["subtitle"]) for a_entry in a_entries])
+
+        return out_dict
+
+    if is_parquet_filename(q_filename):
+        key_filters = [("website", "==", website), ("comp", "==", comp), ("round_number", "==", round_number),
+                       ("question_num", "==", question_num)]
+        q_df = load_table(q_filename, columns=["question", "question_long", "page_from", "page_to"],
+                          filters=key_filters)
+        a_df = load_table(a_filename, columns=["answer_entry_num", "subtitle"], filters=key_filters)
+        q_entry = q_df.iloc[0]
+        out_dict["question"] = q_entry["question"]
+        out_dict["question_long"] = q_entry["question_long"]
+        out_dict["pages"] = (int(q_entry["page_from"]), int(q_entry["page_to"]))
+        a_entries = a_df.sort_values("answer_entry_num")
+        out_dict["answer"] = "\n\n".join(a_entries["subtitle"].apply(__remove_white_space))
+
+        return out_dict
+
     q_df = pd.read_csv(q_filename)
     a_df = pd.read_csv(a_filename)
     q_mask = (q_df["website"] == website) & (q_df["comp"] == comp) & (q_df["round_number"] == round_number) \
@@ -145,30 +288,173 @@ def query_one_q_and_a(website: str, comp: str, round_number: int, question_num:
     return out_dict
 
 
-def __process_one_file(filename: str, q_filename: str, a_filename: str):
-    round_pattern = re.compile(r"第[一二三四五六七八九十]+")
+def load_q_and_a_tables(q_filename: str, a_filename: str):
+    """
+    Returns
+    -------
+    (DataFrame, DataFrame): the question table and the answer table
+    """
+    if is_sqlite_filename(q_filename):
+        return read_sqlite_tables(q_filename)
+    if is_parquet_filename(q_filename):
+        return load_table(q_filename, table_name="questions"), load_table(a_filename, table_name="answers")
+
+    return pd.read_csv(q_filename), pd.read_csv(a_filename)
+
+
+def export_q_and_a_tables(q_filename: str, a_filename: str, q_out_filename: str, a_out_filename: str,
+                          export_csv: bool = False):
+    """
+    Exports the tables (CSV or SQLite) to e.g. Parquet for column-projected, predicate-filtered reads by
+    query_one_q_and_a(.) and QAndAQueryEngine.
+    """
+    q_df, a_df = load_q_and_a_tables(q_filename, a_filename)
+    save_table(q_df, q_out_filename, "questions", export_csv)
+    save_table(a_df, a_out_filename, "answers", export_csv)
+
+
+class QAndAQueryEngine(object):
+    """
+    Loads the question and answer tables once and answers lookups from in-memory indices. Use this instead of
+    query_one_q_and_a(.) when querying many times.
+    """
+    def __init__(self, q_filename: str, a_filename: str):
+        q_df, a_df = load_q_and_a_tables(q_filename, a_filename)
+
+        # Whitespace-stripped answer string of each question, built once
+        a_df = a_df.sort_values(["website", "comp", "round_number", "question_num", "answer_entry_num"])
+        subtitles = a_df["subtitle"].fillna("").astype(str).str.replace(r"\s+", "", regex=True)
+        answers = {}
+        for key, subtitles_iter in subtitles.groupby([a_df["website"], a_df["comp"], a_df["round_number"],
+                                                      a_df["question_num"]], sort=False):
+            answers[self.make_key(*key)] = "\n\n".join(subtitles_iter)
+
+        self.entries = {}
+        self.comp_index = defaultdict(list)
+        self.round_index = defaultdict(list)
+        for q_entry in q_df.to_dict("records"):
+            key = self.make_key(q_entry["website"], q_entry["comp"], q_entry["round_number"],
+                                q_entry["question_num"])
+            if key in self.entries:
+                # The first row of a duplicated key is kept, as in query_one_q_and_a(.)
+                continue
+            self.entries[key] = {
+                "website": key[0],
+                "comp": key[1],
+                "round_number": key[2],
+                "question_num": key[3],
+                "question": q_entry["question"],
+                "question_long": q_entry["question_long"],
+                "pages": (int(q_entry["page_from"]), int(q_entry["page_to"])),
+                "answer": answers.get(key, ""),
+            }
+        for key in sorted(self.entries):
+            website, comp, round_number, _ = key
+            self.comp_index[(website, comp)].append(key)
+            self.round_index[(website, round_number)].append(key)
+
+    @staticmethod
+    def make_key(website: str, comp: str, round_number: int, question_num: int):
+        return website, comp, int(round_number), int(question_num)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def query_one(self, website: str, comp: str, round_number: int, question_num: int) -> dict:
+        """
+        Returns
+        -------
+        {
+            "website": str,
+            "comp": str,
+            "round_number": int,
+            "question_num": int,
+            "question": str,
+            "question_long": str,
+            "pages": (from, to),
+            "answer": str (Each subtitle starts a new line),
+        }
+        """
+        key = self.make_key(website, comp, round_number, question_num)
+        if key not in self.entries:
+            raise IndexError(f"No question found for {key}")
+
+        # A copy, so that callers can't alter the cached entry
+        return dict(self.entries[key])
+
+    def query_comp(self, website: str, comp: str, round_number: int = None) -> List[dict]:
+        """
+        All questions of a company sorted by (round_number, question_num), optionally restricted to one round.
+        """
+        keys = self.comp_index.get((website, comp), [])
+        if round_number is not None:
+            keys = [key for key in keys if key[2] == int(round_number)]
+
+        return [dict(self.entries[key]) for key in keys]
+
+    def query_round(self, website: str, round_number: int) -> List[dict]:
+        """
+        All questions of a round sorted by (comp, question_num).
+        """
+        keys = self.round_index.get((website, int(round_number)), [])
+
+        return [dict(self.entries[key]) for key in keys]
+
+
+def __get_meta_info(filename: str):
     comp_name_dirname = os.path.dirname(filename)
     comp_name = os.path.basename(comp_name_dirname)
     website_dir_name = os.path.dirname(comp_name_dirname)
     website = os.path.basename(website_dir_name)
-    round_pattern_matches = re.findall(round_pattern, filename)
-    round_number = 2
-    if len(round_pattern_matches) == 0 or "第一" in round_pattern_matches[0]:
-        round_number = 1
     meta_info = {
         "website": website,
         "comp": comp_name,
         "filename": filename,
-        "round_number": round_number,
+        "round_number": get_round_number(filename),
     }
 
-    doc = fitz.open(filename)
-    content_res = extract_content(doc)
-    res = extract_q_and_a(doc, content_res)
-    insert_q_and_a_entries(res, meta_info, q_filename, a_filename)
+    return meta_info
 
 
-def construct_q_and_a_database_main(root_dir: str, log_filename: str, q_filename: str, a_filename: str):
+def __parse_one_file(filename: str):
+    """
+    Parses one file without touching the DB, so that it can run in a worker process.
+
+    Returns
+    -------
+    {
+        "filename": str,
+        "q_rows": list[dict],
+        "a_rows": list[dict],
+        "page_cache_stats": dict (output of PageTextCache.stats()),
+    }
+    or {"filename": str, "error": str} if the file can't be parsed
+    """
+    # Only the parsing needs fitz: querying the DB doesn't load it
+    import fitz
+    from .extract_info import extract_content, extract_q_and_a, get_page_text_cache
+
+    try:
+        meta_info = __get_meta_info(filename)
+        with fitz.open(filename) as doc:
+            content_res = extract_content(doc)
+            res = extract_q_and_a(doc, content_res)
+            q_rows, a_rows = build_q_and_a_rows(res, meta_info)
+            page_cache_stats = get_page_text_cache(doc).stats()
+    except Exception as e:
+        return {"filename": filename, "error": str(e)}
+
+    return {
+        "filename": filename,
+        "q_rows": q_rows,
+        "a_rows": a_rows,
+        "page_cache_stats": page_cache_stats,
+    }
+
+
+def construct_q_and_a_database_main(root_dir: str, log_filename: str, q_filename: str, a_filename: str,
+                                    num_workers: int = 1, write_interval: int = 50, chunksize: int = 1,
+                                    manifest_filename: str = None, index_filename: str = None):
     """
     root_dir: e.g. F:\Data\IPODataAnalysis\ipo_doc, i.e. parent directory of e.g. */szse/
     File system:
@@ -176,12 +462,109 @@ def construct_q_and_a_database_main(root_dir: str, log_filename: str, q_filename
         - szse
             - comp1
                 - *.pdf
+    q_filename, a_filename: see create_schema(.); use a SQLite q_filename to avoid rewriting the CSVs on every write
+    num_workers: number of processes parsing the pdfs; the DB is only written by the calling process, in sorted
+        filename order
+    write_interval: number of parsed files buffered before each write to the DB (one transaction for SQLite). If a
+        write fails, the buffered files are written one by one and those still failing are logged, left out of the
+        manifest (so they are retried on the next run) and reported in "write_errors"
+    manifest_filename: if given, only new or changed files (or all files if PATTERNS or
+        .build_manifest.ROW_FORMAT_VERSION changed) are processed, and rows of changed or removed files are replaced /
+        deleted. See .build_manifest.load_manifest(.). Without a manifest, tables built by an older ROW_FORMAT_VERSION
+        must be deleted first: their rows are keyed differently and would not be replaced
+    index_filename: if given, the full-text index (see .search_index.search_q_and_a(.)) is kept in sync with the DB
+
+    Returns
+    -------
+    {
+        "added": list[str],
+        "updated": list[str],
+        "removed": list[str],
+        "unchanged": list[str],
+        "write_errors": list[str] (only if a write failed),
+        "key_conflicts": list[dict] (only if a question key is taken by another file, see insert_q_and_a_files(.)),
+    }
     """
     logger = create_logger("q_and_a_db", log_filename)
     create_schema(q_filename, a_filename)
-    filenames = glob.glob(os.path.join(root_dir, "*/*/*.pdf"))
-    for filename in tqdm(filenames):
+    filenames = sorted(glob.glob(os.path.join(root_dir, "*/*/*.pdf")))
+
+    manifest = None
+    report = {"added": filenames, "updated": [], "removed": [], "unchanged": []}
+    if manifest_filename is not None:
+        manifest = load_manifest(manifest_filename)
+        report = diff_manifest(manifest, filenames)
+        delete_q_and_a_files(report["updated"] + report["removed"], q_filename, a_filename, index_filename)
+        for filename in report["updated"] + report["removed"]:
+            manifest["files"].pop(filename)
+        manifest["patterns_version"] = get_patterns_version()
+        save_manifest(manifest, manifest_filename)
+        filenames = sorted(report["added"] + report["updated"])
+        logger.debug(f"Manifest: {len(report['added'])} added, {len(report['updated'])} updated, "
+                     f"{len(report['removed'])} removed, {len(report['unchanged'])} unchanged")
+
+    # filename: (status, q_rows, a_rows)
+    buffered_files = {}
+
+    def write_files(files: dict):
+        file_rows = [(filename, q_rows, a_rows) for filename, (_, q_rows, a_rows) in files.items()]
+        for conflict in insert_q_and_a_files(file_rows, q_filename, a_filename, index_filename):
+            logger.warning(f"{conflict['filename']}: question {conflict['key']} is already taken by "
+                           f"{conflict['kept_filename']}, not written")
+            report.setdefault("key_conflicts", []).append(conflict)
+
+    def flush():
+        nonlocal buffered_files
+        if len(buffered_files) == 0:
+            return
+        written_files = dict(buffered_files)
         try:
-            __process_one_file(filename, q_filename, a_filename)
+            write_files(buffered_files)
         except Exception as e:
-            logger.debug(f"{filename}: {e}")
+            # One bad file mustn't drop the rest of the buffer: the files are written one by one instead
+            logger.debug(f"Writing {len(buffered_files)} files failed ({e}), retrying file by file")
+            for filename, file_iter in buffered_files.items():
+                try:
+                    write_files({filename: file_iter})
+                except Exception as e_file:
+                    logger.debug(f"{filename}: write failed: {e_file}")
+                    report.setdefault("write_errors", []).append(filename)
+                    written_files.pop(filename)
+        if manifest is not None and len(written_files) > 0:
+            # Only files whose rows are written are recorded, so an interrupted run (or a failed write) resumes from
+            # here
+            for filename, (status, _, _) in written_files.items():
+                manifest["files"][filename] = dict(report["fingerprints"][filename], status=status)
+            save_manifest(manifest, manifest_filename)
+        buffered_files = {}
+
+    def collect(parsed_iter):
+        for parsed in tqdm(parsed_iter, total=len(filenames)):
+            filename = parsed["filename"]
+            if "error" in parsed:
+                logger.debug(f"{filename}: {parsed['error']}")
+                # Recorded in the manifest as well: the file is retried once it or PATTERNS changes
+                buffered_files[filename] = ("error", [], [])
+                continue
+            page_cache_stats = parsed["page_cache_stats"]
+            logger.debug(f"{filename}: page text cache hits: {page_cache_stats['hits']}, "
+                         f"misses: {page_cache_stats['misses']}, pages: {page_cache_stats['num_pages']}")
+            buffered_files[filename] = ("ok", parsed["q_rows"], parsed["a_rows"])
+            if len(buffered_files) >= write_interval:
+                flush()
+
+    if num_workers <= 1:
+        collect(map(__parse_one_file, filenames))
+    else:
+        with Pool(processes=num_workers) as pool:
+            # imap (rather than imap_unordered) keeps the insertion order deterministic
+            collect(pool.imap(__parse_one_file, filenames, chunksize=chunksize))
+    flush()
+
+    for status in ["added", "updated", "removed"]:
+        for filename in report[status]:
+            logger.debug(f"{status}: {filename}")
+    report.pop("fingerprints", None)
+    dump_summary(logger)
+
+    return report
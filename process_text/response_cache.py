@@ -0,0 +1,174 @@
+import hashlib
+import threading
+import sqlite3
+import json
+import time
+import os
+
+from contextlib import contextmanager
+
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    num_bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+"""
+
+
+def normalize_payload(payload):
+    """
+    Dict keys are sorted (by json.dumps) and surrounding whitespace of strings is dropped, so cosmetic differences in
+    a prompt don't miss the cache.
+    """
+    if isinstance(payload, dict):
+        return {key: normalize_payload(val) for key, val in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return [normalize_payload(val) for val in payload]
+    if isinstance(payload, str):
+        return payload.strip()
+
+    return payload
+
+
+def make_key(prompt: dict, model_url: str):
+    payload_str = json.dumps(normalize_payload(prompt), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+    return hashlib.sha256(f"{model_url}\n{payload_str}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache(object):
+    """
+    On-disk (SQLite) cache of model responses keyed by make_key(.), with LRU eviction beyond max_entries / max_bytes
+    and expiry after ttl seconds; None disables a bound. Safe to share between threads: concurrent misses of a key
+    call the model once (see key_lock(.)). Processes may share the file, which SQLite keeps consistent, but a key
+    missed by several processes at once is computed by each of them, the last put(.) winning.
+    """
+    def __init__(self, cache_filename: str, max_entries: int = None, max_bytes: int = None, ttl: float = None):
+        self.cache_filename = cache_filename
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        dir_name = os.path.dirname(cache_filename)
+        if len(dir_name) > 0 and not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+        self.conn = sqlite3.connect(cache_filename, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.executescript(SCHEMA_SQL)
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "puts": 0, "evictions": 0}
+
+    @contextmanager
+    def key_lock(self, key: str):
+        """
+        Serializes callers of the same key within the process (not across processes), so that concurrent misses call
+        the model once.
+        """
+        with self.lock:
+            if key not in self.key_locks:
+                self.key_locks[key] = [threading.Lock(), 0]
+            self.key_locks[key][1] += 1
+            lock = self.key_locks[key][0]
+        try:
+            with lock:
+                yield
+        finally:
+            with self.lock:
+                self.key_locks[key][1] -= 1
+                if self.key_locks[key][1] == 0:
+                    self.key_locks.pop(key)
+
+    def get(self, key: str):
+        """
+        Returns
+        -------
+        str or None (miss or expired)
+        """
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            response, created_at = row
+            with self.conn:
+                if self.ttl is not None and now - created_at > self.ttl:
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.stats["expired"] += 1
+                    self.stats["misses"] += 1
+                    return None
+                self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.stats["hits"] += 1
+
+            return response
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO responses (key, response, num_bytes, created_at, "
+                                  "last_access) VALUES (?, ?, ?, ?, ?)",
+                                  (key, response, len(response.encode("utf-8")), now, now))
+                self.stats["puts"] += 1
+                self.evict()
+
+    def evict(self):
+        """
+        Drops expired entries, then least recently used ones until within the bounds. Called under self.lock.
+        """
+        if self.ttl is not None:
+            self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+        num_entries, num_bytes = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(num_bytes), 0) FROM responses") \
+            .fetchone()
+        over_entries = 0 if self.max_entries is None else num_entries - self.max_entries
+        over_bytes = 0 if self.max_bytes is None else num_bytes - self.max_bytes
+        if over_entries <= 0 and over_bytes <= 0:
+            return
+
+        evicted_keys = []
+        for key, entry_bytes in self.conn.execute("SELECT key, num_bytes FROM responses ORDER BY last_access"):
+            if over_entries <= 0 and over_bytes <= 0:
+                break
+            evicted_keys.append((key,))
+            over_entries -= 1
+            over_bytes -= entry_bytes
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+        self.stats["evictions"] += len(evicted_keys)
+
+    def get_stats(self):
+        """
+        Returns
+        -------
+        {
+            "hits": int,
+            "misses": int,
+            "expired": int,
+            "puts": int,
+            "evictions": int,
+            "hit_rate": float,
+            "num_entries": int,
+            "bytes": int,
+        }
+        """
+        with self.lock:
+            num_entries, num_bytes = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(num_bytes), 0) "
+                                                       "FROM responses").fetchone()
+            stats = dict(self.stats)
+        num_lookups = stats["hits"] + stats["misses"]
+        stats.update({
+            "hit_rate": stats["hits"] / num_lookups if num_lookups > 0 else 0.,
+            "num_entries": num_entries,
+            "bytes": num_bytes,
+        })
+
+        return stats
+
+    def close(self):
+        self.conn.close()
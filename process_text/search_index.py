@@ -0,0 +1,265 @@
+import sqlite3
+import math
+import re
+
+from collections import Counter, defaultdict
+from typing import List
+from .sqlite_store import connect, Q_KEY_COLUMNS
+
+
+# Inverted index over the questions (question_long + answer subtitles), stored in a SQLite file next to the tables.
+# Chinese has no word boundaries, so texts are tokenized into overlapping character bigrams: a query term matches a
+# question if the question holds every bigram of the term, and the term itself is then checked as a substring, so
+# search terms behave as exact phrases.
+
+NGRAM_SIZE = 2
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    website TEXT NOT NULL,
+    comp TEXT NOT NULL,
+    round_number INTEGER NOT NULL,
+    question_num INTEGER NOT NULL,
+    filename TEXT,
+    question TEXT,
+    text TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    UNIQUE (website, comp, round_number, question_num)
+);
+CREATE INDEX IF NOT EXISTS docs_filename ON docs (filename);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+"""
+
+
+def normalize_text(text):
+    """
+    Whitespace (including the line breaks of the pdfs) is dropped and latin letters are lower-cased.
+    """
+    if not isinstance(text, str):
+        return ""
+
+    return re.sub(r"\s+", "", text).lower()
+
+
+def tokenize(text: str, n: int = NGRAM_SIZE):
+    """
+    text: normalized, see normalize_text(.)
+
+    Returns
+    -------
+    list[str]: overlapping character n-grams; a text shorter than n is its own (only) token
+    """
+    if len(text) < n:
+        return [text] if len(text) > 0 else []
+
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+
+def connect_index(index_filename: str) -> sqlite3.Connection:
+    conn = connect(index_filename)
+    # The posting B-tree is written all over on every batch; a larger page cache saves most of the re-reads
+    conn.execute("PRAGMA cache_size=-262144")
+
+    return conn
+
+
+def create_index_schema(index_filename: str):
+    conn = connect_index(index_filename)
+    with conn:
+        conn.executescript(SCHEMA_SQL)
+    conn.close()
+
+
+def __delete_docs(conn: sqlite3.Connection, where_sql: str, params: tuple):
+    """
+    The postings of a doc are found again from its text, so that no (doc_id) index on the postings is maintained.
+    """
+    for doc_id, text in conn.execute(f"SELECT doc_id, text FROM docs WHERE {where_sql}", params).fetchall():
+        conn.executemany("DELETE FROM postings WHERE term = ? AND doc_id = ?",
+                         [(term, doc_id) for term in set(tokenize(text))])
+        conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+
+
+def index_q_and_a_rows(index_filename: str, q_rows: List[dict], a_rows: List[dict]):
+    """
+    Adds the rows (output of .q_and_a_database.build_q_and_a_rows(.)) to the index in one transaction. A question
+    already in the index is re-indexed with the new text. Of the rows sharing a key, only the first is indexed, as the
+    DB keeps the first file's question (see .q_and_a_database.insert_q_and_a_files(.)).
+    """
+    create_index_schema(index_filename)
+    q_rows_by_key = {}
+    for q_row in q_rows:
+        q_rows_by_key.setdefault((q_row["website"], q_row["comp"], int(q_row["round_number"]),
+                                  int(q_row["question_num"])), q_row)
+    subtitles = defaultdict(list)
+    for a_row in sorted(a_rows, key=lambda row: row["answer_entry_num"]):
+        key = tuple([a_row[col] for col in Q_KEY_COLUMNS])
+        subtitles[key].append(a_row["subtitle"] if isinstance(a_row["subtitle"], str) else "")
+
+    key_sql = " AND ".join([f"{col} = ?" for col in Q_KEY_COLUMNS])
+    conn = connect_index(index_filename)
+    with conn:
+        postings = []
+        for key, q_row in q_rows_by_key.items():
+            __delete_docs(conn, key_sql, key)
+
+            question_long = q_row["question_long"] if isinstance(q_row["question_long"], str) else ""
+            a_subtitles = subtitles.get(tuple([q_row[col] for col in Q_KEY_COLUMNS]), [])
+            text = normalize_text("\n".join([question_long] + a_subtitles))
+            question = q_row["question"] if isinstance(q_row["question"], str) else None
+            cursor = conn.execute("INSERT INTO docs (website, comp, round_number, question_num, filename, question, "
+                                  "text, length) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                  key + (q_row.get("filename"), question, text, len(text)))
+            postings += [(term, cursor.lastrowid, tf) for term, tf in Counter(tokenize(text)).items()]
+        # Sorted by term, the postings are appended to the B-tree in key order
+        postings.sort(key=lambda posting: posting[0])
+        conn.executemany("INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)", postings)
+    conn.close()
+
+
+def delete_indexed_files(index_filename: str, filenames: List[str]):
+    """
+    Drops the questions parsed from filenames from the index, in one transaction.
+    """
+    create_index_schema(index_filename)
+    conn = connect_index(index_filename)
+    with conn:
+        for filename in filenames:
+            __delete_docs(conn, "filename = ?", (filename,))
+    conn.close()
+
+
+def build_search_index(q_df: "pd.DataFrame", a_df: "pd.DataFrame", index_filename: str, chunksize: int = 1000):
+    """
+    Indexes existing tables (e.g. the output of .q_and_a_database.load_q_and_a_tables(.)), chunksize questions per
+    transaction. Safe to re-run.
+    """
+    import pandas as pd
+
+    key_cols = list(Q_KEY_COLUMNS)
+    a_groups = {key: group for key, group in a_df.groupby(key_cols, sort=False)}
+    for i in range(0, len(q_df), chunksize):
+        q_chunk = q_df.iloc[i:i + chunksize]
+        a_chunks = [a_groups[key] for key in q_chunk[key_cols].itertuples(index=False, name=None) if key in a_groups]
+        a_rows = pd.concat(a_chunks).to_dict("records") if len(a_chunks) > 0 else []
+        index_q_and_a_rows(index_filename, q_chunk.to_dict("records"), a_rows)
+
+
+def __make_snippet(text: str, term: str, width: int):
+    pos = text.find(term)
+    if pos < 0:
+        return text[:2 * width]
+
+    return text[max(pos - width, 0): pos + len(term) + width]
+
+
+def search_q_and_a(index_filename: str, query: str, website: str = None, comp: str = None, round_number: int = None,
+                   top_k: int = 20, k1: float = 1.2, b: float = 0.75, snippet_width: int = 30) -> List[dict]:
+    """
+    query: whitespace-separated terms, e.g. "毛利率 关联交易"; a question matches if it contains every term as a
+        phrase (ignoring whitespace). Questions are ranked by BM25 over the bigrams of the terms.
+    website, comp, round_number: optional filters
+
+    Returns
+    -------
+    [
+        {
+            "website": str,
+            "comp": str,
+            "round_number": int,
+            "question_num": int,
+            "question": str,
+            "score": float,
+            "snippet": str (text around the first term),
+        }...
+    ] (at most top_k, best first; ties in indexing order)
+    """
+    terms = [normalize_text(term) for term in query.split()]
+    terms = [term for term in terms if len(term) > 0]
+    if len(terms) == 0:
+        return []
+
+    filter_sql = ""
+    filter_params = []
+    for col, value in [("website", website), ("comp", comp), ("round_number", round_number)]:
+        if value is not None:
+            filter_sql += f" AND docs.{col} = ?"
+            filter_params.append(value)
+
+    conn = connect_index(index_filename)
+    num_docs, avg_length = conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+    if num_docs == 0:
+        conn.close()
+        return []
+
+    grams = sorted(set([gram for term in terms for gram in tokenize(term)]))
+    doc_freqs = {}
+    for gram in grams:
+        if len(gram) < NGRAM_SIZE:
+            df_sql = "SELECT COUNT(*) FROM docs WHERE instr(text, ?) > 0"
+        else:
+            df_sql = "SELECT COUNT(*) FROM postings WHERE term = ?"
+        doc_freqs[gram] = conn.execute(df_sql, (gram,)).fetchone()[0]
+    if min(doc_freqs.values()) == 0:
+        conn.close()
+        return []
+
+    # Rarest gram first: its (filtered) posting list bounds the candidates, the other lists only narrow them down
+    tfs = {}
+    lengths = {}
+    candidates = None
+    for gram in sorted(grams, key=lambda gram: doc_freqs[gram]):
+        if len(gram) < NGRAM_SIZE:
+            # Single-character term: no posting list, scan the texts instead
+            rows = conn.execute(f"SELECT doc_id, length(text) - length(replace(text, ?, '')), length FROM docs "
+                                f"WHERE instr(text, ?) > 0{filter_sql}", [gram, gram] + filter_params)
+        else:
+            rows = conn.execute(f"SELECT postings.doc_id, postings.tf, docs.length FROM postings JOIN docs "
+                                f"ON docs.doc_id = postings.doc_id WHERE postings.term = ?{filter_sql}",
+                                [gram] + filter_params)
+        tfs[gram] = {}
+        for doc_id, tf, length in rows:
+            if candidates is None or doc_id in candidates:
+                tfs[gram][doc_id] = tf
+                lengths[doc_id] = length
+        candidates = set(tfs[gram])
+        if len(candidates) == 0:
+            break
+
+    scores = {}
+    for doc_id in candidates:
+        score = 0.
+        for gram in grams:
+            idf = math.log(1. + (num_docs - doc_freqs[gram] + .5) / (doc_freqs[gram] + .5))
+            tf = tfs[gram][doc_id]
+            score += idf * tf * (k1 + 1.) / (tf + k1 * (1. - b + b * lengths[doc_id] / avg_length))
+        scores[doc_id] = score
+
+    # Phrases are only verified for the best-scored candidates, until top_k of them pass
+    results = []
+    for doc_id in sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id)):
+        if len(results) >= top_k:
+            break
+        row = conn.execute("SELECT website, comp, round_number, question_num, question, text FROM docs "
+                           "WHERE doc_id = ?", (doc_id,)).fetchone()
+        text = row[5]
+        if not all([term in text for term in terms]):
+            continue
+        results.append({
+            "website": row[0],
+            "comp": row[1],
+            "round_number": row[2],
+            "question_num": row[3],
+            "question": row[4],
+            "score": scores[doc_id],
+            "snippet": __make_snippet(text, terms[0], snippet_width),
+        })
+    conn.close()
+
+    return results
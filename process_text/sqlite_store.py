@@ -0,0 +1,242 @@
+import sqlite3
+import os
+
+from typing import List
+from .utils import get_round_number
+
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+Q_COLUMNS = (
+    "website",
+    "comp",
+    "filename",
+    "round_number",
+    "question_num",
+    "question",
+    "question_long",
+    "page_from",
+    "page_to",
+)
+
+A_COLUMNS = (
+    "website",
+    "comp",
+    "round_number",
+    "question_num",
+    "answer_entry_num",
+    "page",
+    "subtitle",
+)
+
+Q_KEY_COLUMNS = ("website", "comp", "round_number", "question_num")
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS questions (
+    website TEXT NOT NULL,
+    comp TEXT NOT NULL,
+    filename TEXT,
+    round_number INTEGER NOT NULL,
+    question_num INTEGER NOT NULL,
+    question TEXT,
+    question_long TEXT,
+    page_from INTEGER,
+    page_to INTEGER,
+    PRIMARY KEY (website, comp, round_number, question_num)
+);
+CREATE TABLE IF NOT EXISTS answers (
+    website TEXT NOT NULL,
+    comp TEXT NOT NULL,
+    round_number INTEGER NOT NULL,
+    question_num INTEGER NOT NULL,
+    answer_entry_num INTEGER NOT NULL,
+    page INTEGER,
+    subtitle TEXT,
+    PRIMARY KEY (website, comp, round_number, question_num, answer_entry_num)
+);
+"""
+
+
+def is_sqlite_filename(filename: str):
+    return filename is not None and os.path.splitext(filename)[1].lower() in SQLITE_SUFFIXES
+
+
+def connect(db_filename: str) -> sqlite3.Connection:
+    dir_name = os.path.dirname(db_filename)
+    if len(dir_name) > 0 and not os.path.isdir(dir_name):
+        os.makedirs(dir_name)
+    conn = sqlite3.connect(db_filename)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    return conn
+
+
+def create_sqlite_schema(db_filename: str):
+    conn = connect(db_filename)
+    with conn:
+        conn.executescript(SCHEMA_SQL)
+    conn.close()
+
+
+def __row_values(row: dict, cols: tuple):
+    values = []
+    for col in cols:
+        value = row.get(col)
+        if isinstance(value, float) and value != value:
+            # NaN read back from the CSVs
+            value = None
+        values.append(value)
+
+    return tuple(values)
+
+
+def get_question_filenames(db_filename: str, keys: List[tuple]):
+    """
+    keys: (website, comp, round_number, question_num) of questions
+
+    Returns
+    -------
+    {key: filename} of the keys already in the DB
+    """
+    where_sql = " AND ".join([f"{col} = ?" for col in Q_KEY_COLUMNS])
+    out = {}
+    conn = connect(db_filename)
+    for key in set(keys):
+        row = conn.execute(f"SELECT filename FROM questions WHERE {where_sql}", key).fetchone()
+        if row is not None:
+            out[key] = row[0]
+    conn.close()
+
+    return out
+
+
+def upsert_q_and_a_rows(db_filename: str, q_rows: List[dict], a_rows: List[dict]):
+    """
+    Inserts or replaces the rows (output of .q_and_a_database.build_q_and_a_rows(.)) in one transaction.
+    The previous answer entries of every upserted question are dropped first, so re-inserting a question
+    never leaves stale answer entries behind.
+    Only a question of the same file is replaced: ValueError is raised, and nothing is written, if a question's key is
+    taken by another file, in the DB or earlier in q_rows (see .q_and_a_database.insert_q_and_a_files(.), which
+    resolves such conflicts beforehand).
+    """
+    q_sql = f"INSERT OR REPLACE INTO questions ({', '.join(Q_COLUMNS)}) " \
+            f"VALUES ({', '.join(['?'] * len(Q_COLUMNS))})"
+    a_sql = f"INSERT OR REPLACE INTO answers ({', '.join(A_COLUMNS)}) " \
+            f"VALUES ({', '.join(['?'] * len(A_COLUMNS))})"
+    delete_sql = f"DELETE FROM answers WHERE {' AND '.join([f'{col} = ?' for col in Q_KEY_COLUMNS])}"
+    select_sql = f"SELECT filename FROM questions WHERE {' AND '.join([f'{col} = ?' for col in Q_KEY_COLUMNS])}"
+
+    conn = connect(db_filename)
+    try:
+        with conn:
+            key_filenames = {}
+            for row in q_rows:
+                key = __row_values(row, Q_KEY_COLUMNS)
+                if key not in key_filenames:
+                    existing_row = conn.execute(select_sql, key).fetchone()
+                    key_filenames[key] = row.get("filename") if existing_row is None else existing_row[0]
+                if key_filenames[key] != row.get("filename"):
+                    raise ValueError(f"Question {key} of {row.get('filename')} is already taken by "
+                                     f"{key_filenames[key]}")
+            conn.executemany(delete_sql, [__row_values(row, Q_KEY_COLUMNS) for row in q_rows])
+            conn.executemany(q_sql, [__row_values(row, Q_COLUMNS) for row in q_rows])
+            conn.executemany(a_sql, [__row_values(row, A_COLUMNS) for row in a_rows])
+    finally:
+        conn.close()
+
+
+def delete_files(db_filename: str, filenames: List[str]):
+    """
+    Deletes the questions parsed from filenames together with their answer entries, in one transaction.
+    """
+    key_sql = ", ".join(Q_KEY_COLUMNS)
+    conn = connect(db_filename)
+    with conn:
+        for filename in filenames:
+            conn.execute(f"DELETE FROM answers WHERE ({key_sql}) IN "
+                         f"(SELECT {key_sql} FROM questions WHERE filename = ?)", (filename,))
+            conn.execute("DELETE FROM questions WHERE filename = ?", (filename,))
+    conn.close()
+
+
+def query_question(db_filename: str, website: str, comp: str, round_number: int, question_num: int):
+    """
+    Returns
+    -------
+    (dict, list[dict]): the question row and its answer rows sorted by answer_entry_num
+    """
+    key = (website, comp, int(round_number), int(question_num))
+    where_sql = " AND ".join([f"{col} = ?" for col in Q_KEY_COLUMNS])
+    conn = connect(db_filename)
+    conn.row_factory = sqlite3.Row
+    q_row = conn.execute(f"SELECT * FROM questions WHERE {where_sql}", key).fetchone()
+    a_rows = conn.execute(f"SELECT * FROM answers WHERE {where_sql} ORDER BY answer_entry_num", key).fetchall()
+    conn.close()
+    if q_row is None:
+        raise IndexError(f"No question found for {key}")
+
+    return dict(q_row), [dict(a_row) for a_row in a_rows]
+
+
+def migrate_csv_to_sqlite(q_filename: str, a_filename: str, db_filename: str, chunksize: int = 10000):
+    """
+    One-shot migration of the CSV question and answer tables to a SQLite DB. Safe to re-run: rows are upserted.
+    A key held by several files keeps the first file's question and answer entries. ValueError is raised, and nothing
+    is written, if the round numbers differ from .utils.get_round_number(.) of the file names.
+    """
+    import pandas as pd
+
+    # Tables built before the current round numbering can't be mixed with new builds: a question would be upserted
+    # under two keys
+    for q_chunk in pd.read_csv(q_filename, usecols=["filename", "round_number"], chunksize=chunksize):
+        for filename, round_number in zip(q_chunk["filename"], q_chunk["round_number"]):
+            if int(round_number) != get_round_number(filename):
+                raise ValueError(f"{filename} has round_number {round_number} instead of "
+                                 f"{get_round_number(filename)}: the tables predate the current round numbering, "
+                                 f"rebuild them from the pdfs instead")
+
+    create_sqlite_schema(db_filename)
+    # The CSVs may hold a key twice (from different files): the first question row is kept, as the CSV queries do
+    seen_keys = set()
+    for q_chunk in pd.read_csv(q_filename, chunksize=chunksize):
+        q_rows = []
+        for row in q_chunk.to_dict("records"):
+            key = __row_values(row, Q_KEY_COLUMNS)
+            if key not in seen_keys:
+                seen_keys.add(key)
+                q_rows.append(row)
+        upsert_q_and_a_rows(db_filename, q_rows, [])
+    # Answers go after all the questions, otherwise upserting a question would drop its migrated answers.
+    # Answer rows have no filename: the entries of each file are appended as one block numbered from 0, so only the
+    # first block of a key (up to the first answer_entry_num that doesn't increase) belongs to the kept question
+    last_entry_nums = {}
+    closed_keys = set()
+    for a_chunk in pd.read_csv(a_filename, chunksize=chunksize):
+        a_rows = []
+        for row in a_chunk.to_dict("records"):
+            key = __row_values(row, Q_KEY_COLUMNS)
+            if key not in seen_keys or key in closed_keys:
+                continue
+            if key in last_entry_nums and row["answer_entry_num"] <= last_entry_nums[key]:
+                closed_keys.add(key)
+                continue
+            last_entry_nums[key] = row["answer_entry_num"]
+            a_rows.append(row)
+        upsert_q_and_a_rows(db_filename, [], a_rows)
+
+
+def read_sqlite_tables(db_filename: str):
+    """
+    Returns
+    -------
+    (DataFrame, DataFrame): the question table and the answer table
+    """
+    import pandas as pd
+
+    conn = connect(db_filename)
+    q_df = pd.read_sql_query("SELECT * FROM questions", conn)
+    a_df = pd.read_sql_query("SELECT * FROM answers", conn)
+    conn.close()
+
+    return q_df, a_df
@@ -0,0 +1,211 @@
+import json
+import gzip
+import os
+
+from multiprocessing import Pool
+from tqdm import tqdm
+from ..utils import TO_BYTE_FACTORS, save_json
+from ..metrics import timed, dump_summary
+from .utils import get_comp_pdf_filenames, remove_stale_parts
+
+
+# Text-only alternative to combine_pdf_from_comp_names(.): the same corpus in the same order (per company the latest
+# prospectus, then the reply letters by round) and under the same size cap, as gzip-compressed JSONL (one line per
+# page) or Markdown (one section per document, one anchor per page). The text of each page is extracted once, and
+# each source is rendered and compressed in a worker; the compressed sources are gzip members, so a part is their
+# concatenation and reads back as one stream with gzip.open(.).
+
+EXPORT_FORMATS = {
+    "jsonl": ".jsonl.gz",
+    "markdown": ".md.gz",
+}
+
+
+def make_page_anchor(comp_name: str, doc_idx: int, page_num: int):
+    return f"{comp_name}-d{doc_idx}-p{page_num}"
+
+
+def __render_jsonl(source: dict, page_texts: list):
+    lines = []
+    for page_idx, text in enumerate(page_texts):
+        lines.append(json.dumps({
+            "comp": source["comp_name"],
+            "doc_idx": source["doc_idx"],
+            "doc_type": source["doc_type"],
+            "filename": os.path.basename(source["filename"]),
+            "page": page_idx + 1,
+            "anchor": make_page_anchor(source["comp_name"], source["doc_idx"], page_idx + 1),
+            "text": text,
+        }, ensure_ascii=False))
+
+    return "\n".join(lines) + "\n"
+
+
+def __render_markdown(source: dict, page_texts: list):
+    blocks = []
+    if source["doc_idx"] == 0:
+        blocks.append(f"# {source['comp_name']}\n")
+    blocks.append(f"## {os.path.basename(source['filename'])}\n")
+    for page_idx, text in enumerate(page_texts):
+        anchor = make_page_anchor(source["comp_name"], source["doc_idx"], page_idx + 1)
+        blocks.append(f"<a id=\"{anchor}\"></a>\n\n### 第{page_idx + 1}页\n\n{text}\n")
+
+    return "\n".join(blocks) + "\n"
+
+
+@timed(items=lambda out, *args, **kwargs: out["pages"], num_bytes=lambda out, *args, **kwargs: out["pdf_bytes"])
+def render_source_text(source: dict, export_format: str = "jsonl", compress_level: int = 6):
+    """
+    source: {"comp_name": str, "filename": str, "doc_idx": int (0: the prospectus), "doc_type": str}
+
+    Returns
+    -------
+    {
+        "data": bytes (one gzip member),
+        "pages": int,
+        "chars": int,
+        "pdf_bytes": int,
+    }
+    """
+    import fitz
+
+    with fitz.open(source["filename"]) as doc:
+        page_texts = [page.get_text("text").strip() for page in doc]
+    if export_format == "jsonl":
+        text = __render_jsonl(source, page_texts)
+    else:
+        text = __render_markdown(source, page_texts)
+
+    return {
+        "data": gzip.compress(text.encode("utf-8"), compresslevel=compress_level),
+        "pages": len(page_texts),
+        "chars": sum([len(page_text) for page_text in page_texts]),
+        "pdf_bytes": os.path.getsize(source["filename"]),
+    }
+
+
+def __render_source_text_star(args):
+    return render_source_text(*args)
+
+
+def export_text_from_comp_names(comp_names: list, prospectus_dir: str, inquery_dir: str, output_dir: str,
+                                out_filename: str = "corpus", export_format: str = "jsonl",
+                                max_file_size: float = 576., max_file_size_unit: str = "MB", num_workers: int = 1,
+                                pdf_manifest_filename: str = None):
+    """
+    Same sources, order and size cap as .utils.combine_pdf_from_comp_names(.), exported as compressed text to
+    $output_dir/${out_filename}_{part_num}.jsonl.gz (or .md.gz). Sources are added to a part in order until the next
+    one would exceed the cap (a source larger than the cap gets a part of its own); sizes are exact since the
+    compressed sources are known before they are written.
+    export_format: "jsonl" (one JSON object per page: comp, doc_idx, doc_type, filename, page, anchor, text) or
+        "markdown" (# comp, ## document, an <a id="anchor"></a> and ### heading per page)
+    num_workers: number of processes extracting and compressing sources; the output is the same as with 1
+    pdf_manifest_filename: the manifest of the PDF bundles of the same companies, to compare with; by default the
+        sizes of the source pdfs are used
+
+    The manifest $output_dir/${out_filename}_manifest.json is rewritten as parts are finished, like the PDF one. As
+    with the PDF parts, each part is written to a temporary file and renamed once complete, and parts beyond the final
+    count (from an earlier run) are removed at the end.
+
+    Returns
+    -------
+    {
+        "parts": [
+            {
+                "part_num": int,
+                "filename": str,
+                "comp_names": list[str],
+                "source_filenames": list[str],
+                "pages": int,
+                "chars": int,
+                "bytes": int,
+            }...
+        ],
+        "export_bytes": int,
+        "pdf_bytes": int (the PDF bundles, or the source pdfs),
+        "compression_ratio": float (pdf_bytes / export_bytes),
+        "complete": bool,
+    }
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"export_format must be one of {list(EXPORT_FORMATS)}")
+    max_file_size_bytes = max_file_size * TO_BYTE_FACTORS[max_file_size_unit]
+
+    sources = []
+    for comp_name in comp_names:
+        for doc_idx, filename in enumerate(get_comp_pdf_filenames(comp_name, prospectus_dir, inquery_dir)):
+            sources.append({
+                "comp_name": comp_name,
+                "filename": filename,
+                "doc_idx": doc_idx,
+                "doc_type": "prospectus" if doc_idx == 0 else "inquiry_reply",
+            })
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    manifest_filename = os.path.join(output_dir, f"{out_filename}_manifest.json")
+    out = {"parts": [], "export_bytes": 0, "pdf_bytes": 0, "compression_ratio": None, "complete": False}
+    cur_part = None
+    wf = None
+
+    def finish_part():
+        nonlocal cur_part, wf
+        if cur_part is None:
+            return
+        wf.close()
+        # Renamed once complete: a killed run leaves no truncated part under a final name
+        os.replace(f"{cur_part['filename']}.tmp", cur_part["filename"])
+        out["parts"].append(cur_part)
+        out["export_bytes"] += cur_part["bytes"]
+        save_json(out, manifest_filename)
+        cur_part = None
+        wf = None
+
+    def write_source(source: dict, rendered: dict):
+        nonlocal cur_part, wf
+        num_bytes = len(rendered["data"])
+        if cur_part is not None and cur_part["bytes"] + num_bytes > max_file_size_bytes:
+            finish_part()
+        if cur_part is None:
+            part_num = len(out["parts"])
+            cur_part = {
+                "part_num": part_num,
+                "filename": os.path.join(output_dir, f"{out_filename}_{part_num}{EXPORT_FORMATS[export_format]}"),
+                "comp_names": [],
+                "source_filenames": [],
+                "pages": 0,
+                "chars": 0,
+                "bytes": 0,
+            }
+            wf = open(f"{cur_part['filename']}.tmp", "wb")
+        wf.write(rendered["data"])
+        if source["comp_name"] not in cur_part["comp_names"]:
+            cur_part["comp_names"].append(source["comp_name"])
+        cur_part["source_filenames"].append(source["filename"])
+        cur_part["pages"] += rendered["pages"]
+        cur_part["chars"] += rendered["chars"]
+        cur_part["bytes"] += num_bytes
+        out["pdf_bytes"] += rendered["pdf_bytes"]
+
+    args_all = [(source, export_format) for source in sources]
+    if num_workers > 1:
+        with Pool(processes=num_workers) as pool:
+            # imap keeps the source order
+            for source, rendered in zip(sources, tqdm(pool.imap(__render_source_text_star, args_all),
+                                                      total=len(sources))):
+                write_source(source, rendered)
+    else:
+        for source, args in tqdm(list(zip(sources, args_all))):
+            write_source(source, __render_source_text_star(args))
+    finish_part()
+    remove_stale_parts(output_dir, out_filename, len(out["parts"]), EXPORT_FORMATS[export_format])
+
+    if pdf_manifest_filename is not None:
+        with open(pdf_manifest_filename, "r", encoding="utf-8") as rf:
+            out["pdf_bytes"] = sum([part["bytes"] for part in json.load(rf)["parts"]])
+    out["compression_ratio"] = out["pdf_bytes"] / out["export_bytes"] if out["export_bytes"] > 0 else None
+    out["complete"] = True
+    save_json(out, manifest_filename)
+    dump_summary()
+
+    return out
@@ -1,12 +1,14 @@
-import pandas as pd
-import fitz
+import datetime as dt
 import re
 import os
 import glob
 
+from multiprocessing import Pool
 from functools import cmp_to_key
 from tqdm import tqdm
-from ..utils import TO_BYTE_FACTORS, ZH2NUM
+from ..utils import TO_BYTE_FACTORS, ZH2NUM, save_json
+from .page_dedup import DEDUP_MODES, plan_dedup, apply_page_selection
+from ..metrics import timed, dump_summary
 
 
 def compare_inquery_letter_filename(filename1: str, filename2: str):
@@ -24,91 +26,285 @@ def compare_inquery_letter_filename(filename1: str, filename2: str):
     return ZH2NUM[match1] - ZH2NUM[match2]
 
 
+def get_round_number(filename: str):
+    """
+    e.g. "...第三轮审核问询函的回复.pdf": 3; the file name of the first round reply usually has no round
+    """
+    matches = re.findall(r"第([一二三四五六七八九十])轮", os.path.basename(filename))
+
+    return ZH2NUM[matches[0]] if len(matches) > 0 else 1
+
+
 def compare_key_func_prospectus_filename(filename: str):
     dt_extracted = re.findall(r"\d{4}-\d{2}-\d{2}", filename)[0]
-    dt_extracted = pd.to_datetime(dt_extracted)
+    dt_extracted = dt.datetime.strptime(dt_extracted, "%Y-%m-%d")
 
     return dt_extracted
 
 
-def update_file(doc: fitz.Document, old_filename: str, max_file_size_bytes: float):
+def get_comp_pdf_filenames(comp_name: str, prospectus_dir: str, inquery_dir: str):
+    """
+    Sort the input filenames: the latest prospectus and sorted inquery letters from earliest to latest
     """
+    out_filenames = []
+
+    prospectus_filenames = glob.glob(os.path.join(prospectus_dir, f"{comp_name}", "*.pdf"))
+    if len(prospectus_filenames) == 0:
+        # Ignore companies without any propectus
+        return out_filenames
+
+    prospectus_filenames.sort(key=compare_key_func_prospectus_filename, reverse=True)
+    out_filenames.append(prospectus_filenames[0])
+
+    inquery_filenames = glob.glob(os.path.join(inquery_dir, f"{comp_name}", "*.pdf"))
+    if len(inquery_filenames) == 0:
+        # Ignore companies without any inquery letters
+        return []
+    inquery_filenames.sort(key=cmp_to_key(compare_inquery_letter_filename))
+    out_filenames += inquery_filenames
+
+    return out_filenames
+
+
+def plan_pdf_parts(sources: list, max_file_size_bytes: float):
+    """
+    Greedily groups the sources, in order, into parts whose estimated size is within max_file_size_bytes. A source
+    larger than the limit gets a part of its own.
+    sources:
+    [
+        {
+            "comp_name": str,
+            "filename": str,
+            "bytes": int (estimated size in the combined pdf),
+        }...
+    ]
+
+    Returns
+    -------
+    list[list[dict]]: sources of each part
+    """
+    parts = []
+    cur_part = []
+    cur_bytes = 0
+    for source in sources:
+        if len(cur_part) > 0 and cur_bytes + source["bytes"] > max_file_size_bytes:
+            parts.append(cur_part)
+            cur_part = []
+            cur_bytes = 0
+        cur_part.append(source)
+        cur_bytes += source["bytes"]
+    if len(cur_part) > 0:
+        parts.append(cur_part)
+
+    return parts
+
+
+@timed(items=lambda out, *args, **kwargs: out["pages"], num_bytes=lambda out, *args, **kwargs: out["bytes"])
+def write_pdf_part(filenames: list, out_filename: str, page_selections: list = None, dedup: str = "drop"):
+    """
+    Combines the pdfs and saves the result once.
+    page_selections: per filename, None or its entry of .page_dedup.plan_comp_dedup(.), applied with dedup ("drop" or
+        "reference", see .page_dedup.apply_page_selection(.))
+
     Returns
     -------
-    bool
-        True: Updated the file
-        False: Didn't update the file and a new file should be started
+    {
+        "pages": int,
+        "bytes": int,
+    }
     """
-    if not os.path.isfile(old_filename):
-        doc.save(old_filename)
-        return True
-
-    temp_filename = "temp_file.pdf"
-    dir_name = os.path.dirname(old_filename)
-    temp_filename_full = os.path.join(dir_name, temp_filename)
-    doc.save(temp_filename_full)
-    new_file_size = os.path.getsize(temp_filename_full)
-    if new_file_size <= max_file_size_bytes:
-        os.remove(old_filename)
-        os.rename(temp_filename_full, old_filename)
-        return True
-    else:
-        os.remove(temp_filename_full)
-        return False
+    import fitz
+
+    if page_selections is None:
+        page_selections = [None] * len(filenames)
+    combined_pdf = fitz.open()
+    for filename, selection in zip(filenames, page_selections):
+        with fitz.open(filename) as doc:
+            if selection is not None and not apply_page_selection(doc, selection, dedup):
+                continue
+            combined_pdf.insert_pdf(doc, from_page=0, to_page=doc.page_count)
+    num_pages = combined_pdf.page_count
+    # Renamed once complete: a write cut short (e.g. a terminated worker) leaves no partial part behind
+    temp_filename = f"{out_filename}.tmp"
+    combined_pdf.save(temp_filename)
+    combined_pdf.close()
+    os.replace(temp_filename, out_filename)
+
+    return {
+        "pages": num_pages,
+        "bytes": os.path.getsize(out_filename),
+    }
+
+
+def __write_pdf_part_star(args):
+    return write_pdf_part(*args)
+
+
+def remove_stale_parts(output_dir: str, out_filename: str, num_parts: int, suffix: str = ".pdf"):
+    """
+    Removes the parts ${out_filename}_{part_num}$suffix numbered num_parts or more (left by an earlier run or by parts
+    written before a re-plan) and the temporary files of interrupted writes.
+    """
+    part_pattern = re.compile(rf"{re.escape(out_filename)}_([0-9]+){re.escape(suffix)}(\.tmp)?")
+    for filename in os.listdir(output_dir):
+        match = part_pattern.fullmatch(filename)
+        if match is not None and (match.group(2) is not None or int(match.group(1)) >= num_parts):
+            os.remove(os.path.join(output_dir, filename))
 
 
 def combine_pdf_from_comp_names(comp_names: list, prospectus_dir: str, inquery_dir: str, output_dir: str,
                                 out_filename: str = "combined", max_file_size: float = 576.,
-                                max_file_size_unit: str = "MB"):
+                                max_file_size_unit: str = "MB", num_workers: int = 1, dedup: str = None):
     """
     Combine pdfs to consolidated pdfs with limited file size.
+    The parts are planned from the source file sizes and each part is written once. If a written part turns out
+    larger than the limit, its trailing sources are moved to the next part and it is rewritten. Each part is written to
+    a temporary file and renamed once complete, and parts beyond the final count (from a re-plan or an earlier run) are
+    removed at the end.
+    num_workers: number of processes writing parts in parallel; numbering and contents are the same as with 1.
+    dedup: None, "drop" or "reference": pages identical to an earlier page of the same company's sources are dropped
+        or replaced by a one-line reference to it (see .page_dedup). Planned before the parts, with the estimated
+        savings taken off the source sizes.
+
+    A manifest $output_dir/${out_filename}_manifest.json is rewritten every time a part is finished. Parts are
+    finished in order, so a part listed there is final and can be consumed while later parts are being written:
+    {
+        "num_parts_planned": int,
+        "complete": bool,
+        "parts": list[dict] (same as the returned list),
+        "dedup": {"mode": str, "pages_elided": int, "estimated_bytes_saved": int} (if dedup),
+    }
+
+    Returns
+    -------
+    [
+        {
+            "part_num": int,
+            "filename": str,
+            "comp_names": list[str],
+            "source_filenames": list[str],
+            "pages": int,
+            "bytes": int,
+            "elided_pages": [
+                {
+                    "filename": str,
+                    "page": int,
+                    "duplicate_of": {"filename": str, "page": int},
+                    "bytes_saved": int (estimated),
+                }...
+            ] (if dedup),
+            "estimated_bytes_saved": int (if dedup),
+        }...
+    ]
     """
+    if dedup is not None and dedup not in DEDUP_MODES:
+        raise ValueError(f"dedup must be None or one of {DEDUP_MODES}")
     max_file_size_bytes = max_file_size * TO_BYTE_FACTORS[max_file_size_unit]
 
-    def combine_pdf_from_comp_names_iter(comp_name: str):
-        """
-        Sort the input filenames: the latest prospectus and sorted inquery letters from earliest to latest
-        """
-        out_filenames = []
-
-        prospectus_filenames = glob.glob(os.path.join(prospectus_dir, f"{comp_name}", "*.pdf"))
-        if len(prospectus_filenames) == 0:
-            # Ignore companies without any propectus
-            return out_filenames
-
-        prospectus_filenames.sort(key=compare_key_func_prospectus_filename, reverse=True)
-        # if len(prospectus_filenames) > 1:
-        #     print(prospectus_filenames)
-        out_filenames.append(prospectus_filenames[0])
-
-        inquery_filenames = glob.glob(os.path.join(inquery_dir, f"{comp_name}", "*.pdf"))
-        if len(inquery_filenames) == 0:
-            # Ignore companies without any inquery letters
-            return []
-        inquery_filenames.sort(key=cmp_to_key(compare_inquery_letter_filename))
-        out_filenames += inquery_filenames
-
-        return out_filenames
+    comp_filenames = {comp_name: get_comp_pdf_filenames(comp_name, prospectus_dir, inquery_dir)
+                      for comp_name in comp_names}
+    selections = {}
+    if dedup is not None:
+        selections = plan_dedup(list(comp_filenames.values()), num_workers)
 
+    sources = []
+    for comp_name, filenames in comp_filenames.items():
+        for filename in filenames:
+            selection = selections.get(filename)
+            bytes_saved = 0 if selection is None else sum([elided["bytes_saved"] for elided in selection["elided"]])
+            sources.append({
+                "comp_name": comp_name,
+                "filename": filename,
+                "bytes": max(os.path.getsize(filename) - bytes_saved, 1),
+                "selection": selection,
+            })
 
     if not os.path.isdir(output_dir):
         os.makedirs(output_dir)
-    combined_pdf = fitz.open()
+    manifest_filename = os.path.join(output_dir, f"{out_filename}_manifest.json")
+    parts = plan_pdf_parts(sources, max_file_size_bytes)
+    out_parts = []
+    pbar = tqdm(total=len(sources))
+
+    def get_part_filename(part_num: int):
+        return os.path.join(output_dir, f"{out_filename}_{part_num}.pdf")
+
+    def get_part_args(part: list, part_num: int):
+        return [source["filename"] for source in part], get_part_filename(part_num), \
+            [source["selection"] for source in part], dedup
+
+    def make_manifest(complete: bool):
+        manifest = {
+            "num_parts_planned": len(parts),
+            "complete": complete,
+            "parts": out_parts,
+        }
+        if dedup is not None:
+            manifest["dedup"] = {
+                "mode": dedup,
+                "pages_elided": sum([len(part_iter["elided_pages"]) for part_iter in out_parts]),
+                "estimated_bytes_saved": sum([part_iter["estimated_bytes_saved"] for part_iter in out_parts]),
+            }
+
+        return manifest
+
+    def finish_part(part: list, part_info: dict):
+        out_part = {
+            "part_num": len(out_parts),
+            "filename": get_part_filename(len(out_parts)),
+            "comp_names": list(dict.fromkeys([source["comp_name"] for source in part])),
+            "source_filenames": [source["filename"] for source in part],
+            "pages": part_info["pages"],
+            "bytes": part_info["bytes"],
+        }
+        if dedup is not None:
+            out_part["elided_pages"] = [dict(elided, filename=source["filename"]) for source in part
+                                        if source["selection"] is not None for elided in source["selection"]["elided"]]
+            out_part["estimated_bytes_saved"] = sum([elided["bytes_saved"] for elided in out_part["elided_pages"]])
+        out_parts.append(out_part)
+        save_json(make_manifest(False), manifest_filename)
+        pbar.update(len(part))
+
+    def is_oversize(part: list, part_info: dict):
+        return part_info["bytes"] > max_file_size_bytes and len(part) > 1
+
     part_num = 0
-    cur_out_filename = os.path.join(output_dir, f"{out_filename}_{part_num}.pdf")
+    part_info = None
+    if num_workers > 1:
+        args_all = [get_part_args(part, i) for i, part in enumerate(parts)]
+        with Pool(processes=num_workers) as pool:
+            for part_info in pool.imap(__write_pdf_part_star, args_all):
+                if is_oversize(parts[part_num], part_info):
+                    # The remaining parts are re-planned below; leaving the block terminates the pending writes
+                    break
+                finish_part(parts[part_num], part_info)
+                part_num += 1
+                part_info = None
 
-    for comp_name in tqdm(comp_names):
-        out_filenames_iter = combine_pdf_from_comp_names_iter(comp_name)
-        # print(list(map(lambda filename: os.path.basename(filename), out_filenames_iter)))
-        if len(out_filenames_iter) == 0:
+    while part_num < len(parts):
+        part = parts[part_num]
+        if part_info is None:
+            part_info = write_pdf_part(*get_part_args(part, part_num))
+        if is_oversize(part, part_info):
+            # Size estimate was off: keep the sources that fit at the observed ratio, re-plan the rest
+            ratio = part_info["bytes"] / sum([source["bytes"] for source in part])
+            num_kept = 1
+            kept_bytes = part[0]["bytes"] * ratio
+            while num_kept < len(part) - 1 and kept_bytes + part[num_kept]["bytes"] * ratio <= max_file_size_bytes:
+                kept_bytes += part[num_kept]["bytes"] * ratio
+                num_kept += 1
+            remaining_sources = part[num_kept:] + [source for part_iter in parts[part_num + 1:] for source in part_iter]
+            parts = parts[:part_num] + [part[:num_kept]] + plan_pdf_parts(remaining_sources, max_file_size_bytes)
+            part_info = None
             continue
-        for loc_filename in out_filenames_iter:
-            with fitz.open(loc_filename) as doc:
-                combined_pdf.insert_pdf(doc, from_page=0, to_page=doc.page_count)
-                has_updated_file = update_file(combined_pdf, cur_out_filename, max_file_size_bytes)
-                if not has_updated_file:
-                    combined_pdf.close()
-                    combined_pdf = fitz.open()
-                    combined_pdf.insert_pdf(doc, from_page=0, to_page=doc.page_count)
-                    part_num += 1
-                    cur_out_filename = os.path.join(output_dir, f"{out_filename}_{part_num}.pdf")
+
+        finish_part(part, part_info)
+        part_num += 1
+        part_info = None
+    pbar.close()
+    remove_stale_parts(output_dir, out_filename, len(out_parts))
+
+    save_json(make_manifest(True), manifest_filename)
+    dump_summary()
+
+    return out_parts
@@ -17,7 +17,13 @@ setup(
         "ipywidgets",
         "tqdm",
         "pymupdf",
+        "pyarrow",
         "beautifulsoup4",
         "selenium",
-    ]
+    ],
+    entry_points={
+        "console_scripts": [
+            "ipo-pipeline=IPODataAnalysis.pipeline:main",
+        ],
+    },
 )
@@ -0,0 +1,125 @@
+import pandas as pd
+import os
+
+from IPODataAnalysis.configs import SZSE_TIMELINE_FIELDS
+
+
+# Explicit dtypes of the tables; "datetime" columns are parsed with pd.to_datetime(.)
+TABLE_DTYPES = {
+    "index_page": {
+        "序号": "Int64",
+        "发行人全称": "string",
+        "审核状态": "category",
+        "注册地": "category",
+        "证监会行业": "category",
+        "保荐机构": "string",
+        "律师事务所": "string",
+        "会计师事务所": "string",
+        "更新日期": "datetime",
+        "受理日期": "datetime",
+        "detail_page": "string",
+    },
+    "questions": {
+        "website": "category",
+        "comp": "category",
+        "filename": "string",
+        "round_number": "Int64",
+        "question_num": "Int64",
+        "question": "string",
+        "question_long": "string",
+        "page_from": "Int64",
+        "page_to": "Int64",
+    },
+    "answers": {
+        "website": "category",
+        "comp": "category",
+        "round_number": "Int64",
+        "question_num": "Int64",
+        "answer_entry_num": "Int64",
+        "page": "Int64",
+        "subtitle": "string",
+    },
+}
+TABLE_DTYPES["detailed_info"] = dict(TABLE_DTYPES["index_page"], **{
+    "公司全称": "string",
+    "公司简称": "string",
+}, **{stage: "datetime" for stage in SZSE_TIMELINE_FIELDS})
+
+FILTER_OPS = {
+    "==": lambda col, val: col == val,
+    "!=": lambda col, val: col != val,
+    "<": lambda col, val: col < val,
+    "<=": lambda col, val: col <= val,
+    ">": lambda col, val: col > val,
+    ">=": lambda col, val: col >= val,
+    "in": lambda col, val: col.isin(val),
+}
+
+
+def is_parquet_filename(filename: str):
+    return filename is not None and os.path.splitext(filename)[1].lower() in (".parquet", ".pq")
+
+
+def apply_dtypes(df: pd.DataFrame, table_name: str = None):
+    """
+    Casts the columns of df present in TABLE_DTYPES[table_name]; other columns are kept as they are.
+    ValueError is raised if a value of a "datetime" column can't be parsed, rather than turning it into NaT.
+    """
+    if table_name is None:
+        return df
+    df = df.copy()
+    for col, dtype in TABLE_DTYPES[table_name].items():
+        if col not in df.columns:
+            continue
+        if dtype == "datetime":
+            parsed = pd.to_datetime(df[col], errors="coerce")
+            failed_mask = parsed.isna() & df[col].notna()
+            if failed_mask.any():
+                raise ValueError(f"{table_name}.{col}: {failed_mask.sum()} values aren't dates, e.g. rows "
+                                 f"{df.index[failed_mask][:5].tolist()}: {df.loc[failed_mask, col].head().tolist()}")
+            df[col] = parsed
+        else:
+            df[col] = df[col].astype(dtype)
+
+    return df
+
+
+def save_table(df: pd.DataFrame, filename: str, table_name: str = None, export_csv: bool = False):
+    """
+    Writes df as Parquet or CSV (utf_8_sig) depending on the suffix of filename.
+    table_name: key of TABLE_DTYPES, for the explicit dtypes of Parquet files; CSV files (and the CSV copy) are
+        written from df as it is, i.e. the same as before Parquet support
+    export_csv: also write a CSV copy next to a Parquet file, for analysts
+    """
+    dir_name = os.path.dirname(filename)
+    if len(dir_name) > 0 and not os.path.isdir(dir_name):
+        os.makedirs(dir_name)
+    if is_parquet_filename(filename):
+        apply_dtypes(df, table_name).to_parquet(filename, index=False)
+        if export_csv:
+            df.to_csv(f"{os.path.splitext(filename)[0]}.csv", index=False, encoding="utf_8_sig")
+    else:
+        df.to_csv(filename, index=False, encoding="utf_8_sig")
+
+
+def load_table(filename: str, columns: list = None, filters: list = None, table_name: str = None):
+    """
+    Reads a Parquet or CSV table, only parsing the given columns and keeping the rows matching all the filters.
+    Parquet files are projected and filtered while reading, so e.g. question_long is never parsed when not asked for.
+    filters: [(col, op, val)...], op in FILTER_OPS
+    """
+    if is_parquet_filename(filename):
+        df = pd.read_parquet(filename, columns=columns, filters=filters if filters else None)
+    else:
+        filter_cols = [col for col, _, _ in filters or []]
+        usecols = None if columns is None else list(dict.fromkeys(list(columns) + filter_cols))
+        df = pd.read_csv(filename, usecols=usecols)
+        if filters:
+            mask = pd.Series(True, index=df.index)
+            for col, op, val in filters:
+                mask &= FILTER_OPS[op](df[col], val)
+            df = df[mask].reset_index(drop=True)
+        if columns is not None:
+            df = df[list(columns)]
+
+    return apply_dtypes(df, table_name)
@@ -0,0 +1,10 @@
+import importlib.util
+import sys
+import os
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# The tests import the package as IPODataAnalysis: installed, or from a checkout of the repo named IPODataAnalysis
+if importlib.util.find_spec("IPODataAnalysis") is None:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
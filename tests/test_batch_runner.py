@@ -0,0 +1,77 @@
+import threading
+import pytest
+import json
+import os
+
+from IPODataAnalysis.process_text.batch_runner import run_batch, load_done_ids
+
+
+class EchoClient(object):
+    def __init__(self, fail_on: str = None):
+        self.fail_on = fail_on
+        self.lock = threading.Lock()
+        self.prompts = []
+
+    def get_response(self, prompt: dict):
+        with self.lock:
+            self.prompts.append(prompt)
+        content = prompt["messages"][0]["content"]
+        if content == self.fail_on:
+            # Not JSON serializable: writing the output line fails
+            return {content}
+        return content.upper()
+
+
+def write_prompts(input_filename: str, request_ids: list):
+    with open(input_filename, "w", encoding="utf-8") as wf:
+        for request_id in request_ids:
+            wf.write(json.dumps({"request_id": request_id, "messages": [{"role": "user", "content": request_id}]})
+                     + "\n")
+
+
+def read_records(output_filename: str):
+    with open(output_filename, "r", encoding="utf-8") as rf:
+        return [json.loads(line) for line in rf if len(line.strip()) > 0]
+
+
+def test_resume_after_truncated_line(tmp_path):
+    input_filename = os.path.join(tmp_path, "prompts.jsonl")
+    output_filename = os.path.join(tmp_path, "results.jsonl")
+    write_prompts(input_filename, ["a", "b", "c"])
+    # Crashed while writing b's result
+    with open(output_filename, "w", encoding="utf-8") as wf:
+        wf.write(json.dumps({"request_id": "a", "result": "A"}) + "\n" + '{"request_id": "b", "res')
+
+    client = EchoClient()
+    stats = run_batch(input_filename, output_filename, client, num_workers=2)
+    assert stats["num_skipped"] == 1 and stats["num_done"] == 2
+    assert load_done_ids(output_filename) == {"a", "b", "c"}
+
+    # The truncated line stays on its own: nothing is lost on the next resume
+    stats = run_batch(input_filename, output_filename, client, num_workers=2)
+    assert stats["num_skipped"] == 3
+    assert len(client.prompts) == 2
+
+
+def test_worker_error_raised(tmp_path):
+    input_filename = os.path.join(tmp_path, "prompts.jsonl")
+    output_filename = os.path.join(tmp_path, "results.jsonl")
+    write_prompts(input_filename, ["a", "b", "c"])
+
+    with pytest.raises(TypeError):
+        run_batch(input_filename, output_filename, EchoClient(fail_on="b"), num_workers=1)
+    assert "b" not in load_done_ids(output_filename)
+
+
+def test_failed_prompts_recorded(tmp_path):
+    input_filename = os.path.join(tmp_path, "prompts.jsonl")
+    output_filename = os.path.join(tmp_path, "results.jsonl")
+    write_prompts(input_filename, ["a", "b"])
+
+    class FailingClient(object):
+        def get_response(self, prompt: dict):
+            raise ValueError("bad prompt")
+
+    stats = run_batch(input_filename, output_filename, FailingClient(), num_workers=2)
+    assert stats["num_failed"] == 2
+    assert sorted([record["error"] for record in read_records(output_filename)]) == ["bad prompt"] * 2
@@ -0,0 +1,55 @@
+import logging
+import pandas as pd
+import os
+
+from IPODataAnalysis.download_data.checkpoint import df_to_record, records_to_df, write_shard, load_shards
+from IPODataAnalysis.download_data.retrieve_szse_info import retrieve_all_detail_pages
+
+
+URL = "http://listing.szse.cn/projectdynamic/ipo/detail/index.html?id=1003161"
+
+
+def make_detail_df():
+    return pd.DataFrame({
+        "受理": [pd.Timestamp("2023-06-01")],
+        "公司全称": ["深圳测试科技股份有限公司"],
+        "公司简称": ["测试科技"],
+    })
+
+
+def test_records_round_trip(tmp_path):
+    write_shard(str(tmp_path), [df_to_record(URL, make_detail_df())])
+    records = load_shards(str(tmp_path))
+
+    assert [record["key"] for record in records] == [URL]
+    pd.testing.assert_frame_equal(records_to_df(records), make_detail_df(), check_dtype=False)
+
+
+def test_no_records():
+    assert len(records_to_df([])) == 0
+    assert len(records_to_df(load_shards("no_such_dir"))) == 0
+
+
+def test_retrieve_all_detail_pages_from_checkpoint(tmp_path):
+    # Every page is already in the checkpoint: nothing is retrieved, and no output_dir is needed
+    checkpoint_dir = os.path.join(tmp_path, "checkpoint")
+    index_page_filename = os.path.join(tmp_path, "index_page.csv")
+    index_page_df = pd.DataFrame({"发行人全称": ["深圳测试科技股份有限公司"], "detail_page": [URL]})
+    index_page_df.to_csv(index_page_filename, index=False)
+    write_shard(checkpoint_dir, [df_to_record(URL, make_detail_df())])
+    logger = logging.getLogger("test_checkpoint")
+
+    combined_df = retrieve_all_detail_pages(index_page_filename, str(tmp_path), logger, checkpoint_dir=checkpoint_dir,
+                                            num_processes=1)
+    assert combined_df["公司简称"].tolist() == ["测试科技"]
+
+
+def test_retrieve_all_detail_pages_without_pages(tmp_path):
+    index_page_filename = os.path.join(tmp_path, "index_page.csv")
+    pd.DataFrame({"发行人全称": [], "detail_page": []}).to_csv(index_page_filename, index=False)
+    logger = logging.getLogger("test_checkpoint")
+
+    combined_df = retrieve_all_detail_pages(index_page_filename, str(tmp_path), logger, str(tmp_path),
+                                            num_processes=1)
+    assert len(combined_df) == 0
+    assert os.path.isfile(os.path.join(tmp_path, "detailed_info.csv"))
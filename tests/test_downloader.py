@@ -0,0 +1,100 @@
+import threading
+import requests
+import pytest
+import re
+import os
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from IPODataAnalysis.download_data.utils import download_and_save_file
+from IPODataAnalysis.download_data.downloader import BulkDownloader, download_files, DownloadError
+
+
+CONTENT = bytes(range(256)) * 40
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    /file: CONTENT, honouring "Range: bytes={offset}-" (416 past the end); anything else: 404
+    """
+    def do_GET(self):
+        if self.path != "/file":
+            self.send_error(404)
+            return
+        match = re.fullmatch(r"bytes=([0-9]+)-", self.headers.get("Range", ""))
+        offset = 0 if match is None else int(match.group(1))
+        if offset >= len(CONTENT):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(CONTENT)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = CONTENT[offset:]
+        self.send_response(200 if match is None else 206)
+        if match is not None:
+            self.send_header("Content-Range", f"bytes {offset}-{len(CONTENT) - 1}/{len(CONTENT)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def read_file(filename: str):
+    with open(filename, "rb") as rf:
+        return rf.read()
+
+
+def test_resume_part_file(server_url, tmp_path):
+    save_filename = os.path.join(tmp_path, "a.pdf")
+    with open(f"{save_filename}.part", "wb") as wf:
+        wf.write(CONTENT[:1000])
+
+    assert download_and_save_file(f"{server_url}/file", save_filename) == len(CONTENT) - 1000
+    assert read_file(save_filename) == CONTENT
+    assert not os.path.exists(f"{save_filename}.part")
+
+
+def test_complete_part_file_is_kept(server_url, tmp_path):
+    save_filename = os.path.join(tmp_path, "a.pdf")
+    with open(f"{save_filename}.part", "wb") as wf:
+        wf.write(CONTENT)
+
+    assert download_and_save_file(f"{server_url}/file", save_filename) == 0
+    assert read_file(save_filename) == CONTENT
+    assert not os.path.exists(f"{save_filename}.part")
+
+
+def test_oversize_part_file_is_dropped(server_url, tmp_path):
+    save_filename = os.path.join(tmp_path, "a.pdf")
+    with open(f"{save_filename}.part", "wb") as wf:
+        wf.write(CONTENT + b"garbage")
+
+    with pytest.raises(requests.HTTPError):
+        download_and_save_file(f"{server_url}/file", save_filename)
+    assert not os.path.exists(save_filename)
+    assert not os.path.exists(f"{save_filename}.part")
+    # The next attempt starts over
+    assert download_and_save_file(f"{server_url}/file", save_filename) == len(CONTENT)
+
+
+def test_download_files(server_url, tmp_path):
+    downloader = BulkDownloader(max_workers=2, backoff=0.)
+    items = [(f"{server_url}/file", os.path.join(tmp_path, f"{i}.pdf")) for i in range(3)]
+    results = download_files(items, downloader)
+
+    assert [result["status"] for result in results] == ["downloaded"] * 3
+    assert all([read_file(filename) == CONTENT for _, filename in items])
+    with pytest.raises(DownloadError):
+        download_files([(f"{server_url}/missing", os.path.join(tmp_path, "missing.pdf"))], downloader)
+    downloader.close()
@@ -0,0 +1,163 @@
+import threading
+import pytest
+import json
+import time
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from IPODataAnalysis.process_text import gpt_api
+
+
+EXPIRES_IN = 1000
+REFRESH_MARGIN = 300
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    /token: a new token ("token-{n}") after token_delay seconds
+    /chat?access_token=...: error_code 111 for an outdated token (or error_code for the current one, once), else the
+    prompt's first message echoed after waiting as many seconds as the message says
+    """
+    lock = threading.Lock()
+    num_tokens = 0
+    token_delay = 0.
+    error_code = None
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if url.path == "/token":
+            time.sleep(self.token_delay)
+            with self.lock:
+                StubHandler.num_tokens += 1
+                resp_dict = {"access_token": f"token-{self.num_tokens}", "expires_in": EXPIRES_IN}
+        elif url.path == "/chat":
+            access_token = parse_qs(url.query)["access_token"][0]
+            with self.lock:
+                error_code = 111 if access_token != f"token-{self.num_tokens}" else StubHandler.error_code
+                StubHandler.error_code = None
+            if error_code is not None:
+                resp_dict = {"error_code": error_code, "error_msg": "Access token invalid or no longer valid"}
+            else:
+                content = json.loads(body)["messages"][0]["content"]
+                time.sleep(float(content))
+                resp_dict = {"result": content}
+        else:
+            self.send_error(404)
+            return
+        body = json.dumps(resp_dict).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    # The token's expiry is checked against time.time(): a clock moved by hand
+    now = [1e9]
+    monkeypatch.setattr(gpt_api.time, "time", lambda: now[0])
+
+    return now
+
+
+@pytest.fixture()
+def client():
+    StubHandler.num_tokens = 0
+    StubHandler.token_delay = 0.
+    StubHandler.error_code = None
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    client = gpt_api.ErnieClient("api_key", "secret_key", token_url=f"{base_url}/token",
+                                 model_url=f"{base_url}/chat?access_token={{access_token}}",
+                                 refresh_margin=REFRESH_MARGIN, max_latencies=3)
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def make_prompt(delay: float = 0.):
+    return {"messages": [{"role": "user", "content": str(delay)}]}
+
+
+def test_token_reused_until_refresh_margin(client, clock):
+    assert client.get_response(make_prompt()) == "0.0"
+    clock[0] += EXPIRES_IN - REFRESH_MARGIN - 1
+    client.get_response(make_prompt())
+    assert StubHandler.num_tokens == 1
+
+    clock[0] += 2
+    client.get_response(make_prompt())
+    assert StubHandler.num_tokens == 2
+    assert client.access_token == "token-2"
+
+
+def test_one_refresh_for_concurrent_expiry(client, clock):
+    client.get_response(make_prompt())
+    clock[0] += EXPIRES_IN
+    # Slow enough for every thread to find the token expired before the refresh ends
+    StubHandler.token_delay = 0.2
+    barrier = threading.Barrier(8)
+    results = []
+
+    def run():
+        barrier.wait()
+        results.append(client.get_response(make_prompt()))
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["0.0"] * 8
+    assert StubHandler.num_tokens == 2
+
+
+@pytest.mark.parametrize("error_code", gpt_api.TOKEN_ERROR_CODES)
+def test_token_error_forces_refresh(client, clock, error_code):
+    client.get_response(make_prompt())
+    # Revoked by the server long before it expires
+    StubHandler.error_code = error_code
+
+    assert client.get_response(make_prompt()) == "0.0"
+    assert StubHandler.num_tokens == 2
+    assert client.access_token == "token-2"
+
+
+def test_last_latency_per_thread(client, clock):
+    barrier = threading.Barrier(2)
+    latencies = {}
+
+    def run(delay: float):
+        client.get_response(make_prompt(delay))
+        # Both requests are done before either thread reads its latency
+        barrier.wait()
+        latencies[delay] = client.last_latency
+
+    threads = [threading.Thread(target=run, args=(delay,)) for delay in [0., 0.3]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert latencies[0.3] >= 0.3
+    assert latencies[0.] < 0.3
+    assert client.last_latency is None
+
+
+def test_latency_history_bounded(client, clock):
+    for _ in range(5):
+        client.get_response(make_prompt())
+    stats = client.latency_stats()
+
+    assert stats["chat"]["count"] == 3
+    assert stats["token"]["count"] == 1
+    assert len(client.latencies["chat"]) == 3
@@ -0,0 +1,94 @@
+import pandas as pd
+import pytest
+import os
+
+from conftest import FIXTURE_DIR
+from IPODataAnalysis.download_data.page_parser import make_soup, parse_total_pages, parse_index_table, \
+    parse_timeline, parse_project_info, parse_inquiries_and_replies, parse_latest_prospectus
+
+
+INDEX_URL = "http://listing.szse.cn/projectdynamic/ipo/index.html"
+DETAIL_URL = "http://listing.szse.cn/projectdynamic/ipo/detail/index.html?id=1003161"
+REPLY_TITLE = "关于深圳测试科技股份有限公司首次公开发行股票并在创业板上市申请文件的审核问询函的回复（{}发行人、保荐机构）.pdf"
+SECOND_REPLY_TITLE = "关于深圳测试科技股份有限公司首次公开发行股票并在创业板上市申请文件的第二轮审核问询函的回复（发行人、保荐机构）.pdf"
+
+
+def load_page(filename: str):
+    with open(os.path.join(FIXTURE_DIR, "szse_pages", filename), "r", encoding="utf-8") as rf:
+        return rf.read()
+
+
+def test_parse_index_table():
+    page = load_page("index_page.html")
+    table_df = parse_index_table(page, INDEX_URL)
+
+    assert parse_total_pages(page) == 12
+    assert table_df["序号"].tolist() == [1, 2, 3]
+    assert table_df["发行人全称"].tolist() == ["深圳测试科技股份有限公司", "广州示例电子股份有限公司",
+                                          "东莞样本材料股份有限公司"]
+    assert pd.isna(table_df["审核状态"].iloc[1])
+    assert table_df["detail_page"].tolist()[:2] == [
+        # Relative links are resolved against the page, absolute ones are kept
+        "http://listing.szse.cn/projectdynamic/ipo/detail/index.html?id=1003161",
+        "http://listing.szse.cn/projectdynamic/ipo/detail/index.html?id=1003162",
+    ]
+    # As contains(text(), .): the anchor's first text node is the whitespace before <i>, not the name in the <span>
+    assert pd.isna(table_df["detail_page"].iloc[2])
+
+
+def test_parse_index_table_without_links():
+    table_df = parse_index_table(load_page("index_page.html"), if_retrieve_link=False)
+
+    assert "detail_page" not in table_df.columns
+    assert len(table_df) == 3
+
+
+def test_parse_index_table_keeps_hrefs_without_base_url():
+    table_df = parse_index_table(load_page("index_page.html"))
+
+    assert table_df["detail_page"].iloc[0] == "/projectdynamic/ipo/detail/index.html?id=1003161"
+
+
+def test_parse_detail_page_info():
+    soup = make_soup(load_page("detail_page.html"))
+    timeline_df = parse_timeline(soup)
+    project_info_df = parse_project_info(soup)
+
+    assert timeline_df.columns.tolist() == ["受理", "问询"]
+    assert timeline_df["问询"].iloc[0] == pd.Timestamp("2023-07-01")
+    assert project_info_df.iloc[0].to_dict() == {
+        "公司全称": "深圳测试科技股份有限公司",
+        "公司简称": "测试科技",
+        "审核状态": "已问询",
+        "保荐机构": "测试证券股份有限公司",
+    }
+
+
+def test_parse_inquiries_and_replies():
+    url_dict = parse_inquiries_and_replies(load_page("detail_page.html"), DETAIL_URL)
+
+    # The latest reply of each round: the revised first-round reply is only a <span> (no link), the second-round one
+    # has a relative link. The inquiry itself and the 落实函 reply are left out.
+    assert url_dict == {
+        REPLY_TITLE.format("修订稿）（"): None,
+        SECOND_REPLY_TITLE: "http://listing.szse.cn/reply2.pdf",
+    }
+
+
+def test_parse_inquiries_and_replies_without_table():
+    assert parse_inquiries_and_replies(load_page("detail_page_no_tables.html"), DETAIL_URL) == {}
+    assert parse_inquiries_and_replies("<html><body><div>暂无数据</div></body></html>") == {}
+
+
+def test_parse_latest_prospectus():
+    date_str, url = parse_latest_prospectus(load_page("detail_page.html"), DETAIL_URL)
+
+    assert date_str == "2023-11-15"
+    assert url == "http://listing.szse.cn/p2.pdf"
+
+
+def test_parse_latest_prospectus_without_link():
+    with pytest.raises(ValueError):
+        parse_latest_prospectus(load_page("detail_page_no_tables.html"), DETAIL_URL)
+    with pytest.raises(ValueError):
+        parse_latest_prospectus("<html><body><table><tr><td>发行保荐书</td></tr></table></body></html>")
@@ -0,0 +1,35 @@
+import pytest
+import os
+
+from IPODataAnalysis.process_text.q_and_a_database import create_schema, build_q_and_a_rows, insert_q_and_a_rows, \
+    insert_q_and_a_files
+from IPODataAnalysis.process_text.search_index import search_q_and_a
+
+
+def make_file_rows(filename: str, question: str):
+    q_and_a_entries = [{
+        "question": question,
+        "pages": (3, 4),
+        "question_long": f"{question}，请发行人说明。",
+        "ans_collection": [{"page": 3, "subtitle": f"{question}的回复"}],
+    }]
+    meta_info = {"website": "szse", "comp": "测试科技", "filename": filename, "round_number": 1}
+
+    return build_q_and_a_rows(q_and_a_entries, meta_info)
+
+
+@pytest.fixture()
+def db_filenames(tmp_path):
+    return os.path.join(tmp_path, "q_and_a.db"), None, os.path.join(tmp_path, "index.db")
+
+
+def test_failed_write_not_indexed(db_filenames):
+    q_filename, a_filename, index_filename = db_filenames
+    create_schema(q_filename, a_filename)
+    insert_q_and_a_files([("a.pdf", *make_file_rows("a.pdf", "关于毛利率"))], q_filename, a_filename, index_filename)
+
+    # The key is taken by a.pdf: the write is refused, and the index is left as it was
+    with pytest.raises(ValueError):
+        insert_q_and_a_rows(*make_file_rows("b.pdf", "关于关联交易"), q_filename, a_filename, index_filename)
+    assert search_q_and_a(index_filename, "关联交易") == []
+    assert [res["question"] for res in search_q_and_a(index_filename, "毛利率")] == ["关于毛利率"]
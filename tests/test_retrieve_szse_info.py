@@ -0,0 +1,58 @@
+import os
+
+from conftest import FIXTURE_DIR
+from IPODataAnalysis import metrics
+from IPODataAnalysis.download_data import retrieve_szse_info
+
+
+DETAIL_URL = "http://listing.szse.cn/projectdynamic/ipo/detail/index.html?id=1003161"
+
+
+class FakeElement(object):
+    text = "深圳测试科技股份有限公司"
+
+
+class FakeDriver(object):
+    """
+    Serves tests/fixtures/szse_pages/detail_page.html for any url
+    """
+    def __init__(self):
+        with open(os.path.join(FIXTURE_DIR, "szse_pages", "detail_page.html"), "r", encoding="utf-8") as rf:
+            self.page_source = rf.read()
+        self.current_url = None
+        self.is_quit = False
+
+    def get(self, url: str):
+        self.current_url = url
+
+    def find_element(self, by: str, value: str):
+        return FakeElement()
+
+    def quit(self):
+        self.is_quit = True
+
+
+def test_retrieve_detail_page_timed_once(tmp_path, monkeypatch):
+    drivers = []
+    downloads = []
+
+    def create_driver(headless: bool = False):
+        drivers.append(FakeDriver())
+        return drivers[-1]
+
+    monkeypatch.setattr(retrieve_szse_info, "create_driver", create_driver)
+    monkeypatch.setattr(retrieve_szse_info, "download_files", lambda items, downloader=None: downloads.extend(items))
+    metrics_dir = os.path.join(tmp_path, "metrics")
+    metrics.enable(metrics_dir)
+    try:
+        # Without a driver (created and quit for the page), then with one
+        df_all = retrieve_szse_info.retrieve_detail_page(DETAIL_URL, str(tmp_path))
+        retrieve_szse_info.retrieve_detail_page(DETAIL_URL, str(tmp_path), driver=FakeDriver())
+        summary = metrics.summarize(metrics_dir)
+    finally:
+        metrics.disable()
+
+    assert summary["retrieve_detail_page"]["count"] == 2
+    assert len(drivers) == 1 and drivers[0].is_quit
+    assert df_all["公司简称"].iloc[0] == "测试科技"
+    assert len(downloads) == 4
@@ -0,0 +1,99 @@
+import functools
+import pytest
+import time
+import os
+
+from multiprocessing import Pool
+from selenium.common.exceptions import WebDriverException, TimeoutException
+from IPODataAnalysis.download_data.utils import ReusableDriver, init_worker_driver, get_worker_driver
+
+
+class FakeDriver(object):
+    """
+    Records its creation and its quit() as files in log_dir, so that they can be checked from another process
+    """
+    num_created = 0
+
+    def __init__(self, log_dir: str, headless: bool = False):
+        FakeDriver.num_created += 1
+        self.name = f"{os.getpid()}_{FakeDriver.num_created}"
+        self.log_dir = log_dir
+        self.is_quit = False
+        self.log("created")
+
+    def log(self, event: str):
+        with open(os.path.join(self.log_dir, f"{event}_{self.name}"), "w") as wf:
+            wf.write("")
+
+    def quit(self):
+        self.is_quit = True
+        self.log("quit")
+
+
+def make_reusable_driver(tmp_path, max_pages: int = 50):
+    return ReusableDriver(max_pages=max_pages, driver_factory=functools.partial(FakeDriver, str(tmp_path)))
+
+
+def test_recycled_after_max_pages(tmp_path):
+    reusable_driver = make_reusable_driver(tmp_path, max_pages=2)
+    drivers = []
+    for _ in range(5):
+        with reusable_driver.session() as driver:
+            drivers.append(driver)
+
+    assert [id(driver) for driver in drivers[:2]] == [id(drivers[0])] * 2
+    assert len(set([id(driver) for driver in drivers])) == 3
+    assert [driver.is_quit for driver in drivers] == [True] * 4 + [False]
+    reusable_driver.quit()
+    assert drivers[-1].is_quit
+
+
+def test_crashed_driver_replaced(tmp_path):
+    reusable_driver = make_reusable_driver(tmp_path)
+    with pytest.raises(TimeoutException):
+        with reusable_driver.session() as driver:
+            raise TimeoutException("page not ready")
+    # The page wasn't as expected but the browser is fine: kept
+    with reusable_driver.session() as same_driver:
+        assert same_driver is driver
+    with pytest.raises(WebDriverException):
+        with reusable_driver.session() as same_driver:
+            raise WebDriverException("chrome not reachable")
+
+    assert driver.is_quit
+    with reusable_driver.session() as new_driver:
+        assert new_driver is not driver
+        assert not new_driver.is_quit
+
+
+def use_worker_driver(seconds: float):
+    with get_worker_driver().session():
+        time.sleep(seconds)
+
+
+def wait_for_files(log_dir: str, event: str, num_files: int, timeout: float = 10.):
+    """
+    Returns
+    -------
+    list[int]: pids of the drivers with the event
+    """
+    start_time = time.time()
+    while True:
+        pids = [int(filename.split("_")[1]) for filename in os.listdir(log_dir) if filename.startswith(f"{event}_")]
+        if len(pids) >= num_files or time.time() - start_time > timeout:
+            return pids
+        time.sleep(0.05)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="Pool.terminate() can't be caught on Windows")
+def test_worker_driver_quit_on_terminate(tmp_path):
+    driver_factory = functools.partial(FakeDriver, str(tmp_path))
+    with pytest.raises(RuntimeError):
+        with Pool(processes=2, initializer=init_worker_driver, initargs=(False, 50, driver_factory)) as pool:
+            pool.map_async(use_worker_driver, [30., 30.], chunksize=1)
+            pids = wait_for_files(str(tmp_path), "created", 2)
+            # As if e.g. writing a checkpoint shard failed: the with block terminates the busy workers
+            raise RuntimeError("parent loop failed")
+
+    assert len(pids) == 2
+    assert sorted(wait_for_files(str(tmp_path), "quit", 2)) == sorted(pids)
@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+import os
+
+from IPODataAnalysis.process_text.sqlite_store import migrate_csv_to_sqlite, query_question, read_sqlite_tables
+
+
+FILENAME1 = os.path.join("ipo_doc", "szse", "测试科技", "关于测试科技第二轮审核问询函的回复.pdf")
+FILENAME2 = os.path.join("ipo_doc", "szse", "测试科技", "关于测试科技第二轮审核问询函的回复（修订稿）.pdf")
+
+
+def make_q_row(filename: str, question_num: int, question: str):
+    return {
+        "website": "szse",
+        "comp": "测试科技",
+        "filename": filename,
+        "round_number": 2,
+        "question_num": question_num,
+        "question": question,
+        "question_long": question,
+        "page_from": 1,
+        "page_to": 2,
+    }
+
+
+def make_a_row(question_num: int, answer_entry_num: int, subtitle: str):
+    return {
+        "website": "szse",
+        "comp": "测试科技",
+        "round_number": 2,
+        "question_num": question_num,
+        "answer_entry_num": answer_entry_num,
+        "page": 1,
+        "subtitle": subtitle,
+    }
+
+
+def test_migrate_duplicated_key(tmp_path):
+    # Question 0 is held by both files, the second one with a longer answer list; both files were appended in turn
+    q_df = pd.DataFrame([make_q_row(FILENAME1, 0, "问题一"), make_q_row(FILENAME1, 1, "问题二"),
+                         make_q_row(FILENAME2, 0, "问题一修订")])
+    a_df = pd.DataFrame([make_a_row(0, 0, "回复一"), make_a_row(0, 1, "回复二"), make_a_row(1, 0, "回复三"),
+                         make_a_row(0, 0, "修订回复一"), make_a_row(0, 1, "修订回复二"), make_a_row(0, 2, "修订回复三")])
+    q_filename = os.path.join(tmp_path, "questions.csv")
+    a_filename = os.path.join(tmp_path, "answers.csv")
+    db_filename = os.path.join(tmp_path, "q_and_a.db")
+    q_df.to_csv(q_filename, index=False, encoding="utf_8_sig")
+    a_df.to_csv(a_filename, index=False, encoding="utf_8_sig")
+
+    # Chunks smaller than a file's block, and a second run, mustn't change the result
+    for _ in range(2):
+        migrate_csv_to_sqlite(q_filename, a_filename, db_filename, chunksize=2)
+
+        q_row, a_rows = query_question(db_filename, "szse", "测试科技", 2, 0)
+        assert q_row["filename"] == FILENAME1
+        assert [a_row["subtitle"] for a_row in a_rows] == ["回复一", "回复二"]
+        _, a_rows = query_question(db_filename, "szse", "测试科技", 2, 1)
+        assert [a_row["subtitle"] for a_row in a_rows] == ["回复三"]
+        db_q_df, db_a_df = read_sqlite_tables(db_filename)
+        assert len(db_q_df) == 2
+        assert len(db_a_df) == 3
+
+
+def test_migrate_rejects_old_round_numbers(tmp_path):
+    # Built before rounds were numbered from the file name: every later round was 2
+    filename = os.path.join("ipo_doc", "szse", "测试科技", "关于测试科技第三轮审核问询函的回复.pdf")
+    q_filename = os.path.join(tmp_path, "questions.csv")
+    a_filename = os.path.join(tmp_path, "answers.csv")
+    db_filename = os.path.join(tmp_path, "q_and_a.db")
+    pd.DataFrame([make_q_row(filename, 0, "问题一")]).to_csv(q_filename, index=False, encoding="utf_8_sig")
+    pd.DataFrame([make_a_row(0, 0, "回复一")]).to_csv(a_filename, index=False, encoding="utf_8_sig")
+
+    with pytest.raises(ValueError, match="round_number"):
+        migrate_csv_to_sqlite(q_filename, a_filename, db_filename)
+    assert not os.path.exists(db_filename)
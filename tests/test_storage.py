@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+import os
+
+from IPODataAnalysis.storage import save_table, load_table, apply_dtypes
+from IPODataAnalysis.download_data.retrieve_szse_info import merge_detail_pages
+
+
+def make_index_page_df():
+    return pd.DataFrame({
+        "序号": [1, 2],
+        "发行人全称": ["深圳测试科技股份有限公司", "广州示例电子股份有限公司"],
+        "审核状态": ["已受理", "已问询"],
+        "更新日期": ["2023-11-11", "2023-11-12"],
+        "受理日期": ["2023-06-01", None],
+        "detail_page": ["http://x/?id=1", "http://x/?id=2"],
+    })
+
+
+def test_csv_written_as_is(tmp_path):
+    df = make_index_page_df()
+    save_table(df, os.path.join(tmp_path, "typed.csv"), "index_page")
+    df.to_csv(os.path.join(tmp_path, "plain.csv"), index=False, encoding="utf_8_sig")
+
+    with open(os.path.join(tmp_path, "typed.csv"), "rb") as rf_typed, \
+            open(os.path.join(tmp_path, "plain.csv"), "rb") as rf_plain:
+        assert rf_typed.read() == rf_plain.read()
+
+
+def test_parquet_dtypes_and_csv_copy(tmp_path):
+    df = make_index_page_df()
+    save_table(df, os.path.join(tmp_path, "index_page.parquet"), "index_page", export_csv=True)
+
+    parquet_df = load_table(os.path.join(tmp_path, "index_page.parquet"))
+    assert str(parquet_df["审核状态"].dtype) == "category"
+    assert pd.api.types.is_datetime64_any_dtype(parquet_df["更新日期"])
+    assert parquet_df["受理日期"].isna().tolist() == [False, True]
+    with open(os.path.join(tmp_path, "index_page.csv"), "rb") as rf:
+        assert rf.read() == df.to_csv(index=False, encoding="utf_8_sig").encode("utf_8_sig")
+
+
+def test_unparsable_date_raises():
+    df = make_index_page_df()
+    df.loc[1, "更新日期"] = "待定"
+
+    with pytest.raises(ValueError, match="更新日期"):
+        apply_dtypes(df, "index_page")
+
+
+def test_merge_detail_pages_has_no_suffixed_columns():
+    detail_all_df = pd.DataFrame({
+        "受理": [pd.Timestamp("2023-06-01")],
+        "公司全称": ["深圳测试科技股份有限公司"],
+        "公司简称": ["测试科技"],
+        "审核状态": ["已问询"],
+        "受理日期": [None],
+    })
+    combined_df = merge_detail_pages(make_index_page_df(), detail_all_df)
+
+    assert not any([col.endswith(("_x", "_y", "_detail")) for col in combined_df.columns])
+    assert len(combined_df) == 1
+    # The detail page's value where it has one, else the index page's
+    assert combined_df["审核状态"].iloc[0] == "已问询"
+    assert combined_df["受理日期"].iloc[0] == "2023-06-01"
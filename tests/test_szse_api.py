@@ -0,0 +1,133 @@
+import threading
+import pytest
+import json
+import os
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from conftest import FIXTURE_DIR
+from IPODataAnalysis.download_data import szse_api
+
+
+# The JSON endpoints are served from tests/fixtures/szse_api by a local stub server:
+#   /api/ras/projectrends/query?pageIndex=i -> query_{i}.json
+#   /api/ras/projectrends/details?id=x -> details_{x}.json
+#   /files/*.pdf -> the path as bytes
+
+API_PATH = "/api/ras/projectrends"
+API_FIXTURE_DIR = os.path.join(FIXTURE_DIR, "szse_api")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.requests_seen.append((url.path, query))
+        if url.path == f"{API_PATH}/query":
+            fixture_filename = f"query_{query['pageIndex']}.json"
+        elif url.path == f"{API_PATH}/details":
+            fixture_filename = f"details_{query['id']}.json"
+        elif url.path.startswith("/files/"):
+            self.send_body(url.path.encode("utf-8"), "application/pdf")
+            return
+        else:
+            fixture_filename = None
+        if fixture_filename is None or not os.path.isfile(os.path.join(API_FIXTURE_DIR, fixture_filename)):
+            self.send_error(404)
+            return
+        with open(os.path.join(API_FIXTURE_DIR, fixture_filename), "rb") as rf:
+            self.send_body(rf.read(), "application/json;charset=utf-8")
+
+    def send_body(self, body: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def stub_url(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    # Document paths are resolved against the document server
+    monkeypatch.setattr(szse_api, "SZSE_DOC_BASE_URL", base_url)
+    StubHandler.requests_seen = []
+    yield base_url
+    server.shutdown()
+    server.server_close()
+
+
+def load_fixture(filename: str):
+    with open(os.path.join(API_FIXTURE_DIR, filename), "r", encoding="utf-8") as rf:
+        return json.load(rf)
+
+
+def test_get_project_list():
+    assert szse_api.get_project_list("https://listing.szse.cn/projectdynamic/ipo/index.html") == "ipo"
+    assert szse_api.get_project_list("http://listing.szse.cn/projectdynamic/refinance/index.html") == "refinance"
+    with pytest.raises(ValueError):
+        szse_api.get_project_list("http://listing.szse.cn/disclosure/index.html")
+
+
+def test_retrieve_index_table_http(stub_url, tmp_path):
+    table_df = szse_api.retrieve_index_table_http(str(tmp_path), page_size=2, api_url=f"{stub_url}{API_PATH}")
+
+    assert table_df["序号"].tolist() == [1, 2, 3]
+    assert table_df["发行人全称"].tolist() == ["深圳测试科技股份有限公司", "广州示例电子股份有限公司",
+                                          "东莞样本材料股份有限公司"]
+    assert table_df["detail_page"].iloc[0] == "http://listing.szse.cn/projectdynamic/ipo/detail/index.html?id=1003161"
+    assert os.path.isfile(os.path.join(tmp_path, "index_page.csv"))
+    query_params = [query for path, query in StubHandler.requests_seen if path == f"{API_PATH}/query"]
+    assert [query["pageIndex"] for query in query_params] == ["0", "1"]
+    assert set([query["bizType"] for query in query_params]) == {"1"}
+
+
+def test_retrieve_index_table_http_follows_index_url(stub_url):
+    table_df = szse_api.retrieve_index_table_http(page_size=2, api_url=f"{stub_url}{API_PATH}",
+                                                  index_url="http://listing.szse.cn/projectdynamic/refinance/"
+                                                            "index.html")
+
+    assert set([query["bizType"] for path, query in StubHandler.requests_seen]) == {"2"}
+    assert table_df["detail_page"].str.contains("/projectdynamic/refinance/detail/").all()
+
+
+def test_retrieve_detail_page_http(stub_url, tmp_path):
+    page_url = "http://listing.szse.cn/projectdynamic/ipo/detail/index.html?id=1003161"
+    df_all = szse_api.retrieve_detail_page_http(page_url, str(tmp_path), api_url=f"{stub_url}{API_PATH}")
+
+    assert len(df_all) == 1
+    assert df_all["公司简称"].iloc[0] == "测试科技"
+    assert df_all["受理"].iloc[0].strftime("%Y-%m-%d") == "2023-06-01"
+    assert "上市委会议" not in df_all.columns
+    # The latest reply of each round by the issuer and the sponsor; the inquiry and the 落实函 reply are left out
+    details = load_fixture("details_1003161.json")["data"]
+    expected = {doc["dfnm"]: doc["dfpth"] for doc in details["enquiryResponseAttachment"]
+                if doc["dfpth"] in ["/files/reply1.pdf", "/files/reply2.pdf"]}
+    comp_dir = os.path.join(tmp_path, "测试科技")
+    assert sorted(os.listdir(comp_dir)) == sorted(expected)
+    for filename, path in expected.items():
+        with open(os.path.join(comp_dir, filename), "rb") as rf:
+            assert rf.read() == path.encode("utf-8")
+
+
+def test_retrieve_latest_prospectus_http(stub_url, tmp_path):
+    page_url = "http://listing.szse.cn/projectdynamic/ipo/detail/index.html?id=1003161"
+    szse_api.retrieve_latest_prospectus_http(page_url, str(tmp_path), api_url=f"{stub_url}{API_PATH}")
+
+    assert os.listdir(tmp_path) == ["招股说明书_2023-11-15.pdf"]
+    with open(os.path.join(tmp_path, "招股说明书_2023-11-15.pdf"), "rb") as rf:
+        assert rf.read() == b"/files/prospectus_1115.pdf"
+
+
+def test_missing_project(stub_url):
+    with pytest.raises(Exception):
+        szse_api.retrieve_project_details("http://listing.szse.cn/projectdynamic/ipo/detail/index.html?id=1",
+                                          api_url=f"{stub_url}{API_PATH}")
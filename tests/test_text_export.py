@@ -0,0 +1,78 @@
+import gzip
+import json
+import pytest
+import os
+
+from IPODataAnalysis.process_text import text_export
+
+
+COMP_NAMES = ["测试科技", "示例电子", "样本材料"]
+
+
+def make_pdf(filename: str, text: str, num_pages: int = 2):
+    import fitz
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    doc = fitz.open()
+    for page_idx in range(num_pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"{text} {page_idx}")
+    doc.save(filename)
+    doc.close()
+
+
+@pytest.fixture()
+def source_dirs(tmp_path):
+    prospectus_dir = os.path.join(tmp_path, "prospectus")
+    inquery_dir = os.path.join(tmp_path, "inquery")
+    for comp_idx, comp_name in enumerate(COMP_NAMES):
+        make_pdf(os.path.join(prospectus_dir, comp_name, "招股说明书_2023-06-01.pdf"), f"prospectus {comp_idx}")
+        make_pdf(os.path.join(inquery_dir, comp_name, "审核问询函的回复.pdf"), f"reply {comp_idx}")
+
+    return prospectus_dir, inquery_dir
+
+
+def list_parts(output_dir: str):
+    return sorted([filename for filename in os.listdir(output_dir) if filename.startswith("corpus_")
+                   and not filename.endswith("manifest.json")])
+
+
+def test_rerun_removes_stale_parts(source_dirs, tmp_path):
+    output_dir = os.path.join(tmp_path, "export")
+    # One source per part, then everything in one part
+    out = text_export.export_text_from_comp_names(COMP_NAMES, *source_dirs, output_dir, max_file_size=1,
+                                                  max_file_size_unit="B")
+    assert len(out["parts"]) == 6
+    out = text_export.export_text_from_comp_names(COMP_NAMES, *source_dirs, output_dir)
+
+    assert list_parts(output_dir) == ["corpus_0.jsonl.gz"]
+    with gzip.open(os.path.join(output_dir, "corpus_0.jsonl.gz"), "rt", encoding="utf-8") as rf:
+        rows = [json.loads(line) for line in rf]
+    assert len(rows) == out["parts"][0]["pages"] == 12
+
+
+def test_interrupted_part_not_published(source_dirs, tmp_path, monkeypatch):
+    output_dir = os.path.join(tmp_path, "export")
+    render_source_text = text_export.render_source_text
+    rendered_sources = []
+
+    def render_then_fail(source: dict, *args):
+        if len(rendered_sources) == 3:
+            raise KeyboardInterrupt
+        rendered_sources.append(source)
+        return render_source_text(source, *args)
+
+    source = {"comp_name": COMP_NAMES[0], "filename": os.path.join(source_dirs[1], COMP_NAMES[0], "审核问询函的回复.pdf"),
+              "doc_idx": 1, "doc_type": "inquiry_reply"}
+    source_bytes = len(render_source_text(source)["data"])
+    monkeypatch.setattr(text_export, "render_source_text", render_then_fail)
+    with pytest.raises(KeyboardInterrupt):
+        # Two sources per part: the second part is cut short
+        text_export.export_text_from_comp_names(COMP_NAMES, *source_dirs, output_dir, max_file_size=2.5 * source_bytes,
+                                                max_file_size_unit="B")
+
+    assert list_parts(output_dir) == ["corpus_0.jsonl.gz", "corpus_1.jsonl.gz.tmp"]
+    with open(os.path.join(output_dir, "corpus_manifest.json"), "r", encoding="utf-8") as rf:
+        manifest = json.load(rf)
+    assert [part["part_num"] for part in manifest["parts"]] == [0]
+    assert not manifest["complete"]
@@ -0,0 +1,19 @@
+import json
+import os
+
+from IPODataAnalysis.utils import save_json
+
+
+def test_save_json(tmp_path):
+    filename = os.path.join(tmp_path, "out", "data.json")
+    save_json({"b": "测试", "a": 1}, filename)
+    with open(filename, "r", encoding="utf-8") as rf:
+        text = rf.read()
+
+    assert "测试" in text and "\n  " in text
+    assert os.listdir(os.path.dirname(filename)) == ["data.json"]
+
+    # Any json.dump(.) argument goes through, and overrides the defaults
+    save_json({"b": "测试", "a": 1}, filename, sort_keys=True, indent=None, ensure_ascii=True)
+    with open(filename, "r", encoding="utf-8") as rf:
+        assert rf.read() == json.dumps({"a": 1, "b": "测试"})
@@ -1,6 +1,6 @@
-import fitz
 import logging
 import datetime as dt
+import json
 import os
 
 
@@ -42,7 +42,24 @@ def make_directories(filename: str):
         os.makedirs(dir_name)
 
 
+def save_json(data, filename: str, **kwargs):
+    """
+    Writes to a temporary file first, then renames it: readers (and an interrupted run) never see a partly written
+    file.
+    kwargs: passed to json.dump(.), by default ensure_ascii=False and indent=2
+    """
+    dir_name = os.path.dirname(filename)
+    if len(dir_name) > 0 and not os.path.isdir(dir_name):
+        os.makedirs(dir_name)
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, "w", encoding="utf-8") as wf:
+        json.dump(data, wf, **dict({"ensure_ascii": False, "indent": 2}, **kwargs))
+    os.replace(temp_filename, filename)
+
+
 def combine_pdfs(out_filename: str, *filenames):
+    import fitz
+
     doc_out = fitz.open()
     for filename in filenames:
         doc_iter = fitz.open(filename)